@@ -1,33 +1,144 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, g, Response, stream_with_context
 import sqlite3
-from datetime import datetime, time
+from datetime import datetime, time, timedelta
 import re
-import cv2
-import numpy as np
-from deepface import DeepFace
+import csv
+import io
+import click
+from time import perf_counter
 import os
 from werkzeug.utils import secure_filename
+from concurrent.futures import ThreadPoolExecutor
+import archive
+import models
+import face_store
+import live_feed
+import metrics
+from cache import cache as dashboard_cache
+import provisional
+import queries
+import summary
+from verification_pool import pool as verification_pool, PoolBusy, verify_faces_task, identify_task, prewarm_task, store_embedding_task
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key_here'
 
+# Enrollment images are kept in the face store (face_store.py); static/uploads is where
+# older versions saved them, until gc-face-store deletes what is left there
 UPLOAD_FOLDER = 'static/uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
+# How long process_attendance waits for a verification before handing the page a job id to poll
+app.config['VERIFY_WAIT_SECONDS'] = float(os.environ.get('VERIFY_WAIT_SECONDS', '5'))
+
+# Capture settings for mark_attendance: face crops are sent at the recognizer input size
+# (224 px for VGG-Face), full frames are downscaled to FRAME_MAX_WIDTH
+app.config['FACE_CROP_SIZE'] = int(os.environ.get('FACE_CROP_SIZE', '224'))
+app.config['FRAME_MAX_WIDTH'] = int(os.environ.get('FRAME_MAX_WIDTH', '320'))
+
+# Kiosk mode (lecturer-run 1:N identification): group photos need more pixels per face,
+# and a whole-hall frame takes longer to identify than a single check-in
+app.config['KIOSK_FRAME_MAX_WIDTH'] = int(os.environ.get('KIOSK_FRAME_MAX_WIDTH', '1280'))
+app.config['KIOSK_WAIT_SECONDS'] = float(os.environ.get('KIOSK_WAIT_SECONDS', '30'))
+
+# Opt-in audit mode: keep rejected check-in frames, outside the static folder
+app.config['AUDIT_REJECTED_FRAMES'] = os.environ.get('AUDIT_REJECTED_FRAMES') == '1'
+app.config['AUDIT_FOLDER'] = os.environ.get('AUDIT_FOLDER', 'audit_frames')
+
+if app.config['AUDIT_REJECTED_FRAMES'] and not os.path.exists(app.config['AUDIT_FOLDER']):
+    os.makedirs(app.config['AUDIT_FOLDER'])
+
+# Writes audit frames off the verification path
+audit_executor = ThreadPoolExecutor(max_workers=1)
+
+# Idle SQLite connections shared by the request threads of this worker
+db_pool = models.ConnectionPool(int(os.environ.get('DB_POOL_SIZE', '8')))
 
 def get_db_connection():
-    conn = sqlite3.connect('attendance.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Return the connection of the current request, taking one from the pool on first use"""
+    if 'db' not in g:
+        g.db = db_pool.acquire()
+        # Statement counters of the pooled connection when this request got it
+        g.sql_start = (g.db.queries, g.db.query_seconds)
+    return g.db
+
+@app.teardown_appcontext
+def release_db_connection(exception):
+    conn = g.pop('db', None)
+    if conn is not None:
+        db_pool.release(conn)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        queries, sql_seconds = 0, 0.0
+        if 'db' in g:
+            queries = g.db.queries - g.sql_start[0]
+            sql_seconds = g.db.query_seconds - g.sql_start[1]
+        metrics.observe_request(request.endpoint or 'unmatched', request.method, response.status_code,
+                                perf_counter() - started, queries, sql_seconds)
+    return response
 
 def validate_student_email(email):
     """Validate student email format: 8 digits followed by @dut4life.ac.za"""
     pattern = r'^\d{8}@dut4life\.ac\.za$'
     return bool(re.match(pattern, email))
 
+def parse_email_list(text):
+    """Emails from a CSV file or pasted list, lower-cased and in order; other CSV fields are ignored"""
+    tokens = re.split(r'[\s,;]+', text)
+    return [token.strip('"\'').lower() for token in tokens if '@' in token]
+
+def bulk_enroll(conn, module_id, emails):
+    """Enroll many students in a module in one transaction.
+
+    Returns lists of emails: added, already_enrolled, unknown (no student
+    account) and invalid (not a student email). Emails repeated in the list
+    are handled once.
+    """
+    result = {'added': [], 'already_enrolled': [], 'unknown': [], 'invalid': []}
+    valid = []
+    for email in dict.fromkeys(emails):
+        (valid if validate_student_email(email) else result['invalid']).append(email)
+    
+    # Resolve every email in one query through a temporary table (no limit on the number of emails)
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS import_emails (position INTEGER PRIMARY KEY, email TEXT NOT NULL)')
+    try:
+        conn.execute('DELETE FROM temp.import_emails')
+        conn.executemany('INSERT INTO temp.import_emails (email) VALUES (?)', [(email,) for email in valid])
+        rows = conn.execute('''SELECT ie.email, s.id AS student_id, sm.student_id IS NOT NULL AS enrolled
+                               FROM temp.import_emails ie
+                               LEFT JOIN students s ON s.email = ie.email
+                               LEFT JOIN student_modules sm ON sm.module_id = ? AND sm.student_id = s.id
+                               ORDER BY ie.position''', (module_id,)).fetchall()
+        
+        new_ids = []
+        for row in rows:
+            if row['student_id'] is None:
+                result['unknown'].append(row['email'])
+            elif row['enrolled']:
+                result['already_enrolled'].append(row['email'])
+            else:
+                result['added'].append(row['email'])
+                new_ids.append(row['student_id'])
+        
+        conn.executemany('INSERT INTO student_modules (student_id, module_id) VALUES (?, ?)',
+                         [(student_id, module_id) for student_id in new_ids])
+        summary.add_enrollments(conn, module_id, new_ids)
+        conn.execute('DELETE FROM temp.import_emails')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    if new_ids:
+        dashboard_cache.invalidate(conn, f'module:{module_id}', *[f'student:{student_id}' for student_id in new_ids])
+    return result
+
 def validate_lecturer_email(email):
     """Validate lecturer email format: must end with @dut.ac.za"""
     pattern = r'^[a-zA-Z0-9._%+-]+@dut\.ac\.za$'
@@ -41,49 +152,51 @@ def hash_password(password):
     import hashlib
     return hashlib.sha256(password.encode()).hexdigest()
 
-def verify_face(image_path, student_id):
-    """Compare uploaded face with registered face in database"""
+def refresh_face_embedding(student_id, face_image):
+    """Precompute the embedding of a newly registered face image in the background.
+
+    Failures are not fatal: the embedding is computed lazily on the first check-in instead.
+    """
     try:
-        # Get the registered face path from database
-        conn = get_db_connection()
-        student = conn.execute('SELECT face_image FROM students WHERE id = ?', (student_id,)).fetchone()
-        conn.close()
-        
-        if not student or not student['face_image']:
-            return False, "No registered face found"
-        
-        # Check if registered face image exists
-        if not os.path.exists(student['face_image']):
-            return False, "Registered face image not found"
-        
-        # Check if uploaded image exists
-        if not os.path.exists(image_path):
-            return False, "Uploaded image not found"
-        
-        try:
-            result = DeepFace.verify(
-                img1_path=student['face_image'], 
-                img2_path=image_path,
-                model_name='VGG-Face',
-                detector_backend='opencv' 
-            )
-            return result['verified'], f"Distance: {result['distance']:.4f}"
-        except Exception as e:
-            return False, f"Face comparison error: {str(e)}"
-            
+        verification_pool.submit(store_embedding_task, student_id, face_image)
     except Exception as e:
-        return False, f"Verification error: {str(e)}"
+        app.logger.warning(f"Could not precompute face embedding for student {student_id}: {e}")
+
+# Seconds between embedding pre-warms for the same student
+PREWARM_INTERVAL = 300
+
+def prewarm_embedding(student_id, sessions):
+    """Have an inference process check the student's embedding while they can still check in.
+
+    A missing or outdated embedding (new face image, model upgrade) is then
+    recomputed before the capture instead of during it.
+    """
+    if not any(not row['marked'] for row in sessions):
+        return
+    now = datetime.now().timestamp()
+    if now - session.get('prewarmed_at', 0) < PREWARM_INTERVAL:
+        return
+    try:
+        verification_pool.submit(prewarm_task, student_id)
+        session['prewarmed_at'] = now
+    except PoolBusy:
+        # Check-ins come first; the embedding is still computed on demand
+        pass
 
 def has_face_image(student_id):
-    """Check if student has a face image registered"""
+    """Check if student has a face image registered (the face store keeps the file while face_hash points at it)"""
     conn = get_db_connection()
-    student = conn.execute('SELECT face_image FROM students WHERE id = ?', (student_id,)).fetchone()
-    conn.close()
-    
-    if student and student['face_image']:
-        # Check if the file actually exists
-        return os.path.exists(student['face_image'])
-    return False
+    student = conn.execute('SELECT face_hash FROM students WHERE id = ?', (student_id,)).fetchone()
+    return bool(student and student['face_hash'])
+
+def replace_face_image(conn, student_id, path, digest):
+    """Point a student at a stored enrollment image and delete their previous one if nobody else uses it"""
+    old = conn.execute('SELECT face_hash FROM students WHERE id = ?', (student_id,)).fetchone()
+    conn.execute('UPDATE students SET face_image = ?, face_hash = ? WHERE id = ?', (path, digest, student_id))
+    conn.commit()
+    if old and old['face_hash'] and old['face_hash'] != digest:
+        face_store.release(conn, old['face_hash'])
+    refresh_face_embedding(student_id, path)
 
 @app.route('/')
 def index():
@@ -115,8 +228,6 @@ def login():
             user = conn.execute('SELECT * FROM lecturers WHERE email = ?', (email,)).fetchone()
             dashboard_route = 'lecturer_dashboard'
         
-        conn.close()
-        
         if user and user['password'] == hash_password(password):
             session['user_id'] = user['id']
             session['user_type'] = user_type
@@ -156,21 +267,31 @@ def register():
                 return render_template('register.html')
             
             # Handle face image upload
-            face_image_path = None
+            face_image_path = face_hash = None
             if 'face_image' in request.files:
                 file = request.files['face_image']
                 if file and allowed_file(file.filename):
-                    filename = secure_filename(f"student_{email}_{file.filename}")
-                    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                    file.save(filepath)
-                    face_image_path = filepath
+                    image_data = file.read()
+                    ok, reason = verification_pool.check_frame(image_data)
+                    if ok:
+                        try:
+                            face_image_path, face_hash = face_store.save(verification_pool.normalize_image(image_data),
+                                                                         normalize_image=False)
+                        except ValueError as e:
+                            reason = str(e)
+                    if not face_hash:
+                        flash(f'Face image not saved: {reason}. You can upload another one after logging in.', 'warning')
             
             try:
-                conn.execute('INSERT INTO students (name, surname, email, course, Faculty, password, face_image) VALUES (?, ?, ?, ?, ?, ?, ?)',
-                             (name, surname, email, course, Faculty, hash_password(password), face_image_path))
+                cursor = conn.execute('INSERT INTO students (name, surname, email, course, Faculty, password, face_image, face_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                      (name, surname, email, course, Faculty, hash_password(password), face_image_path, face_hash))
                 conn.commit()
+                if face_image_path:
+                    refresh_face_embedding(cursor.lastrowid, face_image_path)
                 flash('Student registration successful! Please login.', 'success')
             except sqlite3.IntegrityError:
+                if face_hash:
+                    face_store.release(conn, face_hash)
                 flash('Email already exists!', 'error')
         
         else:  # lecturer
@@ -188,7 +309,6 @@ def register():
             except sqlite3.IntegrityError:
                 flash('Email already exists!', 'error')
         
-        conn.close()
         return redirect(url_for('login'))
     
     return render_template('register.html')
@@ -210,16 +330,20 @@ def upload_face():
             return redirect(url_for('upload_face'))
         
         if file and allowed_file(file.filename):
-            filename = secure_filename(f"student_{session['email']}_{file.filename}")
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
+            image_data = file.read()
+            ok, reason = verification_pool.check_frame(image_data)
+            if not ok:
+                flash(reason, 'error')
+                return redirect(url_for('upload_face'))
             
-            # Update student record with face image path
-            conn = get_db_connection()
-            conn.execute('UPDATE students SET face_image = ? WHERE id = ?', 
-                         (filepath, session['user_id']))
-            conn.commit()
-            conn.close()
+            try:
+                filepath, digest = face_store.save(verification_pool.normalize_image(image_data), normalize_image=False)
+            except ValueError as e:
+                flash(str(e), 'error')
+                return redirect(url_for('upload_face'))
+            
+            # Update student record with the stored image
+            replace_face_image(get_db_connection(), session['user_id'], filepath, digest)
             
             flash('Face image uploaded successfully!', 'success')
             return redirect(url_for('student_dashboard'))
@@ -233,8 +357,11 @@ def lecturer_dashboard():
         return redirect(url_for('login'))
     
     conn = get_db_connection()
-    modules = conn.execute('SELECT * FROM modules WHERE lecturer_id = ?', (session['user_id'],)).fetchall()
-    conn.close()
+    lecturer_id = session['user_id']
+    modules = dashboard_cache.get(
+        conn, ('lecturer_dashboard', lecturer_id),
+        lambda: conn.execute('SELECT * FROM modules WHERE lecturer_id = ?', (lecturer_id,)).fetchall(),
+        tags=[f'lecturer:{lecturer_id}'])
     
     return render_template('lecturer_dashboard.html', modules=modules)
 
@@ -243,27 +370,36 @@ def student_dashboard():
     if 'user_id' not in session or session['user_type'] != 'student':
         return redirect(url_for('login'))
     
-    
     if not has_face_image(session['user_id']):
         flash('Please register your face image for attendance marking.', 'warning')
         return redirect(url_for('upload_face'))
     
     conn = get_db_connection()
+    student_id = session['user_id']
 
-    modules = conn.execute('''
-        SELECT m.*, 
-               (SELECT COUNT(*) FROM sessions WHERE module_id = m.id) as total_sessions,
-               COUNT(a.id) as attended_sessions
-        FROM modules m
-        JOIN student_modules sm ON m.id = sm.module_id
-        LEFT JOIN attendance a ON m.id = a.module_id AND a.student_id = ? AND a.status = 'Present'
-        WHERE sm.student_id = ?
-        GROUP BY m.id
-    ''', (session['user_id'], session['user_id'])).fetchall()
+    # Stale once the student's attendance or enrollments change, or a session is added to one of the modules
+    modules = dashboard_cache.get(
+        conn, ('student_dashboard', student_id),
+        lambda: queries.student_modules_with_attendance(conn, student_id),
+        tags=lambda modules: [f'student:{student_id}'] + [f"sessions:{module['id']}" for module in modules])
+    # Depends on the time, so not cached (one indexed lookup)
+    open_sessions = queries.open_sessions(conn, student_id)
+    prewarm_embedding(student_id, open_sessions)
     
-    conn.close()
+    return render_template('student_dashboard.html', modules=modules, open_sessions=open_sessions)
+
+# Sessions the student can check into right now, for the dashboard and mobile clients
+@app.route('/student/open_sessions')
+def student_open_sessions():
+    if 'user_id' not in session or session['user_type'] != 'student':
+        return jsonify({'success': False, 'message': 'Not authorized'}), 401
     
-    return render_template('student_dashboard.html', modules=modules)
+    open_sessions = queries.open_sessions(get_db_connection(), session['user_id'])
+    prewarm_embedding(session['user_id'], open_sessions)
+    return jsonify({'success': True, 'sessions': [
+        dict(row, marked=bool(row['marked']),
+             mark_url=url_for('mark_attendance_page', module_id=row['module_id'], session_id=row['id']))
+        for row in open_sessions]})
 
 # Add Module (Lecturer)
 @app.route('/add_module', methods=['GET', 'POST'])
@@ -281,10 +417,10 @@ def add_module():
             conn.execute('INSERT INTO modules (name, code, Faculty, lecturer_id) VALUES (?, ?, ?, ?)',
                          (name, code, Faculty, session['user_id']))
             conn.commit()
+            dashboard_cache.invalidate(conn, f"lecturer:{session['user_id']}")
             flash('Module added successfully!', 'success')
         except sqlite3.IntegrityError:
             flash('Module code already exists!', 'error')
-        conn.close()
         
         return redirect(url_for('lecturer_dashboard'))
     
@@ -301,22 +437,39 @@ def module_detail(module_id):
     # Get module details
     module = conn.execute('SELECT * FROM modules WHERE id = ?', (module_id,)).fetchone()
 
-    students = conn.execute('''
-        SELECT s.*, sm.final_mark,
-               (SELECT COUNT(*) FROM sessions WHERE module_id = ?) as total_sessions,
-               COUNT(a.id) as attended_sessions
-        FROM students s
-        JOIN student_modules sm ON s.id = sm.student_id
-        LEFT JOIN attendance a ON s.id = a.student_id AND a.module_id = ? AND a.status = 'Present'
-        WHERE sm.module_id = ?
-        GROUP BY s.id
-    ''', (module_id, module_id, module_id)).fetchall()
+    def load():
+        # One read snapshot, so the live feed starts exactly after the rows counted on the page
+        conn.execute('BEGIN')
+        students = queries.module_students_with_attendance(conn, module_id)
+        live_after = live_feed.latest_attendance_id(conn)
+        conn.commit()
+        sessions = conn.execute('SELECT * FROM sessions WHERE module_id = ? ORDER BY session_date DESC, start_time DESC', (module_id,)).fetchall()
+        return students, live_after, sessions
 
-    sessions = conn.execute('SELECT * FROM sessions WHERE module_id = ? ORDER BY session_date DESC, start_time DESC', (module_id,)).fetchall()
+    students, live_after, sessions = dashboard_cache.get(conn, ('module_detail', module_id), load,
+                                                         tags=[f'module:{module_id}'])
     
-    conn.close()
+    # Not cached: the outcomes of provisional check-ins change as the reverifier works through them
+    provisional_report = provisional.module_report(conn, module_id)
     
-    return render_template('module_detail.html', module=module, students=students, sessions=sessions)
+    return render_template('module_detail.html', module=module, students=students, sessions=sessions, live_after=live_after,
+                           provisional=provisional_report)
+
+# Live attendance feed for module_detail (server-sent events, one message per new attendance row)
+@app.route('/module/<int:module_id>/live')
+def live_attendance(module_id):
+    if 'user_id' not in session or session['user_type'] != 'lecturer':
+        return jsonify({'success': False, 'message': 'Not authorized'}), 403
+    
+    # EventSource sends Last-Event-ID when it reconnects
+    after_id = request.headers.get('Last-Event-ID', type=int) or request.args.get('after', 0, type=int)
+    response = Response(stream_with_context(live_feed.events(db_pool, module_id, after_id,
+                                                             request.args.get('session_id', type=int))),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Don't let nginx buffer the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 # Update final mark for a student
 @app.route('/module/<int:module_id>/update_mark/<int:student_id>', methods=['POST'])
@@ -335,7 +488,7 @@ def update_final_mark(module_id, student_id):
         conn.execute('UPDATE student_modules SET final_mark = ? WHERE student_id = ? AND module_id = ?',
                      (final_mark, student_id, module_id))
         conn.commit()
-        conn.close()
+        dashboard_cache.invalidate(conn, f'module:{module_id}')
         
         flash('Final mark updated successfully!', 'success')
     except ValueError:
@@ -373,12 +526,148 @@ def add_student_to_module(module_id):
             # Enroll student
             conn.execute('INSERT INTO student_modules (student_id, module_id) VALUES (?, ?)',
                          (student['id'], module_id))
+            summary.add_enrollment(conn, student['id'], module_id)
             conn.commit()
+            dashboard_cache.invalidate(conn, f'module:{module_id}', f"student:{student['id']}")
             flash('Student added to module successfully!', 'success')
     
-    conn.close()
     return redirect(url_for('module_detail', module_id=module_id))
 
+def csv_line(row):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(row)
+    return buffer.getvalue()
+
+def stream_csv(rows, filename):
+    """CSV download written row by row as the generator produces them"""
+    response = Response(stream_with_context(csv_line(row) for row in rows), mimetype='text/csv')
+    response.headers['Content-Disposition'] = f'attachment; filename="{secure_filename(filename)}"'
+    return response
+
+def pooled_rows(generate, *args):
+    # The export outlives the view function, so it holds its own pooled connection until the last row
+    conn = db_pool.acquire()
+    try:
+        yield from generate(conn, *args)
+    finally:
+        db_pool.release(conn)
+
+def archived_rows(conn, generate, *args):
+    # Like pooled_rows, for a reporting connection with the term archives attached
+    try:
+        yield from generate(conn, *args)
+    finally:
+        conn.close()
+
+def register_rows(generate, *args):
+    """Rows of a register export, including the archived terms when the URL has include_archived=1"""
+    if request.args.get('include_archived') == '1':
+        return archived_rows(archive.reporting_connection(), generate, *args)
+    return pooled_rows(generate, *args)
+
+def faculty_register(conn, faculty):
+    """The registers of every module of a faculty, one module after the other, with a module code column"""
+    modules = conn.execute('SELECT id, code FROM modules WHERE Faculty = ? ORDER BY code', (faculty,))
+    for module in modules:
+        # The first row of each register is its header
+        for i, row in enumerate(queries.attendance_register(conn, module['id'])):
+            yield ['Module' if i == 0 else module['code']] + row
+        yield []
+
+# Attendance register export (Lecturer)
+@app.route('/module/<int:module_id>/export')
+def export_module(module_id):
+    if 'user_id' not in session or session['user_type'] != 'lecturer':
+        return redirect(url_for('login'))
+    
+    module = get_db_connection().execute('SELECT code FROM modules WHERE id = ?', (module_id,)).fetchone()
+    if not module:
+        flash('Module not found!', 'error')
+        return redirect(url_for('lecturer_dashboard'))
+    
+    rows = register_rows(queries.attendance_register, module_id)
+    suffix = '_all_terms' if request.args.get('include_archived') == '1' else ''
+    return stream_csv(rows, f"{module['code']}_attendance{suffix}.csv")
+
+@app.route('/export/faculty')
+def export_faculty():
+    if 'user_id' not in session or session['user_type'] != 'lecturer':
+        return redirect(url_for('login'))
+    
+    lecturer = get_db_connection().execute('SELECT Faculty FROM lecturers WHERE id = ?', (session['user_id'],)).fetchone()
+    rows = register_rows(faculty_register, lecturer['Faculty'])
+    suffix = '_all_terms' if request.args.get('include_archived') == '1' else ''
+    return stream_csv(rows, f"{lecturer['Faculty']}_attendance{suffix}.csv")
+
+# Bulk enrollment from a class list (Lecturer)
+@app.route('/module/<int:module_id>/bulk_enroll', methods=['POST'])
+def bulk_enroll_students(module_id):
+    if 'user_id' not in session or session['user_type'] != 'lecturer':
+        return redirect(url_for('login'))
+    
+    text = request.form.get('student_emails', '')
+    file = request.files.get('class_list')
+    if file and file.filename:
+        text += '\n' + file.read().decode('utf-8-sig', errors='replace')
+    
+    emails = parse_email_list(text)
+    if not emails:
+        flash('No student emails found in the list!', 'error')
+        return redirect(url_for('module_detail', module_id=module_id))
+    
+    result = bulk_enroll(get_db_connection(), module_id, emails)
+    
+    flash(f"Enrolled {len(result['added'])} students, {len(result['already_enrolled'])} were already enrolled.", 'success')
+    if result['unknown']:
+        flash(f"No account found for {len(result['unknown'])} emails: {', '.join(result['unknown'][:10])}"
+              f"{' ...' if len(result['unknown']) > 10 else ''}", 'warning')
+    if result['invalid']:
+        flash(f"Skipped {len(result['invalid'])} invalid student emails: {', '.join(result['invalid'][:10])}"
+              f"{' ...' if len(result['invalid']) > 10 else ''}", 'error')
+    
+    return redirect(url_for('module_detail', module_id=module_id))
+
+# Longest series a single recurring session form may create
+MAX_RECURRING_SESSIONS = 200
+
+def parse_dates(text):
+    """Set of YYYY-MM-DD dates found in free text (the excluded holidays field)"""
+    return {datetime.strptime(token, '%Y-%m-%d').date() for token in re.findall(r'\d{4}-\d{2}-\d{2}', text)}
+
+def recurring_dates(first, until, interval_weeks, excluded=()):
+    """Dates from first to until (inclusive), every interval_weeks weeks, skipping excluded dates"""
+    dates = []
+    current = first
+    while current <= until:
+        if current not in excluded:
+            dates.append(current)
+        current += timedelta(weeks=interval_weeks)
+    return dates
+
+def create_sessions(conn, module_id, dates, start_time, end_time):
+    """Insert one session per date in a single transaction, skipping dates that clash with an existing session.
+
+    Returns (created, conflicts); conflicts are the dates where the module
+    already has a session overlapping start_time - end_time.
+    """
+    dates = sorted(dates)
+    existing = conn.execute('''SELECT session_date FROM sessions
+                               WHERE module_id = ? AND session_date BETWEEN ? AND ?
+                                 AND start_time < ? AND end_time > ?''',
+                            (module_id, dates[0].isoformat(), dates[-1].isoformat(), end_time, start_time)).fetchall()
+    clashing = {row['session_date'] for row in existing}
+    
+    rows = [(module_id, day.isoformat(), start_time, end_time) for day in dates if day.isoformat() not in clashing]
+    conflicts = [day for day in dates if day.isoformat() in clashing]
+    conn.executemany('INSERT INTO sessions (module_id, session_date, start_time, end_time) VALUES (?, ?, ?, ?)', rows)
+    # Dashboard totals are updated once for the whole batch
+    if rows:
+        summary.add_sessions(conn, module_id, len(rows))
+    conn.commit()
+    if rows:
+        dashboard_cache.invalidate(conn, f'module:{module_id}', f'sessions:{module_id}')
+    return len(rows), conflicts
+
 # Create Session (Lecturer)
 @app.route('/module/<int:module_id>/create_session', methods=['GET', 'POST'])
 def create_session(module_id):
@@ -389,14 +678,40 @@ def create_session(module_id):
         session_date = request.form['session_date']
         start_time = request.form['start_time']
         end_time = request.form['end_time']
+        repeat = request.form.get('repeat', 'none')
         
-        conn = get_db_connection()
-        conn.execute('INSERT INTO sessions (module_id, session_date, start_time, end_time) VALUES (?, ?, ?, ?)',
-                     (module_id, session_date, start_time, end_time))
-        conn.commit()
-        conn.close()
+        if end_time <= start_time:
+            flash('End time must be after the start time!', 'error')
+            return render_template('create_session.html', module_id=module_id)
+        
+        try:
+            first = datetime.strptime(session_date, '%Y-%m-%d').date()
+            if repeat == 'none':
+                dates = [first]
+            else:
+                until = datetime.strptime(request.form['repeat_until'], '%Y-%m-%d').date()
+                interval_weeks = 2 if repeat == 'biweekly' else 1
+                dates = recurring_dates(first, until, interval_weeks, parse_dates(request.form.get('excluded_dates', '')))
+        except (KeyError, ValueError):
+            flash('Please enter valid dates (YYYY-MM-DD)!', 'error')
+            return render_template('create_session.html', module_id=module_id)
+        
+        if not dates:
+            flash('No session dates in the selected range!', 'error')
+            return render_template('create_session.html', module_id=module_id)
+        if len(dates) > MAX_RECURRING_SESSIONS:
+            flash(f'A series can have at most {MAX_RECURRING_SESSIONS} sessions!', 'error')
+            return render_template('create_session.html', module_id=module_id)
+        
+        created, conflicts = create_sessions(get_db_connection(), module_id, dates, start_time, end_time)
+        
+        if conflicts:
+            flash(f"Skipped {len(conflicts)} date(s) that clash with an existing session: "
+                  f"{', '.join(day.isoformat() for day in conflicts)}", 'warning')
+        if not created:
+            return render_template('create_session.html', module_id=module_id)
         
-        flash('Session created successfully!', 'success')
+        flash('Session created successfully!' if created == 1 else f'{created} sessions created successfully!', 'success')
         return redirect(url_for('module_detail', module_id=module_id))
     
     return render_template('create_session.html', module_id=module_id)
@@ -419,28 +734,19 @@ def student_module(module_id):
         flash('You are not enrolled in this module!', 'error')
         return redirect(url_for('student_dashboard'))
 
-    module = conn.execute('SELECT * FROM modules WHERE id = ?', (module_id,)).fetchone()
-    
-    attendance = conn.execute('''
-        SELECT s.id, s.session_date, s.start_time, s.end_time, a.status, a.attendance_time
-        FROM sessions s
-        LEFT JOIN attendance a ON s.id = a.session_id AND a.student_id = ?
-        WHERE s.module_id = ?
-        ORDER BY s.session_date DESC, s.start_time DESC
-    ''', (session['user_id'], module_id)).fetchall()
-
-    attendance_stats = conn.execute('''
-        SELECT 
-            (SELECT COUNT(*) FROM sessions WHERE module_id = ?) as total_sessions,
-            COUNT(a.id) as attended_sessions
-        FROM attendance a
-        JOIN sessions s ON a.session_id = s.id
-        WHERE a.student_id = ? AND s.module_id = ? AND a.status = 'Present'
-    ''', (module_id, session['user_id'], module_id)).fetchone()
-    
-    conn.close()
+    student_id = session['user_id']
+
+    def load():
+        module = conn.execute('SELECT * FROM modules WHERE id = ?', (module_id,)).fetchone()
+        return (module,) + tuple(queries.student_module_attendance(conn, student_id, module_id))
+
+    module, attendance, attendance_stats = dashboard_cache.get(
+        conn, ('student_module', student_id, module_id), load,
+        tags=[f'student:{student_id}', f'sessions:{module_id}'])
     
-    return render_template('student_module.html', module=module, attendance=attendance, attendance_stats=attendance_stats)
+    # The cached rows carry starts_at / ends_at; which sessions are open is decided per request
+    return render_template('student_module.html', module=module, attendance=attendance, attendance_stats=attendance_stats,
+                           now=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
 
 @app.route('/mark_attendance/<int:module_id>/<int:session_id>')
 def mark_attendance_page(module_id, session_id):
@@ -458,31 +764,43 @@ def mark_attendance_page(module_id, session_id):
     
     if existing:
         flash('Attendance already marked for this session!', 'info')
-        conn.close()
         return redirect(url_for('student_module', module_id=module_id))
     
     session_details = conn.execute('SELECT * FROM sessions WHERE id = ?', (session_id,)).fetchone()
-    conn.close()
     
     if not session_details:
         flash('Session not found!', 'error')
         return redirect(url_for('student_module', module_id=module_id))
     
-    current_datetime = datetime.now()
-    session_date = datetime.strptime(session_details['session_date'], '%Y-%m-%d').date()
-    session_start = datetime.strptime(session_details['start_time'], '%H:%M').time()
-    session_end = datetime.strptime(session_details['end_time'], '%H:%M').time()
-    
-    if current_datetime.date() != session_date:
-        flash('Attendance can only be marked on the session date!', 'error')
+    error = session_time_error(session_details)
+    if error:
+        flash(error, 'error')
         return redirect(url_for('student_module', module_id=module_id))
     
-    current_time = current_datetime.time()
-    if not (session_start <= current_time <= session_end):
-        flash('Attendance can only be marked during the session time!', 'error')
-        return redirect(url_for('student_module', module_id=module_id))
+    return render_template('mark_attendance.html', module_id=module_id, session_id=session_id,
+                           face_crop_size=app.config['FACE_CROP_SIZE'], frame_max_width=app.config['FRAME_MAX_WIDTH'])
+
+def session_time_error(session_details):
+    """Why attendance can't be marked for a session right now, or None"""
+    # starts_at / ends_at are 'YYYY-MM-DD HH:MM:SS' strings, which compare in time order
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    
+    if session_details['session_date'] != now[:10]:
+        return 'Attendance can only be marked on the session date!'
     
-    return render_template('mark_attendance.html', module_id=module_id, session_id=session_id)
+    if not (session_details['starts_at'] <= now <= session_details['ends_at']):
+        return 'Attendance can only be marked during the session time!'
+    return None
+
+def is_valid_face_box(face_box):
+    """Check the 'x,y,w,h' box sent with a client-side face crop"""
+    if not face_box:
+        return False
+    try:
+        x, y, w, h = [float(v) for v in face_box.split(',')]
+    except ValueError:
+        return False
+    return x >= 0 and y >= 0 and w > 0 and h > 0
 
 @app.route('/process_attendance/<int:module_id>/<int:session_id>', methods=['POST'])
 def process_attendance(module_id, session_id):
@@ -497,30 +815,266 @@ def process_attendance(module_id, session_id):
         return jsonify({'success': False, 'message': 'No image selected'})
     
     if file and allowed_file(file.filename):
-        filename = secure_filename(f"attendance_{session['user_id']}_{session_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg")
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        # The frame stays in memory and is decoded by the face worker
+        image_data = file.read()
         
-        is_verified, result = verify_face(filepath, session['user_id'])
+        # The page may send just the face, cropped by the browser's face detector
+        face_crop = is_valid_face_box(request.form.get('face_box'))
         
-        if is_verified:
-            
-            conn = get_db_connection()
-            conn.execute('INSERT INTO attendance (student_id, module_id, session_id, status, attendance_time) VALUES (?, ?, ?, ?, ?)',
-                         (session['user_id'], module_id, session_id, 'Present', datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        # Cheap checks first: dark, blurry or face-less frames are rejected without using the recognizer
+        ok, reason = verification_pool.check_frame(image_data, face_crop)
+        if not ok:
+            if app.config['AUDIT_REJECTED_FRAMES']:
+                audit_executor.submit(save_audit_frame, image_data, session['user_id'], session_id, f"precheck: {reason}")
+            return jsonify({'success': False, 'rejected': True, 'message': reason})
+        
+        student_id = session['user_id']
+        # Overloaded: take the check-in now and verify the stored frame once the backlog has drained
+        if provisional.PROVISIONAL_WAIT_SECONDS:
+            provisional.reverifier.start()
+        if provisional.should_defer(verification_pool):
+            return jsonify(provisional.record(get_db_connection(), student_id, module_id, session_id, image_data, face_crop))
+        try:
+            job = verification_pool.submit_batched(
+                verify_faces_task, (image_data, student_id, face_crop),
+                on_done=lambda job: finish_attendance_job(job, student_id, module_id, session_id, image_data)
+            )
+        except PoolBusy as e:
+            if provisional.PROVISIONAL_WAIT_SECONDS:
+                return jsonify(provisional.record(get_db_connection(), student_id, module_id, session_id, image_data, face_crop))
+            response = jsonify({'success': False, 'busy': True, 'retry_after': e.retry_after, 'message': str(e)})
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response, 503
+        
+        conn = get_db_connection()
+        conn.execute('INSERT OR IGNORE INTO verification_jobs (id, student_id, module_id, session_id) VALUES (?, ?, ?, ?)',
+                     (job.id, student_id, module_id, session_id))
+        conn.commit()
+        
+        if job.wait(app.config['VERIFY_WAIT_SECONDS']):
+            return jsonify(job.outcome)
+        
+        # Still queued: the page polls for the result instead of holding this worker
+        return jsonify({'success': False, 'pending': True, 'job_id': job.id,
+                        'poll_url': url_for('verification_status', job_id=job.id),
+                        'message': 'Verifying your face, please wait...'}), 202
+    
+    return jsonify({'success': False, 'message': 'Invalid file format'})
+
+def finish_attendance_job(job, student_id, module_id, session_id, image_data):
+    """Record the outcome of a verification job (runs on a verification pool thread)"""
+    # A pooled connection: check-ins don't pay the connect and pragma cost
+    conn = db_pool.acquire()
+    try:
+        if job.error:
+            job.outcome = {'success': False, 'message': f'Face verification failed. Please try again. (Error: {job.error})'}
+        elif job.result['verified']:
+            attendance_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            try:
+                conn.execute('INSERT INTO attendance (student_id, module_id, session_id, status, attendance_time) VALUES (?, ?, ?, ?, ?)',
+                             (student_id, module_id, session_id, 'Present', attendance_time))
+                summary.record_attendance(conn, student_id, module_id, attendance_time)
+                job.outcome = {'success': True, 'message': 'Attendance marked successfully!', 'marked': True}
+            except sqlite3.IntegrityError:
+                # A second capture for the same session (unique index on student and session)
+                job.outcome = {'success': True, 'message': 'Attendance already marked for this session!'}
+        else:
+            job.outcome = {'success': False, 'message': f"Face verification failed. Please try again. (Error: {job.result['message']})"}
+    
+        conn.execute('''INSERT OR REPLACE INTO verification_jobs (id, student_id, module_id, session_id, status, success, message, finished_at)
+                        VALUES (?, ?, ?, ?, 'done', ?, ?, ?)''',
+                     (job.id, student_id, module_id, session_id, job.outcome['success'], job.outcome['message'],
+                      datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        if job.outcome.pop('marked', False):
+            # Commits the attendance with the cache generation bump, in one transaction
+            dashboard_cache.invalidate(conn, f'module:{module_id}', f'student:{student_id}')
+            live_feed.notify()
+        else:
             conn.commit()
-            conn.close()
-            
-            os.remove(filepath)
-            
-            return jsonify({'success': True, 'message': 'Attendance marked successfully!'})
+    finally:
+        db_pool.release(conn)
+    
+    if app.config['AUDIT_REJECTED_FRAMES'] and not job.outcome['success']:
+        audit_executor.submit(save_audit_frame, image_data, student_id, session_id, job.outcome['message'])
+
+def save_audit_frame(image_data, student_id, session_id, reason):
+    """Keep a rejected check-in frame, and why it was rejected next to it, for later review (audit mode only)"""
+    path = os.path.join(app.config['AUDIT_FOLDER'],
+                        f"rejected_{student_id}_{session_id}_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}")
+    with open(f"{path}.jpg", 'wb') as f:
+        f.write(image_data)
+    with open(f"{path}.txt", 'w', encoding='utf-8') as f:
+        f.write(f"{reason}\n")
+
+@app.route('/verification/<job_id>')
+def verification_status(job_id):
+    if 'user_id' not in session or session['user_type'] != 'student':
+        return jsonify({'success': False, 'message': 'Not authorized'})
+    
+    conn = get_db_connection()
+    job = conn.execute('SELECT * FROM verification_jobs WHERE id = ? AND student_id = ?',
+                       (job_id, session['user_id'])).fetchone()
+    
+    if not job:
+        return jsonify({'success': False, 'message': 'Verification not found'}), 404
+    
+    if job['status'] != 'done':
+        return jsonify({'success': False, 'pending': True, 'job_id': job_id, 'message': 'Verifying your face, please wait...'}), 202
+    
+    return jsonify({'success': bool(job['success']), 'message': job['message']})
+
+
+# Kiosk mode (Lecturer): identify every enrolled student in a frame or group photo
+@app.route('/module/<int:module_id>/session/<int:session_id>/kiosk')
+def kiosk(module_id, session_id):
+    if 'user_id' not in session or session['user_type'] != 'lecturer':
+        return redirect(url_for('login'))
+    
+    conn = get_db_connection()
+    module = conn.execute('SELECT * FROM modules WHERE id = ?', (module_id,)).fetchone()
+    session_details = conn.execute('SELECT * FROM sessions WHERE id = ? AND module_id = ?', (session_id, module_id)).fetchone()
+    
+    if not module or not session_details:
+        flash('Session not found!', 'error')
+        return redirect(url_for('lecturer_dashboard'))
+    
+    error = session_time_error(session_details)
+    if error:
+        flash(error, 'error')
+        return redirect(url_for('module_detail', module_id=module_id))
+    
+    return render_template('kiosk.html', module=module, session_details=session_details,
+                           frame_max_width=app.config['KIOSK_FRAME_MAX_WIDTH'])
+
+@app.route('/module/<int:module_id>/session/<int:session_id>/kiosk/identify', methods=['POST'])
+def kiosk_identify(module_id, session_id):
+    if 'user_id' not in session or session['user_type'] != 'lecturer':
+        return jsonify({'success': False, 'message': 'Not authorized'})
+    
+    file = request.files.get('face_image')
+    if not file or not allowed_file(file.filename):
+        return jsonify({'success': False, 'message': 'No image uploaded'})
+    
+    conn = get_db_connection()
+    session_details = conn.execute('SELECT * FROM sessions WHERE id = ? AND module_id = ?', (session_id, module_id)).fetchone()
+    error = session_time_error(session_details) if session_details else 'Session not found!'
+    if error:
+        return jsonify({'success': False, 'message': error})
+    
+    try:
+        job = verification_pool.submit(identify_task, module_id, file.read(),
+                                       on_done=lambda job: finish_kiosk_job(job, module_id, session_id))
+    except PoolBusy as e:
+        response = jsonify({'success': False, 'busy': True, 'retry_after': e.retry_after, 'message': str(e)})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 503
+    
+    if job.wait(app.config['KIOSK_WAIT_SECONDS']):
+        return jsonify(job.outcome)
+    
+    # Attendance is still written by finish_kiosk_job once the job is done
+    return jsonify({'success': False, 'pending': True,
+                    'message': 'Still identifying this frame, matched students will be marked when it finishes'}), 202
+
+def finish_kiosk_job(job, module_id, session_id):
+    """Mark every identified student present in one transaction (runs on a verification pool thread)"""
+    if job.error:
+        job.outcome = {'success': False, 'message': f'Identification failed. Please try again. (Error: {job.error})'}
+        return
+    
+    faces = job.result['faces']
+    conn = db_pool.acquire()
+    try:
+        student_ids = [face['student_id'] for face in faces if face['student_id'] is not None]
+        names = {}
+        if student_ids:
+            placeholders = ','.join('?' * len(student_ids))
+            names = {row['id']: f"{row['name']} {row['surname']}" for row in
+                     conn.execute(f'SELECT id, name, surname FROM students WHERE id IN ({placeholders})', student_ids)}
+    
+        attendance_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        marked = 0
+        confirmed_frames = []
+        for face in faces:
+            if face['student_id'] is None:
+                face['status'] = 'Unknown'
+                continue
+            face['name'] = names.get(face['student_id'])
+            cursor = conn.execute('INSERT OR IGNORE INTO attendance (student_id, module_id, session_id, status, attendance_time) VALUES (?, ?, ?, ?, ?)',
+                                  (face['student_id'], module_id, session_id, 'Present', attendance_time))
+            if cursor.rowcount:
+                summary.record_attendance(conn, face['student_id'], module_id, attendance_time)
+                face['status'] = 'Marked present'
+                marked += 1
+                continue
+            # A provisional check-in still waiting for re-verification is confirmed by the identification
+            frames = provisional.confirm(conn, face['student_id'], module_id, session_id, attendance_time,
+                                         'Identified by the kiosk')
+            if frames is None:
+                face['status'] = 'Already marked'
+                continue
+            confirmed_frames.extend(frames)
+            face['status'] = 'Marked present'
+            marked += 1
+        if marked:
+            # Commits the attendance with the cache generation bump, in one transaction
+            dashboard_cache.invalidate(conn, f'module:{module_id}',
+                                       *[f"student:{face['student_id']}" for face in faces if face['status'] == 'Marked present'])
+            live_feed.notify()
         else:
-           
-            os.remove(filepath)
-            return jsonify({'success': False, 'message': f'Face verification failed. Please try again. (Error: {result})'})
+            conn.commit()
+        provisional.remove_frames(confirmed_frames)
+    finally:
+        db_pool.release(conn)
     
-    return jsonify({'success': False, 'message': 'Invalid file format'})
+    job.outcome = {'success': True, 'faces': faces, 'marked': marked,
+                   'message': f"{len(faces)} face(s) found, {marked} student(s) marked present"}
+
+# Verification pool readiness, queue metrics and pre-check rejections (used by load balancer health checks)
+@app.route('/health/face')
+def face_engine_health():
+    status = verification_pool.status()
+    return jsonify(status), 200 if status['ready'] else 503
+
+# Dashboard cache size and hit/miss counts of this web worker
+@app.route('/health/cache')
+def cache_health():
+    return jsonify(dashboard_cache.status())
+
+# Prometheus metrics of this web worker: route latency, SQL per request, face pipeline stages
+@app.route('/metrics')
+def prometheus_metrics():
+    pool_status = verification_pool.status()
+    cache_stats = dashboard_cache.status()['stats']
+    extra = {
+        'visited_face_pending': ('gauge', 'Face verification jobs queued or running', pool_status['pending']),
+        'visited_face_completed_total': ('counter', 'Face verification jobs completed', pool_status['stats']['completed']),
+        'visited_face_failed_total': ('counter', 'Face verification jobs failed', pool_status['stats']['failed']),
+        'visited_face_rejected_busy_total': ('counter', 'Check-ins turned away because the queue was full',
+                                             pool_status['stats']['rejected_busy']),
+        'visited_provisional_recorded_total': ('counter', 'Check-ins taken provisionally because verification was overloaded',
+                                               provisional.stats['recorded']),
+        'visited_provisional_confirmed_total': ('counter', 'Provisional check-ins confirmed by re-verification',
+                                                provisional.stats['confirmed']),
+        'visited_provisional_revoked_total': ('counter', 'Provisional check-ins revoked by re-verification',
+                                              provisional.stats['revoked']),
+        'visited_cache_hits_total': ('counter', 'Dashboard cache hits', cache_stats['hits']),
+        'visited_cache_misses_total': ('counter', 'Dashboard cache misses, stale and expired entries',
+                                       cache_stats['misses'] + cache_stats['stale'] + cache_stats['expired']),
+    }
+    return Response(metrics.render(extra), mimetype='text/plain; version=0.0.4')
 
+# Sampling profile of this web worker in folded-stack format, opt-in with PROFILER_ENABLED=1:
+# curl 'localhost:8000/debug/profile?seconds=10' > profile.folded && flamegraph.pl profile.folded > profile.svg
+@app.route('/debug/profile')
+def debug_profile():
+    if not metrics.PROFILER_ENABLED:
+        return Response('Profiler is disabled, set PROFILER_ENABLED=1', status=404, mimetype='text/plain')
+    try:
+        folded = metrics.profile(request.args.get('seconds', 10, type=float))
+    except RuntimeError as e:
+        return Response(str(e), status=409, mimetype='text/plain')
+    return Response(folded, mimetype='text/plain')
 
 @app.route('/logout')
 def logout():
@@ -528,5 +1082,115 @@ def logout():
     flash('You have been logged out successfully.', 'info')
     return redirect(url_for('index'))
 
+# Bulk enrollment from the command line: flask --app app enroll-students MODULE_ID class_list.csv
+@app.cli.command('enroll-students')
+@click.argument('module_id', type=int)
+@click.argument('class_list', type=click.File(encoding='utf-8-sig'))
+def enroll_students_command(module_id, class_list):
+    """Enroll every student email in a CSV file or list in a module"""
+    conn = models.get_connection()
+    if not conn.execute('SELECT 1 FROM modules WHERE id = ?', (module_id,)).fetchone():
+        raise click.ClickException(f"Module {module_id} does not exist")
+    result = bulk_enroll(conn, module_id, parse_email_list(class_list.read()))
+    conn.close()
+    for key in ('unknown', 'invalid'):
+        for email in result[key]:
+            print(f"{key}: {email}")
+    print(', '.join(f"{key.replace('_', ' ')}: {len(emails)}" for key, emails in result.items()))
+
+# Delete enrollment images no student uses any more, and the uploads older versions left in static/uploads
+@app.cli.command('gc-face-store')
+def gc_face_store_command():
+    """Delete unused face store images and leftover static/uploads files"""
+    conn = models.get_connection()
+    removed = face_store.collect_garbage(conn)
+    referenced = {row[0] for row in conn.execute('SELECT face_image FROM students WHERE face_image IS NOT NULL')}
+    conn.close()
+    legacy = 0
+    if os.path.isdir(UPLOAD_FOLDER):
+        for name in os.listdir(UPLOAD_FOLDER):
+            path = os.path.join(UPLOAD_FOLDER, name)
+            if name.startswith('student_') and path not in referenced:
+                os.remove(path)
+                legacy += 1
+    print(f"Removed {removed} face store files and {legacy} old uploads")
+
+# Move a closed semester into archive/<TERM>.db: flask --app app archive-term 2025-S1 2025-01-27 2025-06-20
+@app.cli.command('archive-term')
+@click.argument('term')
+@click.argument('start')
+@click.argument('end')
+@click.option('--no-vacuum', is_flag=True, help="Don't VACUUM the live database afterwards")
+def archive_term_command(term, start, end, no_vacuum):
+    """Archive the sessions dated START..END (YYYY-MM-DD) and their attendance"""
+    conn = models.get_connection()
+    try:
+        counts = archive.archive_term(conn, term, start, end)
+    except (ValueError, RuntimeError) as e:
+        conn.close()
+        raise click.ClickException(str(e))
+    dashboard_cache.invalidate(conn, 'all')
+    if not no_vacuum:
+        conn.execute('VACUUM')
+    conn.close()
+    print(f"Archived {counts['sessions']} sessions, {counts['attendance']} attendance records and "
+          f"{counts['enrollments']} enrollments into {archive.archive_path(term)}")
+
+@app.cli.command('list-archives')
+def list_archives_command():
+    """List the archived terms and what they hold"""
+    for term, path in archive.archived_terms().items():
+        conn = sqlite3.connect(path)
+        info = conn.execute('SELECT start_date, end_date, archived_at FROM archive_info WHERE term = ?', (term,)).fetchone()
+        sessions, attendance = conn.execute('SELECT (SELECT COUNT(*) FROM sessions), (SELECT COUNT(*) FROM attendance)').fetchone()
+        conn.close()
+        dates = f"{info[0]} to {info[1]}, archived {info[2]}" if info else "no archive_info"
+        print(f"{term}: {dates}, {sessions} sessions, {attendance} attendance records, "
+              f"{os.path.getsize(path) / 1024:.0f} KB")
+
+# Verify every pending provisional check-in now, e.g. after a peak: flask --app app reverify-provisional
+@app.cli.command('reverify-provisional')
+def reverify_provisional_command():
+    """Re-verify the pending provisional check-ins in batches"""
+    conn = models.get_connection()
+    totals = {'confirmed': 0, 'revoked': 0}
+    try:
+        while True:
+            counts = provisional.run_batch(conn, verification_pool)
+            if counts is None:
+                break
+            for key in totals:
+                totals[key] += counts[key]
+    finally:
+        verification_pool.shutdown()
+    left = conn.execute("SELECT COUNT(*) FROM provisional_checkins WHERE status = 'pending'").fetchone()[0]
+    conn.close()
+    print(f"Confirmed {totals['confirmed']}, revoked {totals['revoked']}, {left} still pending")
+
+# Maintenance commands: flask --app app rebuild-summary / check-summary
+@app.cli.command('rebuild-summary')
+def rebuild_summary_command():
+    """Recompute the attendance_summary table from scratch"""
+    conn = models.get_connection()
+    rows = summary.rebuild(conn)
+    dashboard_cache.invalidate(conn, 'all')
+    conn.close()
+    print(f"Rebuilt attendance summary: {rows} rows")
+
+@app.cli.command('check-summary')
+def check_summary_command():
+    """Compare attendance_summary with the attendance, sessions and enrollment tables"""
+    conn = models.get_connection()
+    expected_only, stored_only = summary.check(conn)
+    conn.close()
+    for row in expected_only:
+        print(f"Missing or wrong: {tuple(row)}")
+    for row in stored_only:
+        print(f"Unexpected: {tuple(row)}")
+    if expected_only or stored_only:
+        raise SystemExit(f"Attendance summary is inconsistent ({len(expected_only)} missing or wrong, "
+                         f"{len(stored_only)} unexpected), run flask --app app rebuild-summary")
+    print("Attendance summary is consistent")
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,242 @@
+"""Per-term archives of closed semesters.
+
+archive_term() copies a term's sessions and attendance, the enrollments of
+the modules they belong to, and the modules and students they refer to
+into <ARCHIVE_FOLDER>/<term>.db, then deletes the sessions and attendance
+(and enrollments of modules with nothing left in the live database) from
+attendance.db. The live file then only holds the running term, so the
+dashboards, backups and VACUUM stop growing with every semester.
+
+reporting_connection() opens the live database with the archives attached
+read-only and temporary views named sessions, attendance and
+student_modules over all of them, so the register queries in queries.py
+work across terms unchanged.
+"""
+import glob
+import os
+import re
+from datetime import date, datetime
+from urllib.parse import quote
+
+import models
+import summary
+
+ARCHIVE_FOLDER = os.environ.get('ARCHIVE_FOLDER', 'archive')
+# SQLite attaches at most 10 databases by default, reports over more archives copy them in groups
+MAX_ATTACHED = 10
+
+# The archive keeps the row ids of the live database, so archived rows never collide
+ARCHIVE_SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS archive.archive_info
+       (term TEXT PRIMARY KEY,
+        start_date TEXT NOT NULL,
+        end_date TEXT NOT NULL,
+        archived_at TIMESTAMP NOT NULL)''',
+    '''CREATE TABLE IF NOT EXISTS archive.modules
+       (id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        code TEXT NOT NULL,
+        Faculty TEXT NOT NULL,
+        lecturer_id INTEGER NOT NULL)''',
+    '''CREATE TABLE IF NOT EXISTS archive.students
+       (id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        surname TEXT NOT NULL,
+        email TEXT NOT NULL,
+        course TEXT NOT NULL,
+        Faculty TEXT NOT NULL)''',
+    '''CREATE TABLE IF NOT EXISTS archive.student_modules
+       (id INTEGER PRIMARY KEY,
+        student_id INTEGER NOT NULL,
+        module_id INTEGER NOT NULL,
+        final_mark REAL,
+        enrolled_at TIMESTAMP)''',
+    '''CREATE TABLE IF NOT EXISTS archive.sessions
+       (id INTEGER PRIMARY KEY,
+        module_id INTEGER NOT NULL,
+        session_date TEXT NOT NULL,
+        start_time TEXT NOT NULL,
+        end_time TEXT NOT NULL,
+        created_at TIMESTAMP)''',
+    '''CREATE TABLE IF NOT EXISTS archive.attendance
+       (id INTEGER PRIMARY KEY,
+        student_id INTEGER NOT NULL,
+        module_id INTEGER NOT NULL,
+        session_id INTEGER NOT NULL,
+        status TEXT,
+        attendance_time TIMESTAMP,
+        created_at TIMESTAMP)''',
+    'CREATE INDEX IF NOT EXISTS archive.idx_student_modules_module ON student_modules (module_id, student_id)',
+    'CREATE INDEX IF NOT EXISTS archive.idx_sessions_module ON sessions (module_id, session_date)',
+    'CREATE INDEX IF NOT EXISTS archive.idx_attendance_module_student ON attendance (module_id, student_id)',
+)
+
+# Columns the reporting views expose, shared by the live and archived tables
+VIEW_COLUMNS = {
+    'sessions': 'id, module_id, session_date, start_time, end_time',
+    'attendance': 'id, student_id, module_id, session_id, status, attendance_time',
+    'student_modules': 'id, student_id, module_id, final_mark, enrolled_at',
+}
+
+# Sessions of the term and the modules they belong to, in the live database
+TERM_SESSIONS = 'SELECT id FROM main.sessions WHERE session_date BETWEEN :start AND :end'
+TERM_MODULES = 'SELECT DISTINCT module_id FROM main.sessions WHERE session_date BETWEEN :start AND :end'
+
+
+def archive_path(term, folder=ARCHIVE_FOLDER):
+    if not re.fullmatch(r'[A-Za-z0-9_-]+', term):
+        raise ValueError("Term names may only contain letters, digits, '-' and '_'")
+    return os.path.join(folder, f"{term}.db")
+
+
+def archived_terms(folder=ARCHIVE_FOLDER):
+    """Archive files in the folder, as {term: path} in term order"""
+    return {os.path.splitext(os.path.basename(path))[0]: path
+            for path in sorted(glob.glob(os.path.join(folder, '*.db')))}
+
+
+def archive_term(conn, term, start, end, folder=ARCHIVE_FOLDER, today=None):
+    """Move the sessions dated start..end (ISO dates) and their attendance into the term's archive.
+
+    Returns the number of archived sessions, attendance rows and
+    enrollments. The copy is committed and counted before anything is
+    deleted (a transaction over attached WAL databases is not atomic), and
+    running it again for the same term is safe.
+    """
+    start, end = date.fromisoformat(start).isoformat(), date.fromisoformat(end).isoformat()
+    if start > end:
+        raise ValueError("The term starts after it ends")
+    if end >= (today or date.today()).isoformat():
+        raise ValueError("Only a term that has ended can be archived")
+    path = archive_path(term, folder)
+    os.makedirs(folder, exist_ok=True)
+    term_range = {'start': start, 'end': end}
+
+    conn.execute('ATTACH DATABASE ? AS archive', (path,))
+    try:
+        for statement in ARCHIVE_SCHEMA:
+            conn.execute(statement)
+        conn.commit()
+
+        conn.execute('BEGIN')
+        conn.execute(f'''INSERT OR REPLACE INTO archive.sessions
+                         SELECT id, module_id, session_date, start_time, end_time, created_at
+                         FROM main.sessions WHERE id IN ({TERM_SESSIONS})''', term_range)
+        conn.execute(f'''INSERT OR REPLACE INTO archive.attendance
+                         SELECT id, student_id, module_id, session_id, status, attendance_time, created_at
+                         FROM main.attendance WHERE session_id IN ({TERM_SESSIONS})''', term_range)
+        # The enrollment as it stood at the end of the term, final marks included
+        conn.execute(f'''INSERT OR REPLACE INTO archive.student_modules
+                         SELECT id, student_id, module_id, final_mark, enrolled_at
+                         FROM main.student_modules WHERE module_id IN ({TERM_MODULES})''', term_range)
+        conn.execute('''INSERT OR REPLACE INTO archive.modules
+                        SELECT id, name, code, Faculty, lecturer_id FROM main.modules
+                        WHERE id IN (SELECT module_id FROM archive.sessions)''')
+        conn.execute('''INSERT OR REPLACE INTO archive.students
+                        SELECT id, name, surname, email, course, Faculty FROM main.students
+                        WHERE id IN (SELECT student_id FROM archive.student_modules
+                                     UNION SELECT student_id FROM archive.attendance)''')
+        conn.execute('INSERT OR REPLACE INTO archive.archive_info VALUES (?, ?, ?, ?)',
+                     (term, start, end, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        conn.commit()
+
+        # Only delete what the archive now holds
+        for table, where in (('sessions', f'id IN ({TERM_SESSIONS})'),
+                             ('attendance', f'session_id IN ({TERM_SESSIONS})')):
+            live, archived = conn.execute(f'''SELECT COUNT(*), COUNT(a.id) FROM main.{table} t
+                                              LEFT JOIN archive.{table} a ON a.id = t.id
+                                              WHERE t.{where}''', term_range).fetchone()
+            if live != archived:
+                raise RuntimeError(f"{live - archived} {table} rows are missing from {path}, nothing was deleted")
+
+        conn.execute('BEGIN')
+        modules = [row[0] for row in conn.execute(TERM_MODULES, term_range)]
+        attendance = conn.execute(f'DELETE FROM main.attendance WHERE session_id IN ({TERM_SESSIONS})',
+                                  term_range).rowcount
+        conn.execute(f'DELETE FROM main.verification_jobs WHERE session_id IN ({TERM_SESSIONS})', term_range)
+        conn.execute(f'DELETE FROM main.provisional_checkins WHERE session_id IN ({TERM_SESSIONS})', term_range)
+        sessions = conn.execute('DELETE FROM main.sessions WHERE session_date BETWEEN :start AND :end',
+                                term_range).rowcount
+        # Enrollments stay live while their module still has sessions (e.g. a year module), or were made after the term
+        enrollments = 0
+        for module_id in modules:
+            if conn.execute('SELECT 1 FROM main.sessions WHERE module_id = ? LIMIT 1', (module_id,)).fetchone():
+                continue
+            enrollments += conn.execute('''DELETE FROM main.student_modules
+                                           WHERE module_id = ? AND enrolled_at <= ?''',
+                                        (module_id, f"{end} 23:59:59")).rowcount
+        conn.execute('DELETE FROM attendance_summary')
+        summary.populate(conn)
+        conn.commit()
+
+        conn.execute('VACUUM archive')
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        conn.execute('DETACH DATABASE archive')
+    return {'sessions': sessions, 'attendance': attendance, 'enrollments': enrollments}
+
+
+def _attach(conn, paths):
+    schemas = []
+    for i, path in enumerate(paths):
+        conn.execute(f'ATTACH DATABASE ? AS term_{i}', (f"file:{quote(os.path.abspath(path))}?mode=ro",))
+        schemas.append(f"term_{i}")
+    return schemas
+
+
+def _copy_archives(conn, paths):
+    """Copy the reported tables of every archive into temporary archived_<table> tables.
+
+    The archives are attached MAX_ATTACHED at a time. Each row keeps the
+    rank of its term, the most recent term ranking 1.
+    """
+    for table, columns in VIEW_COLUMNS.items():
+        conn.execute(f'CREATE TEMP TABLE archived_{table} AS SELECT {columns}, 0 AS rank FROM main.{table} WHERE 0')
+    for start in range(0, len(paths), MAX_ATTACHED):
+        schemas = _attach(conn, paths[start:start + MAX_ATTACHED])
+        for i, schema in enumerate(schemas):
+            for table, columns in VIEW_COLUMNS.items():
+                conn.execute(f'INSERT INTO temp.archived_{table} SELECT {columns}, ? FROM {schema}.{table}',
+                             (len(paths) - start - i,))
+        conn.commit()
+        for schema in schemas:
+            conn.execute(f'DETACH DATABASE {schema}')
+
+
+def reporting_connection(folder=ARCHIVE_FOLDER):
+    """A connection to the live database where sessions, attendance and student_modules include every archive.
+
+    Archived enrollments only count where the live database has none for
+    the same student and module; the students and modules tables are the
+    live ones. Up to MAX_ATTACHED archives are attached, more are copied
+    into temporary tables a group at a time.
+    """
+    paths = list(archived_terms(folder).values())
+    conn = models.get_connection()
+    try:
+        # (table name format, rank of its enrollments); the live database ranks first
+        sources = [('main.{}', '0')]
+        if len(paths) <= MAX_ATTACHED:
+            schemas = _attach(conn, paths)
+            sources += [(f'{schema}.{{}}', str(rank)) for rank, schema in enumerate(schemas[::-1], start=1)]
+        else:
+            _copy_archives(conn, paths)
+            sources.append(('temp.archived_{}', 'rank'))
+        # Temporary views take precedence over main tables of the same name
+        for table in ('sessions', 'attendance'):
+            columns = VIEW_COLUMNS[table]
+            conn.execute(f'CREATE TEMP VIEW {table} AS '
+                         + ' UNION ALL '.join(f'SELECT {columns} FROM {source.format(table)}'
+                                              for source, _ in sources))
+        # Every term has its own enrollment snapshot, so keep the most recent row per student and module
+        columns = VIEW_COLUMNS['student_modules']
+        ranked = ' UNION ALL '.join(f'SELECT {columns}, {rank} AS rank FROM {source.format("student_modules")}'
+                                    for source, rank in sources)
+        conn.execute(f'''CREATE TEMP VIEW student_modules AS
+                         SELECT {columns}, MIN(rank) AS rank FROM ({ranked}) GROUP BY student_id, module_id''')
+        conn.execute('PRAGMA query_only = ON')
+    except Exception:
+        conn.close()
+        raise
+    return conn
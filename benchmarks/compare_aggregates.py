@@ -0,0 +1,147 @@
+"""Check that the dashboard aggregates in queries.py match the original SQL, and time both.
+
+queries.py reads the attendance_summary table, so this also checks the
+summary after a rebuild.
+
+Usage:
+    python benchmarks/compare_aggregates.py --students 3000 --modules 60
+
+Exits with status 1 if any student or module gets different numbers.
+tests/test_queries.py runs the same comparison on a small database.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models
+import queries
+import seed_data
+import summary
+
+# The queries app.py used before they moved to queries.py
+OLD_STUDENT_DASHBOARD = '''
+    SELECT m.*,
+           (SELECT COUNT(*) FROM sessions WHERE module_id = m.id) as total_sessions,
+           COUNT(a.id) as attended_sessions
+    FROM modules m
+    JOIN student_modules sm ON m.id = sm.module_id
+    LEFT JOIN attendance a ON m.id = a.module_id AND a.student_id = ? AND a.status = 'Present'
+    WHERE sm.student_id = ?
+    GROUP BY m.id
+'''
+
+OLD_MODULE_DETAIL = '''
+    SELECT s.*, sm.final_mark,
+           (SELECT COUNT(*) FROM sessions WHERE module_id = ?) as total_sessions,
+           COUNT(a.id) as attended_sessions
+    FROM students s
+    JOIN student_modules sm ON s.id = sm.student_id
+    LEFT JOIN attendance a ON s.id = a.student_id AND a.module_id = ? AND a.status = 'Present'
+    WHERE sm.module_id = ?
+    GROUP BY s.id
+'''
+
+OLD_STUDENT_MODULE_RECORDS = '''
+    SELECT s.id, s.session_date, s.start_time, s.end_time, a.status, a.attendance_time
+    FROM sessions s
+    LEFT JOIN attendance a ON s.id = a.session_id AND a.student_id = ?
+    WHERE s.module_id = ?
+    ORDER BY s.session_date DESC, s.start_time DESC
+'''
+
+OLD_STUDENT_MODULE_STATS = '''
+    SELECT
+        (SELECT COUNT(*) FROM sessions WHERE module_id = ?) as total_sessions,
+        COUNT(a.id) as attended_sessions
+    FROM attendance a
+    JOIN sessions s ON a.session_id = s.id
+    WHERE a.student_id = ? AND s.module_id = ? AND a.status = 'Present'
+'''
+
+
+def add_edge_cases(conn):
+    """A module without sessions and a student without any attendance"""
+    cursor = conn.execute("INSERT INTO modules (name, code, Faculty, lecturer_id) VALUES ('Empty', 'EMPTY01', 'Bench', 1)")
+    empty_module = cursor.lastrowid
+    conn.executemany('INSERT INTO student_modules (student_id, module_id) VALUES (?, ?)',
+                     [(student_id, empty_module) for student_id in range(1, 51)])
+    conn.execute('DELETE FROM attendance WHERE student_id = 2')
+    conn.commit()
+    summary.rebuild(conn)
+
+
+def rows(result, columns):
+    return sorted(tuple(row[column] for column in columns) for row in result)
+
+
+def compare(conn):
+    mismatches = []
+    timings = {}
+
+    def timed(page, key, fn):
+        start = time.perf_counter()
+        result = fn()
+        timings.setdefault(page, {'old': 0.0, 'new': 0.0})[key] += time.perf_counter() - start
+        return result
+
+    student_ids = [row['id'] for row in conn.execute('SELECT id FROM students')]
+    module_ids = [row['id'] for row in conn.execute('SELECT id FROM modules')]
+    enrollments = conn.execute('SELECT student_id, module_id FROM student_modules').fetchall()
+
+    columns = ('id', 'code', 'total_sessions', 'attended_sessions')
+    for student_id in student_ids:
+        old = timed('student dashboard', 'old', lambda: conn.execute(OLD_STUDENT_DASHBOARD, (student_id, student_id)).fetchall())
+        new = timed('student dashboard', 'new', lambda: queries.student_modules_with_attendance(conn, student_id))
+        if rows(old, columns) != rows(new, columns):
+            mismatches.append(('student dashboard', student_id))
+
+    columns = ('id', 'email', 'final_mark', 'total_sessions', 'attended_sessions')
+    for module_id in module_ids:
+        old = timed('module detail', 'old', lambda: conn.execute(OLD_MODULE_DETAIL, (module_id, module_id, module_id)).fetchall())
+        new = timed('module detail', 'new', lambda: queries.module_students_with_attendance(conn, module_id))
+        if rows(old, columns) != rows(new, columns):
+            mismatches.append(('module detail', module_id))
+
+    def old_student_module(student_id, module_id):
+        records = conn.execute(OLD_STUDENT_MODULE_RECORDS, (student_id, module_id)).fetchall()
+        return records, conn.execute(OLD_STUDENT_MODULE_STATS, (module_id, student_id, module_id)).fetchone()
+
+    columns = ('id', 'session_date', 'start_time', 'status', 'attendance_time')
+    for student_id, module_id in enrollments:
+        old_records, old = timed('student module', 'old', lambda: old_student_module(student_id, module_id))
+        new_records, new = timed('student module', 'new',
+                                 lambda: queries.student_module_attendance(conn, student_id, module_id))
+        if ((old['total_sessions'], old['attended_sessions']) != (new['total_sessions'], new['attended_sessions'])
+                or rows(old_records, columns) != rows(new_records, columns)):
+            mismatches.append(('student module', (student_id, module_id)))
+
+    return mismatches, timings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    seed_data.add_arguments(parser)
+    parser.set_defaults(students=3000, modules=60, sessions_per_module=30)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        seed_data.create_database(os.path.join(tmp, 'bench.db'))
+        conn = models.get_connection()
+        counts = seed_data.seed_from_args(conn, args)
+        add_edge_cases(conn)
+        conn.execute('ANALYZE')
+        print(f"Seeded {counts}")
+
+        mismatches, timings = compare(conn)
+        conn.close()
+
+    for page, timing in timings.items():
+        print(f"{page:<18} original {timing['old']:7.2f}s   rewritten {timing['new']:7.2f}s")
+    if mismatches:
+        print(f"{len(mismatches)} mismatches, first ones: {mismatches[:10]}")
+        sys.exit(1)
+    print('All results identical')
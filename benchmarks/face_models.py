@@ -0,0 +1,180 @@
+"""Latency, memory and accuracy of face recognizer / detector / metric combinations.
+
+Usage:
+    python benchmarks/face_models.py faces/ --models VGG-Face Facenet SFace --detectors opencv yunet --cores 4
+
+The image set has one folder per person (faces/<person>/<image>.jpg) with at
+least two images for most people. For every model and detector, all images
+are embedded by a fresh pool of --cores processes; the report gives the
+detect + embed latency per image (p50/p95), throughput, peak memory of a
+worker, and for every metric the false accept and false reject rates at the
+threshold the app would use (DeepFace's default, or --threshold), plus the
+equal error rate for a threshold-independent comparison.
+"""
+import argparse
+import itertools
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import face_engine
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+_engine = None
+
+
+def _init_worker(model_name, detector_backend):
+    global _engine
+    _engine = face_engine.FaceEngine(model_name, detector_backend)
+    _engine.load()
+
+
+def _peak_rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    return face_engine.current_rss_mb()
+
+
+def _ready(_):
+    # Keeps a worker busy for a moment so every worker gets one and finishes loading
+    time.sleep(0.5)
+    return os.getpid()
+
+
+def _embed(path):
+    start = time.perf_counter()
+    try:
+        embedding, error = _engine.represent_batch([face_engine.decode_image(open(path, 'rb').read())])[0]
+    except Exception as e:
+        embedding, error = None, str(e)
+    return embedding, error, time.perf_counter() - start, _peak_rss_mb()
+
+
+def percent(value):
+    return '-' if value is None else f"{value:.2%}"
+
+
+def load_image_set(directory):
+    """Return (paths, labels) of the images in one folder per person"""
+    paths = []
+    labels = []
+    for person in sorted(os.listdir(directory)):
+        folder = os.path.join(directory, person)
+        if not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(folder, name))
+                labels.append(person)
+    return paths, labels
+
+
+def embed_all(paths, model_name, detector_backend, cores):
+    """Embed every image in a pool of `cores` processes and return the measurements"""
+    context = multiprocessing.get_context('spawn')
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=cores, mp_context=context, initializer=_init_worker,
+                             initargs=(model_name, detector_backend)) as executor:
+        list(executor.map(_ready, range(cores)))
+        load_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = list(executor.map(_embed, paths))
+        wall_seconds = time.perf_counter() - start
+
+    return {
+        'embeddings': [embedding for embedding, _, _, _ in results],
+        'errors': [error for _, error, _, _ in results if error],
+        'latencies': [seconds for _, _, seconds, _ in results],
+        'peak_rss_mb': max(peak for _, _, _, peak in results),
+        'load_seconds': load_seconds,
+        'throughput': len(paths) / wall_seconds,
+    }
+
+
+def pairwise_distances(embeddings, distance_metric):
+    """Distance matrix between all rows, using the app's metric definitions"""
+    x = np.asarray(embeddings, dtype=np.float32)
+    if distance_metric in ('cosine', 'euclidean_l2'):
+        x = x / np.linalg.norm(x, axis=1, keepdims=True)
+    if distance_metric == 'cosine':
+        return 1 - x @ x.T
+    squared = (x ** 2).sum(axis=1)
+    return np.sqrt(np.maximum(squared[:, np.newaxis] + squared - 2 * x @ x.T, 0))
+
+
+def error_rates(embeddings, labels, distance_metric, threshold):
+    """False accept rate, false reject rate at threshold, and the equal error rate.
+
+    Images without an embedding (no face detected) reject every pair they are in.
+    """
+    embedded = [i for i, embedding in enumerate(embeddings) if embedding is not None]
+    labels = np.asarray(labels)
+    upper = np.triu_indices(len(labels), k=1)
+    genuine = (labels[:, np.newaxis] == labels)[upper]
+
+    distances = np.full((len(labels), len(labels)), np.inf, dtype=np.float32)
+    if embedded:
+        distances[np.ix_(embedded, embedded)] = pairwise_distances([embeddings[i] for i in embedded], distance_metric)
+    distances = distances[upper]
+
+    genuine_distances = distances[genuine]
+    impostor_distances = distances[~genuine]
+    far = float((impostor_distances <= threshold).mean()) if len(impostor_distances) else None
+    frr = float((genuine_distances > threshold).mean()) if len(genuine_distances) else None
+
+    eer = None
+    finite = distances[np.isfinite(distances)]
+    if len(genuine_distances) and len(impostor_distances) and len(finite):
+        candidates = np.quantile(finite, np.linspace(0, 1, 501))
+        fars = np.array([(impostor_distances <= t).mean() for t in candidates])
+        frrs = np.array([(genuine_distances > t).mean() for t in candidates])
+        best = np.abs(fars - frrs).argmin()
+        eer = float((fars[best] + frrs[best]) / 2)
+    return far, frr, eer
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', help='folder with one sub-folder of images per person')
+    parser.add_argument('--models', nargs='+', default=[face_engine.MODEL_NAME])
+    parser.add_argument('--detectors', nargs='+', default=[face_engine.DETECTOR_BACKEND])
+    parser.add_argument('--metrics', nargs='+', default=['cosine', 'euclidean_l2'])
+    parser.add_argument('--cores', type=int, default=os.cpu_count())
+    parser.add_argument('--threshold', type=float, help="instead of DeepFace's default threshold")
+    args = parser.parse_args()
+
+    paths, labels = load_image_set(args.images)
+    print(f"{len(paths)} images of {len(set(labels))} people, {args.cores} worker processes")
+
+    header = (f"{'model':<12} {'detector':<11} {'metric':<13} {'p50 ms':>8} {'p95 ms':>8} {'img/s':>7} "
+              f"{'peak MB':>8} {'load s':>7} {'fail':>5} {'thresh':>7} {'FAR':>7} {'FRR':>7} {'EER':>7}")
+    rows = []
+    for model_name, detector_backend in itertools.product(args.models, args.detectors):
+        try:
+            result = embed_all(paths, model_name, detector_backend, args.cores)
+        except Exception as e:
+            print(f"{model_name} / {detector_backend} failed: {e}")
+            continue
+        p50, p95 = np.percentile(result['latencies'], [50, 95]) * 1000
+        for distance_metric in args.metrics:
+            threshold = args.threshold if args.threshold is not None else face_engine.find_threshold(model_name, distance_metric)
+            far, frr, eer = error_rates(result['embeddings'], labels, distance_metric, threshold)
+            rows.append(f"{model_name:<12} {detector_backend:<11} {distance_metric:<13} {p50:8.1f} {p95:8.1f} "
+                        f"{result['throughput']:7.2f} {result['peak_rss_mb']:8.0f} {result['load_seconds']:7.1f} "
+                        f"{len(result['errors']):5d} {threshold:7.3f} {percent(far):>7} {percent(frr):>7} {percent(eer):>7}")
+            print(rows[-1])
+
+    print()
+    print(header)
+    for row in rows:
+        print(row)
@@ -0,0 +1,113 @@
+"""Import time and memory of a web worker and of an inference worker.
+
+Usage:
+    python benchmarks/import_footprint.py --runs 5
+
+Each measurement runs in a fresh interpreter: the web worker imports app
+and serves GET /login once, the check-in target does the same with one
+POST /process_attendance against an inference service (as under gunicorn),
+and the inference worker imports face_engine and loads the model. The
+report gives the median wall time, the resident set size afterwards, and
+which heavy libraries ended up imported. Exits with status 1 if either web
+worker target imported any of them.
+
+Without FACE_SERVICE_ADDRESS (flask run) the pool runs in-process, so a web
+process that takes check-ins loads OpenCV and the model like an inference
+worker does.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Libraries only the inference service should load; a gunicorn web worker never needs them
+HEAVY_MODULES = ('cv2', 'numpy', 'deepface', 'tensorflow', 'keras', 'torch')
+
+MEASURE = '''
+import json, sys, time
+{setup}
+start = time.perf_counter()
+{code}
+seconds = time.perf_counter() - start
+rss_kb = 0
+with open('/proc/self/status') as f:
+    for line in f:
+        if line.startswith('VmRSS:'):
+            rss_kb = int(line.split()[1])
+loaded = sorted({{name.split('.')[0] for name in sys.modules}} & set({heavy!r}))
+print(json.dumps({{'seconds': seconds, 'rss_mb': rss_kb / 1024, 'loaded': loaded}}))
+'''
+
+# Untimed: a scratch database and an inference service on a Unix socket, started
+# in a separate interpreter so nothing it imports shows up in the measured one
+SERVICE_SETUP = '''
+import os, subprocess, tempfile
+work = tempfile.mkdtemp()
+os.environ.update(DATABASE=os.path.join(work, 'attendance.db'), PRECHECK_ENABLED='1',
+                  FACE_SERVICE_ADDRESS=os.path.join(work, 'face.sock'), FACE_SERVICE_AUTHKEY='footprint')
+subprocess.Popen([sys.executable, '-c', 'import os, models, verification_pool; models.init_db(); models.update_db(); '
+                  'verification_pool.serve(parent_pid=os.getppid())'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+while not os.path.exists(os.environ['FACE_SERVICE_ADDRESS']):
+    time.sleep(0.05)
+'''
+
+TARGETS = {
+    'web worker': ('', '''
+import app
+app.app.test_client().get('/login')
+'''),
+    'web check-in': (SERVICE_SETUP, '''
+import io
+import app
+client = app.app.test_client()
+with client.session_transaction() as session:
+    session['user_id'], session['user_type'] = 1, 'student'
+client.post('/process_attendance/1/1', data={'face_image': (io.BytesIO(b'\\xff\\xd8 not a frame'), 'frame.jpg')})
+'''),
+    'inference worker': ('', '''
+import face_engine
+face_engine.preload()
+'''),
+}
+
+
+def measure(code, setup=''):
+    """Run code in a fresh interpreter (after the untimed setup) and return its measurements"""
+    script = MEASURE.format(setup=setup, code=code, heavy=HEAVY_MODULES)
+    output = subprocess.run([sys.executable, '-c', script], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--skip-inference', action='store_true', help='only measure the web worker targets')
+    args = parser.parse_args()
+
+    baseline = measure('pass')
+    print(f"{'process':<18} {'median s':>9} {'RSS MB':>8} {'+MB':>8}  heavy modules")
+    print(f"{'interpreter':<18} {baseline['seconds']:9.3f} {baseline['rss_mb']:8.1f} {0:8.1f}  -")
+
+    web_loaded = []
+    for name, (setup, code) in TARGETS.items():
+        if name == 'inference worker' and args.skip_inference:
+            continue
+        try:
+            results = [measure(code, setup) for _ in range(args.runs)]
+        except subprocess.CalledProcessError as e:
+            print(f"{name:<18} failed: {e.stderr.strip().splitlines()[-1] if e.stderr.strip() else e}")
+            continue
+        rss_mb = statistics.median(result['rss_mb'] for result in results)
+        loaded = results[-1]['loaded']
+        if name.startswith('web'):
+            web_loaded += [module for module in loaded if module not in web_loaded]
+        print(f"{name:<18} {statistics.median(result['seconds'] for result in results):9.3f} {rss_mb:8.1f} "
+              f"{rss_mb - baseline['rss_mb']:8.1f}  {', '.join(loaded) or '-'}")
+
+    if web_loaded:
+        print(f"The web worker imported {', '.join(web_loaded)}")
+        sys.exit(1)
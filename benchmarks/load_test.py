@@ -0,0 +1,372 @@
+"""End-to-end load test of the start-of-lecture check-in spike.
+
+Usage:
+    python benchmarks/load_test.py --users 100 --students 5000 --modules 100 --stub-recognizer
+    python benchmarks/load_test.py --users 100 --url http://localhost:8000 --database attendance.db --no-seed
+
+Seeds a database (seed_data.py, with generated face images for the
+students taking part) and opens a session in every module that is running
+now. Then every virtual student logs in, opens their dashboard and module
+page, and checks in with a slightly jittered copy of their registered face,
+waiting for the verification result. Virtual lecturers log in and open
+their dashboard and module pages in the meantime. All users start together
+(or spread over --ramp-seconds).
+
+By default the app runs in this process behind Flask's test client;
+--url drives a running server over HTTP instead (its database must be the
+one given with --database, seeded beforehand with seed_data.py --faces and
+used with --no-seed). --stub-recognizer replaces the inference processes
+with a sleep of --stub-latency-ms that accepts every face, so the web and
+database side can be measured without DeepFace; it only applies in process.
+
+The report gives per route the number of requests, errors, throughput and
+p50/p95/p99 latency, plus the most common errors.
+"""
+import argparse
+import http.cookiejar
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import models
+import seed_data
+import summary
+
+
+class TestClient:
+    """One user's session on the app in this process"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None, files=None):
+        if files:
+            data = dict(data or {})
+            data.update({name: (io.BytesIO(content), filename) for name, (filename, content) in files.items()})
+        response = self.client.open(path, method=method, data=data)
+        return response.status_code, response.get_data()
+
+
+class HttpClient:
+    """One user's session on a running server, with its own cookie jar and no redirects followed"""
+
+    class _NoRedirect(urllib.request.HTTPRedirectHandler):
+        def redirect_request(self, *args, **kwargs):
+            return None
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+                                                  self._NoRedirect)
+
+    def request(self, method, path, data=None, files=None):
+        headers = {}
+        body = None
+        if files:
+            body, content_type = encode_multipart(data or {}, files)
+            headers['Content-Type'] = content_type
+        elif data is not None:
+            body = urllib.parse.urlencode(data).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        request = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+        try:
+            with self.opener.open(request, timeout=60) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+def encode_multipart(fields, files):
+    """multipart/form-data body and content type for form fields and {name: (filename, bytes)} files"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content) in files.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: image/jpeg\r\n\r\n'.encode() + content + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class Recorder:
+    """Latencies and errors per route, shared by all virtual users"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.error_reasons = Counter()
+        self._lock = threading.Lock()
+
+    def call(self, client, route, method, path, data=None, files=None, ok=None):
+        """Make a request, record its latency under route, and return (status, JSON body or None)"""
+        start = time.perf_counter()
+        try:
+            status, body = client.request(method, path, data, files)
+        except Exception as e:
+            status, body = None, str(e).encode()
+        seconds = time.perf_counter() - start
+
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            payload = None
+        if status is None or status >= 500 or (ok and not ok(status, payload)):
+            reason = payload.get('message') if isinstance(payload, dict) else body[:80].decode(errors='replace')
+            self.record(route, seconds, f"{status}: {reason}")
+        else:
+            self.record(route, seconds)
+        return status, payload
+
+    def record(self, route, seconds, error=None):
+        with self._lock:
+            self.latencies[route].append(seconds)
+            if error:
+                self.errors[route] += 1
+                self.error_reasons[f"{route} {error}"] += 1
+
+    def report(self, wall_seconds):
+        print(f"{'route':<32} {'requests':>8} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for route, latencies in self.latencies.items():
+            p50, p95, p99 = percentiles(latencies, (50, 95, 99))
+            print(f"{route:<32} {len(latencies):8d} {self.errors[route]:7d} {len(latencies) / wall_seconds:8.1f} "
+                  f"{p50 * 1000:8.1f} {p95 * 1000:8.1f} {p99 * 1000:8.1f}")
+        if self.error_reasons:
+            print()
+            print("Most common errors:")
+            for reason, count in self.error_reasons.most_common(5):
+                print(f"{count:6d}  {reason}")
+
+
+def percentiles(values, points):
+    if len(values) == 1:
+        return [values[0]] * len(points)
+    cuts = statistics.quantiles(values, n=100, method='inclusive')
+    return [cuts[point - 1] for point in points]
+
+
+def logged_in(status, payload):
+    # A successful login redirects to the dashboard, a failed one renders the form again
+    return status == 302
+
+
+def page_ok(status, payload):
+    return status == 200
+
+
+def checkin_ok(status, payload):
+    return status in (200, 202) and payload is not None and (payload.get('success') or payload.get('pending'))
+
+
+def live_frame(face_image, rng):
+    """A fresh 'capture' of a registered face: shifted and re-lit a little"""
+    import cv2
+    import numpy as np
+
+    image = cv2.imread(face_image)
+    height, width = image.shape[:2]
+    shift = np.float32([[1, 0, rng.randint(-6, 6)], [0, 1, rng.randint(-6, 6)]])
+    image = cv2.warpAffine(image, shift, (width, height), borderMode=cv2.BORDER_REPLICATE)
+    image = cv2.convertScaleAbs(image, alpha=rng.uniform(0.9, 1.1), beta=rng.uniform(-10, 10))
+    return cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+
+def student_visit(client, recorder, student, rng, poll_seconds=0.5, max_wait=60):
+    email, face_image, module_id, session_id = student
+    recorder.call(client, 'POST /login (student)', 'POST', '/login', ok=logged_in,
+                         data={'email': email, 'password': 'password', 'user_type': 'student'})
+    recorder.call(client, 'GET /student/dashboard', 'GET', '/student/dashboard', ok=page_ok)
+    recorder.call(client, 'GET /student/module/<id>', 'GET', f'/student/module/{module_id}', ok=page_ok)
+
+    frame = live_frame(face_image, rng)
+    start = time.perf_counter()
+    status, payload = recorder.call(client, 'POST /process_attendance', 'POST',
+                                    f'/process_attendance/{module_id}/{session_id}',
+                                    files={'face_image': ('face.jpg', frame)}, ok=checkin_ok)
+    # Jobs still queued after the request's wait are polled like the page does
+    while payload and payload.get('pending') and time.perf_counter() - start < max_wait:
+        time.sleep(poll_seconds)
+        status, payload = recorder.call(client, 'GET /verification/<job>', 'GET', payload['poll_url'], ok=checkin_ok)
+    ok = bool(payload and payload.get('success'))
+    reason = None if ok else f"{status}: {payload.get('message') if payload else 'no response'}"
+    recorder.record('check-in end to end', time.perf_counter() - start, reason)
+
+    recorder.call(client, 'GET /student/dashboard', 'GET', '/student/dashboard', ok=page_ok)
+
+
+def lecturer_visit(client, recorder, lecturer, rng):
+    email, module_ids = lecturer
+    recorder.call(client, 'POST /login (lecturer)', 'POST', '/login', ok=logged_in,
+                  data={'email': email, 'password': 'password', 'user_type': 'lecturer'})
+    recorder.call(client, 'GET /lecturer/dashboard', 'GET', '/lecturer/dashboard', ok=page_ok)
+    recorder.call(client, 'GET /module/<id>', 'GET', f'/module/{rng.choice(module_ids)}', ok=page_ok)
+
+
+def open_sessions(conn):
+    """Add a session running now to every module and return {module_id: session_id}"""
+    now = datetime.now()
+    start_time = (now - timedelta(minutes=5)).strftime('%H:%M')
+    end_time = (now + timedelta(minutes=60)).strftime('%H:%M')
+    sessions = {}
+    for (module_id,) in conn.execute('SELECT id FROM modules').fetchall():
+        cursor = conn.execute('INSERT INTO sessions (module_id, session_date, start_time, end_time) VALUES (?, ?, ?, ?)',
+                              (module_id, now.strftime('%Y-%m-%d'), start_time, end_time))
+        summary.add_sessions(conn, module_id)
+        sessions[module_id] = cursor.lastrowid
+    conn.commit()
+    return sessions
+
+
+def pick_students(conn, count, sessions, faces_directory):
+    """The first `count` students with their first module, given generated face images if needed"""
+    rows = conn.execute('''SELECT s.id, s.email, MIN(sm.module_id) AS module_id FROM students s
+                           JOIN student_modules sm ON sm.student_id = s.id
+                           GROUP BY s.id ORDER BY s.id LIMIT ?''', (count,)).fetchall()
+    missing = [row['id'] for row in conn.execute(
+        f"SELECT id FROM students WHERE face_image IS NULL AND id IN ({','.join('?' * len(rows))})",
+        [row['id'] for row in rows])]
+    if missing:
+        seed_data.write_face_images(conn, faces_directory, missing)
+    face_images = dict(conn.execute(f"SELECT id, face_image FROM students WHERE id IN ({','.join('?' * len(rows))})",
+                                    [row['id'] for row in rows]).fetchall())
+    return [(row['email'], face_images[row['id']], row['module_id'], sessions[row['module_id']]) for row in rows]
+
+
+def pick_lecturers(conn, count):
+    modules = defaultdict(list)
+    for row in conn.execute('SELECT l.email, m.id FROM lecturers l JOIN modules m ON m.lecturer_id = l.id ORDER BY l.id'):
+        modules[row[0]].append(row[1])
+    return list(modules.items())[:count]
+
+
+class StubPool:
+    """Stands in for the verification pool: every job sleeps, then every face matches"""
+
+    def __init__(self, pool, latency):
+        self.pool = pool
+        self.latency = latency
+        self.pool.engines = {0: {'stub': True}}
+        self._threads = ThreadPoolExecutor(pool.max_workers)
+
+    def _run(self, job, task):
+        time.sleep(self.latency)
+        if task.__name__ == 'verify_faces_task':
+            result = {'verified': True, 'message': 'Distance: 0.0000'}
+        elif task.__name__ == 'identify_task':
+            result = {'faces': []}
+        else:
+            result = {'stored': True}
+        self.pool._finish(job, result=result)
+
+    def submit(self, task, *args, on_done=None):
+        job = self.pool._reserve(on_done)
+        self._threads.submit(self._run, job, task)
+        return job
+
+    def submit_batched(self, task, item, on_done=None):
+        return self.submit(task, item, on_done=on_done)
+
+    def __getattr__(self, name):
+        return getattr(self.pool, name)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=50, help='virtual students checking in')
+    parser.add_argument('--lecturer-users', type=int, help='virtual lecturers (default: users / 10)')
+    parser.add_argument('--ramp-seconds', type=float, default=0, help='spread the user starts over this long')
+    parser.add_argument('--url', help='drive a running server instead of the app in this process')
+    parser.add_argument('--database', help='database to seed and use (default: a temporary file)')
+    parser.add_argument('--faces', help='folder for the generated face images (default: next to the database)')
+    parser.add_argument('--no-seed', action='store_true', help='use the database as it is')
+    parser.add_argument('--stub-recognizer', action='store_true', help='accept every face without DeepFace')
+    parser.add_argument('--stub-latency-ms', type=float, default=50)
+    parser.add_argument('--random-seed', type=int, default=1)
+    seed_data.add_arguments(parser)
+    parser.set_defaults(students=2000, modules=40, lecturers=20, sessions_per_module=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='load_test_')
+    database = os.path.abspath(args.database or os.path.join(workdir, 'bench.db'))
+    faces_directory = args.faces or os.path.join(os.path.dirname(database), 'bench_faces')
+
+    # Inherited by the inference processes, which open the database themselves
+    os.environ['DATABASE'] = database
+    if args.no_seed:
+        models.DATABASE = database
+        models.update_db()
+    else:
+        start = time.perf_counter()
+        seed_data.create_database(database)
+        conn = models.get_connection()
+        counts = seed_data.seed_from_args(conn, args)
+        conn.close()
+        print(f"Seeded {database} in {time.perf_counter() - start:.1f} s: "
+              + ', '.join(f"{table}: {count}" for table, count in counts.items()))
+
+    conn = models.get_connection()
+    sessions = open_sessions(conn)
+    students = pick_students(conn, args.users, sessions, faces_directory)
+    lecturers = pick_lecturers(conn, args.lecturer_users if args.lecturer_users is not None else args.users // 10)
+    if args.url:
+        # The server's dashboard caches share their generations through the database
+        import cache
+        cache.cache.invalidate(conn, cache.ALL)
+    conn.close()
+
+    if args.url:
+        if args.stub_recognizer:
+            print("--stub-recognizer only applies in process, the server's recognizer is used")
+        make_client = lambda: HttpClient(args.url)
+    else:
+        os.chdir(ROOT)
+        import app as appmod
+        if args.stub_recognizer:
+            appmod.verification_pool = StubPool(appmod.verification_pool, args.stub_latency_ms / 1000)
+        else:
+            print("Loading the face model in the inference processes...")
+            appmod.verification_pool.start()
+            while not appmod.verification_pool.status()['ready']:
+                time.sleep(0.5)
+        make_client = lambda: TestClient(appmod.app)
+
+    recorder = Recorder()
+    visits = ([(student_visit, student) for student in students]
+              + [(lecturer_visit, lecturer) for lecturer in lecturers])
+    rng = random.Random(args.random_seed)
+    rng.shuffle(visits)
+
+    def run(index, visit, user):
+        time.sleep(args.ramp_seconds * index / max(len(visits), 1))
+        visit(make_client(), recorder, user, random.Random(args.random_seed + index))
+
+    print(f"{len(students)} students and {len(lecturers)} lecturers"
+          f"{' (stub recognizer)' if args.stub_recognizer and not args.url else ''}")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(len(visits), 1)) as executor:
+        for future in [executor.submit(run, i, visit, user) for i, (visit, user) in enumerate(visits)]:
+            future.result()
+    wall_seconds = time.perf_counter() - start
+
+    print(f"Finished in {wall_seconds:.1f} s")
+    print()
+    recorder.report(wall_seconds)
+
+    if not args.url:
+        appmod.verification_pool.shutdown()
@@ -0,0 +1,115 @@
+"""Query plans and timings of the attendance hot-path queries, before and after the index migration.
+
+Usage:
+    python benchmarks/query_plans.py --students 10000 --attendance-rate 0.5
+
+Seeds a throwaway database (about 1M attendance rows with the defaults),
+runs every query without the migration indexes, applies models.MIGRATIONS
+and runs them again.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models
+import seed_data
+
+# The hot-path queries as issued by app.py; params() picks random arguments
+QUERIES = {
+    'attendance already marked': (
+        'SELECT * FROM attendance WHERE student_id = ? AND session_id = ?',
+        lambda rng, n: (rng.randint(1, n['students']), rng.randint(1, n['sessions']))),
+    'enrollment check': (
+        'SELECT * FROM student_modules WHERE student_id = ? AND module_id = ?',
+        lambda rng, n: (rng.randint(1, n['students']), rng.randint(1, n['modules']))),
+    'module sessions': (
+        'SELECT * FROM sessions WHERE module_id = ? ORDER BY session_date DESC, start_time DESC',
+        lambda rng, n: (rng.randint(1, n['modules']),)),
+    'student dashboard': ('''
+        SELECT m.*,
+               (SELECT COUNT(*) FROM sessions WHERE module_id = m.id) as total_sessions,
+               COUNT(a.id) as attended_sessions
+        FROM modules m
+        JOIN student_modules sm ON m.id = sm.module_id
+        LEFT JOIN attendance a ON m.id = a.module_id AND a.student_id = ? AND a.status = 'Present'
+        WHERE sm.student_id = ?
+        GROUP BY m.id''',
+        lambda rng, n: (rng.randint(1, n['students']),) * 2),
+    'module detail students': ('''
+        SELECT s.*, sm.final_mark,
+               (SELECT COUNT(*) FROM sessions WHERE module_id = ?) as total_sessions,
+               COUNT(a.id) as attended_sessions
+        FROM students s
+        JOIN student_modules sm ON s.id = sm.student_id
+        LEFT JOIN attendance a ON s.id = a.student_id AND a.module_id = ? AND a.status = 'Present'
+        WHERE sm.module_id = ?
+        GROUP BY s.id''',
+        lambda rng, n: (rng.randint(1, n['modules']),) * 3),
+    'student module records': ('''
+        SELECT s.id, s.session_date, s.start_time, s.end_time, a.status, a.attendance_time
+        FROM sessions s
+        LEFT JOIN attendance a ON s.id = a.session_id AND a.student_id = ?
+        WHERE s.module_id = ?
+        ORDER BY s.session_date DESC, s.start_time DESC''',
+        lambda rng, n: (rng.randint(1, n['students']), rng.randint(1, n['modules']))),
+}
+
+
+def measure(conn, counts, repeat, budget):
+    """Return {name: (plan, average ms)}; stops repeating a query once it used up `budget` seconds"""
+    results = {}
+    for name, (sql, params) in QUERIES.items():
+        rng = random.Random(7)
+        plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params(rng, counts))]
+        runs = 0
+        start = time.perf_counter()
+        while runs < repeat and time.perf_counter() - start < budget:
+            conn.execute(sql, params(rng, counts)).fetchall()
+            runs += 1
+        results[name] = (plan, (time.perf_counter() - start) / runs * 1000)
+    return results
+
+
+def report(title, results):
+    print(f"\n== {title}")
+    for name, (plan, ms) in results.items():
+        print(f"{name:<26} {ms:10.3f} ms")
+        for step in plan:
+            print(f"    {step}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    seed_data.add_arguments(parser)
+    parser.add_argument('--repeat', type=int, default=200, help='runs per query')
+    parser.add_argument('--budget', type=float, default=10, help='max seconds per query')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        seed_data.create_database(os.path.join(tmp, 'bench.db'), migrate=False)
+        conn = models.get_connection()
+        started = time.perf_counter()
+        counts = seed_data.seed_from_args(conn, args)
+        print(f"Seeded {counts} in {time.perf_counter() - started:.1f}s")
+        conn.execute('ANALYZE')
+
+        before = measure(conn, counts, args.repeat, args.budget)
+        report('Without indexes', before)
+
+        started = time.perf_counter()
+        models.migrate(conn)
+        conn.execute('ANALYZE')
+        print(f"\nMigrations applied in {time.perf_counter() - started:.1f}s")
+
+        after = measure(conn, counts, args.repeat, args.budget)
+        report('With indexes', after)
+
+        print('\n== Speed-up')
+        for name in QUERIES:
+            print(f"{name:<26} {before[name][1] / after[name][1]:10.1f}x")
+        conn.close()
@@ -0,0 +1,185 @@
+"""Generate a synthetic attendance database for benchmarks.
+
+Usage:
+    python benchmarks/seed_data.py bench.db --students 10000 --modules 200 --faces bench_faces/
+
+All users get the password "password". With --faces, every student also
+gets a generated face image (drawn with OpenCV, no downloads) registered
+as their face_image.
+"""
+import argparse
+import os
+import random
+import sys
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import face_store
+import models
+import summary
+
+FACULTIES = ['Accounting and Informatics', 'Applied Sciences', 'Arts and Design',
+             'Engineering and the Built Environment', 'Health Sciences', 'Management Sciences']
+SESSION_TIMES = [('08:00', '09:30'), ('10:00', '11:30'), ('12:00', '13:30'), ('14:00', '15:30')]
+
+
+def create_database(path, migrate=True):
+    """Create an empty database with the application schema and point models at it"""
+    if os.path.exists(path):
+        os.remove(path)
+    models.DATABASE = path
+    models.init_db()
+    if migrate:
+        models.update_db()
+
+
+def faculty_names(count):
+    """The real faculty names first, then numbered ones"""
+    return (FACULTIES + [f"Faculty {i}" for i in range(len(FACULTIES) + 1, count + 1)])[:count]
+
+
+def seed(conn, faculties=len(FACULTIES), lecturers=50, modules=200, students=10000, modules_per_student=5,
+         sessions_per_module=40, attendance_rate=0.5, start=date(2025, 2, 3), random_seed=1):
+    """Fill an empty database and return the number of rows written per table"""
+    rng = random.Random(random_seed)
+    password = models.hash_password('password')
+    names = faculty_names(faculties)
+
+    conn.executemany('INSERT INTO lecturers (name, surname, email, Faculty, password) VALUES (?, ?, ?, ?, ?)',
+                     ((f"Lecturer{i}", 'Bench', f"lecturer{i}@dut.ac.za", names[i % len(names)], password)
+                      for i in range(1, lecturers + 1)))
+
+    conn.executemany('INSERT INTO modules (name, code, Faculty, lecturer_id) VALUES (?, ?, ?, ?)',
+                     ((f"Module {i}", f"MOD{i:04d}", names[i % len(names)], i % lecturers + 1)
+                      for i in range(1, modules + 1)))
+
+    conn.executemany('INSERT INTO students (name, surname, email, course, Faculty, password) VALUES (?, ?, ?, ?, ?, ?)',
+                     ((f"Student{i}", 'Bench', f"{20000000 + i:08d}@dut4life.ac.za", 'Bench Course',
+                       names[i % len(names)], password)
+                      for i in range(1, students + 1)))
+
+    # Weekly sessions for every module, module ids and session ids are assigned in order
+    sessions = {}
+    session_rows = []
+    for module_id in range(1, modules + 1):
+        start_time, end_time = SESSION_TIMES[module_id % len(SESSION_TIMES)]
+        sessions[module_id] = []
+        for week in range(sessions_per_module):
+            session_date = (start + timedelta(weeks=week, days=module_id % 5)).isoformat()
+            session_rows.append((module_id, session_date, start_time, end_time))
+            sessions[module_id].append((len(session_rows), session_date, start_time))
+    conn.executemany('INSERT INTO sessions (module_id, session_date, start_time, end_time) VALUES (?, ?, ?, ?)',
+                     session_rows)
+
+    enrollments = [(student_id, module_id)
+                   for student_id in range(1, students + 1)
+                   for module_id in rng.sample(range(1, modules + 1), min(modules_per_student, modules))]
+    conn.executemany('INSERT INTO student_modules (student_id, module_id, final_mark) VALUES (?, ?, ?)',
+                     ((student_id, module_id, round(rng.uniform(30, 95), 1)) for student_id, module_id in enrollments))
+
+    counts = {'attendance': 0}
+
+    def attendance_rows():
+        for student_id, module_id in enrollments:
+            for session_id, session_date, start_time in sessions[module_id]:
+                if rng.random() < attendance_rate:
+                    counts['attendance'] += 1
+                    yield (student_id, module_id, session_id, 'Present', f"{session_date} {start_time}:00")
+
+    conn.executemany('INSERT INTO attendance (student_id, module_id, session_id, status, attendance_time) VALUES (?, ?, ?, ?, ?)',
+                     attendance_rows())
+    conn.commit()
+
+    # Bulk inserts bypass the incremental updates, recompute the summary once (it comes with the migrations)
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'attendance_summary'").fetchone():
+        summary.rebuild(conn)
+
+    counts.update(lecturers=lecturers, modules=modules, students=students,
+                  student_modules=len(enrollments), sessions=len(session_rows))
+    return counts
+
+
+def synthetic_face(rng, size=256):
+    """Draw a frontal face (BGR array) that OpenCV's Haar cascade detects.
+
+    Face shape, colours and position vary with rng, so every student looks a
+    little different; the image is only meant for load tests, not accuracy.
+    """
+    import cv2
+    import numpy as np
+
+    image = np.empty((size, size, 3), np.uint8)
+    image[:] = (rng.randint(150, 230), rng.randint(150, 230), rng.randint(150, 230))
+    skin = np.array((rng.randint(110, 170), rng.randint(140, 190), rng.randint(180, 235)))
+    shade = tuple(int(c) for c in skin * 0.55)
+    hair = (rng.randint(10, 60),) * 3
+    cx, cy = size // 2 + rng.randint(-6, 6), size // 2 + rng.randint(-4, 4)
+    w, h = int(size * rng.uniform(0.25, 0.29)), int(size * rng.uniform(0.34, 0.38))
+
+    cv2.ellipse(image, (cx, cy - int(h * 0.1)), (int(w * 1.1), h), 0, 0, 360, hair, -1)
+    cv2.ellipse(image, (cx, cy), (w, h), 0, 0, 360, tuple(int(c) for c in skin), -1)
+    # Dark eye sockets and a bright nose bridge are what the cascade looks for
+    eye_y, eye_x = cy - int(h * 0.18), int(w * 0.42)
+    for side in (-1, 1):
+        cv2.ellipse(image, (cx + side * eye_x, eye_y), (int(w * 0.34), int(h * 0.16)), 0, 0, 360, shade, -1)
+    for side in (-1, 1):
+        cv2.ellipse(image, (cx + side * eye_x, eye_y), (int(w * 0.2), int(h * 0.07)), 0, 0, 360, (200, 200, 200), -1)
+        cv2.circle(image, (cx + side * eye_x, eye_y), int(h * 0.055), (30, 30, 30), -1)
+        cv2.ellipse(image, (cx + side * eye_x, eye_y - int(h * 0.2)), (int(w * 0.3), int(h * 0.04)), 0, 0, 360, hair, -1)
+    cv2.ellipse(image, (cx, cy + int(h * 0.2)), (int(w * 0.15), int(h * 0.08)), 0, 0, 360, shade, -1)
+    cv2.ellipse(image, (cx, cy + int(h * 0.5)), (int(w * 0.4), int(h * 0.08)), 0, 0, 360,
+                tuple(int(c) for c in skin * 0.45), -1)
+
+    image = cv2.GaussianBlur(image, (0, 0), 2.5)
+    noise = np.random.default_rng(rng.randint(0, 2 ** 32)).normal(0, 4, image.shape)
+    return np.clip(image + noise, 0, 255).astype(np.uint8)
+
+
+def write_face_images(conn, directory, student_ids=None, random_seed=1):
+    """Generate a face image for each student (all by default) and register it, in a face store at directory"""
+    import cv2
+
+    if student_ids is None:
+        student_ids = [row[0] for row in conn.execute('SELECT id FROM students ORDER BY id')]
+    rows = []
+    for student_id in student_ids:
+        image = synthetic_face(random.Random(random_seed * 1000003 + student_id))
+        path, digest = face_store.save(cv2.imencode('.jpg', image)[1].tobytes(), normalize_image=False,
+                                       root=os.path.abspath(directory))
+        rows.append((path, digest, student_id))
+    conn.executemany('UPDATE students SET face_image = ?, face_hash = ? WHERE id = ?', rows)
+    conn.commit()
+    return len(rows)
+
+
+def add_arguments(parser):
+    parser.add_argument('--faculties', type=int, default=len(FACULTIES))
+    parser.add_argument('--lecturers', type=int, default=50)
+    parser.add_argument('--modules', type=int, default=200)
+    parser.add_argument('--students', type=int, default=10000)
+    parser.add_argument('--modules-per-student', type=int, default=5)
+    parser.add_argument('--sessions-per-module', type=int, default=40)
+    parser.add_argument('--attendance-rate', type=float, default=0.5)
+
+
+def seed_from_args(conn, args):
+    return seed(conn, faculties=args.faculties, lecturers=args.lecturers, modules=args.modules, students=args.students,
+                modules_per_student=args.modules_per_student, sessions_per_module=args.sessions_per_module,
+                attendance_rate=args.attendance_rate)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('database')
+    parser.add_argument('--faces', metavar='DIR', help='generate a face image for every student in DIR')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    create_database(args.database)
+    conn = models.get_connection()
+    counts = seed_from_args(conn, args)
+    if args.faces:
+        counts['face_images'] = write_face_images(conn, args.faces)
+    conn.close()
+    print(', '.join(f"{table}: {count}" for table, count in counts.items()))
@@ -0,0 +1,145 @@
+"""Cache for the data behind the dashboards, invalidated by the write routes.
+
+Entries live in a per-process LRU with a TTL. Every entry carries tags such
+as 'module:3' or 'student:7'; a write route calls invalidate() with the tags
+it affected, which bumps their generation and commits the write. An entry is
+only served while none of its tags has a newer generation than the entry
+itself.
+
+With CACHE_SHARED on, the generations are kept in the cache_generations
+table, so an invalidation in one gunicorn worker also retires the entries
+of the others. The bump is then made in the write's own transaction, so a
+check-in takes the write lock once. Pages are still rendered per request (flash messages are
+part of every page); only the query results are cached.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', '2048'))
+CACHE_TTL = float(os.environ.get('CACHE_TTL', '300'))
+CACHE_SHARED = os.environ.get('CACHE_SHARED', '1') == '1'
+
+# Tag on every entry, invalidated to drop everything (e.g. after rebuilding the summary)
+ALL = 'all'
+# Row of cache_generations holding the last generation handed out
+COUNTER = '*'
+
+
+class Cache:
+    """LRU + TTL cache whose entries are retired by tag generations"""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL, shared=CACHE_SHARED):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared = shared
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'stale': 0,
+            'expired': 0,
+            'evictions': 0,
+            'not_stored': 0,
+            'invalidations': 0,
+        }
+
+    def _count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def _generation(self, conn, tags):
+        """Newest generation among tags (COUNTER gives the latest generation overall)"""
+        if self.shared:
+            placeholders = ','.join('?' * len(tags))
+            row = conn.execute(f'SELECT MAX(generation) FROM cache_generations WHERE tag IN ({placeholders})',
+                               tags).fetchone()
+            return row[0] or 0
+        with self._lock:
+            return max(self._generations.get(tag, 0) for tag in tags)
+
+    def get(self, conn, key, compute, tags=()):
+        """Return the cached value for key, or compute() it and cache it.
+
+        tags may be a function of the computed value, for entries whose
+        dependencies are only known from the data (e.g. a student's modules).
+        """
+        if self.max_entries <= 0:
+            return compute()
+
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry:
+            generation, stored_at, entry_tags, value = entry
+            if time.monotonic() - stored_at > self.ttl:
+                self._count('expired')
+            elif self._generation(conn, entry_tags) > generation:
+                self._count('stale')
+            else:
+                with self._lock:
+                    self._entries.move_to_end(key)
+                    self.stats['hits'] += 1
+                return value
+        else:
+            self._count('misses')
+
+        generation = self._generation(conn, (COUNTER,))
+        value = compute()
+        entry_tags = (ALL,) + tuple(tags(value) if callable(tags) else tags)
+        # A write that landed while computing may not be in value; don't keep it then
+        if self._generation(conn, entry_tags) > generation:
+            self._count('not_stored')
+            return value
+
+        with self._lock:
+            self._entries[key] = (generation, time.monotonic(), entry_tags, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+        return value
+
+    def invalidate(self, conn, *tags):
+        """Retire every entry carrying one of tags and commit conn's transaction.
+
+        Call it in place of the write's commit (or after it). Shared
+        generations are bumped in the write's transaction; the per-process
+        ones only once the write is committed, so no entry computed from the
+        old rows can get the new generation.
+        """
+        self._count('invalidations')
+        if self.shared:
+            conn.execute('''INSERT INTO cache_generations (tag, generation) VALUES (?, 1)
+                            ON CONFLICT (tag) DO UPDATE SET generation = generation + 1''', (COUNTER,))
+            conn.executemany('''INSERT INTO cache_generations (tag, generation)
+                                SELECT ?, generation FROM cache_generations WHERE tag = ?
+                                ON CONFLICT (tag) DO UPDATE SET generation = excluded.generation''',
+                             [(tag, COUNTER) for tag in tags])
+            conn.commit()
+            return
+        conn.commit()
+        with self._lock:
+            generation = self._generations.get(COUNTER, 0) + 1
+            self._generations[COUNTER] = generation
+            for tag in tags:
+                self._generations[tag] = generation
+
+    def status(self):
+        with self._lock:
+            stats = dict(self.stats)
+            size = len(self._entries)
+        lookups = stats['hits'] + stats['misses'] + stats['stale'] + stats['expired']
+        return {
+            'entries': size,
+            'max_entries': self.max_entries,
+            'ttl': self.ttl,
+            'shared': self.shared,
+            'hit_rate': stats['hits'] / lookups if lookups else None,
+            'stats': stats,
+        }
+
+
+cache = Cache()
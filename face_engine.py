@@ -0,0 +1,621 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from importlib import metadata
+
+import cv2
+import numpy as np
+from deepface import DeepFace
+from deepface.modules import preprocessing
+
+import face_store
+
+logger = logging.getLogger(__name__)
+
+# Recognizer, detector and metric are DeepFace names; benchmarks/face_models.py compares them.
+# FACE_THRESHOLD overrides DeepFace's verification threshold for the model and metric.
+MODEL_NAME = os.environ.get('FACE_MODEL', 'VGG-Face')
+DETECTOR_BACKEND = os.environ.get('FACE_DETECTOR', 'opencv')
+DISTANCE_METRIC = os.environ.get('FACE_DISTANCE_METRIC', 'cosine')
+THRESHOLD = float(os.environ['FACE_THRESHOLD']) if os.environ.get('FACE_THRESHOLD') else None
+
+# Smallest face crop (pixels a side, or the recognizer input size if that is smaller) accepted
+# without running the detector again
+MIN_FACE_CROP = 64
+# How far a crop's aspect ratio may be from the recognizer input's, or from square (the browser's crops)
+FACE_CROP_ASPECT_TOLERANCE = 0.1
+
+# Bumped whenever our preprocessing changes, so stored embeddings get recomputed
+EMBEDDING_PIPELINE = 'batch-v2'
+
+# Input normalization of DeepFace.represent (its default), which find_threshold's values assume
+NORMALIZATION = 'base'
+# On load, the batched embedding of a test image must match DeepFace.represent within this relative distance
+PARITY_CHECK = os.environ.get('FACE_PARITY_CHECK', '1') == '1'
+PARITY_TOLERANCE = 1e-3
+
+# 1:N identification (kiosk mode): galleries with at least GALLERY_IVF_MIN_SIZE students use the
+# approximate index when GALLERY_INDEX is 'ivf'; cached galleries are re-checked after GALLERY_TTL seconds
+GALLERY_INDEX = os.environ.get('GALLERY_INDEX', 'exact')
+GALLERY_IVF_MIN_SIZE = int(os.environ.get('GALLERY_IVF_MIN_SIZE', '2000'))
+GALLERY_IVF_NPROBE = int(os.environ.get('GALLERY_IVF_NPROBE', '4'))
+GALLERY_TTL = float(os.environ.get('GALLERY_TTL', '300'))
+
+
+def find_threshold(model_name, distance_metric):
+    """Return DeepFace's verification threshold for a model/metric pair"""
+    try:
+        from deepface.modules.verification import find_threshold as _find_threshold
+    except ImportError:
+        # Older deepface releases
+        from deepface.commons.distance import findThreshold as _find_threshold
+    return _find_threshold(model_name, distance_metric)
+
+
+def find_distance(embedding1, embedding2, distance_metric):
+    """Distance between two embeddings for a DeepFace metric name"""
+    a = np.asarray(embedding1, dtype=np.float32)
+    b = np.asarray(embedding2, dtype=np.float32)
+    if distance_metric == 'cosine':
+        return float(1 - np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+    if distance_metric == 'euclidean':
+        return float(np.linalg.norm(a - b))
+    if distance_metric == 'euclidean_l2':
+        return float(np.linalg.norm(a / np.linalg.norm(a) - b / np.linalg.norm(b)))
+    raise ValueError(f"Unknown distance metric: {distance_metric}")
+
+
+def model_version():
+    """Version tag stored next to each embedding so a library or preprocessing change invalidates it"""
+    try:
+        deepface_version = metadata.version('deepface')
+    except metadata.PackageNotFoundError:
+        deepface_version = 'unknown'
+    return f"{deepface_version}/{EMBEDDING_PIPELINE}"
+
+
+def current_rss_mb():
+    """Resident set size of this process in MB"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# (stage, seconds) pairs timed in this process since the last take_stage_timings()
+_stage_timings = []
+
+
+@contextmanager
+def stage(name):
+    """Time a pipeline stage (decode, detect, crop, embed, gallery, compare)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _stage_timings.append((name, time.perf_counter() - start))
+
+
+def take_stage_timings():
+    timings = list(_stage_timings)
+    _stage_timings.clear()
+    return timings
+
+
+class FaceEngine:
+    """Process-resident face detector and recognizer.
+
+    The model is built once per process by load() (normally from a gunicorn
+    hook, see gunicorn.conf.py) and reused by every verification afterwards.
+    """
+
+    def __init__(self, model_name=MODEL_NAME, detector_backend=DETECTOR_BACKEND, distance_metric=DISTANCE_METRIC,
+                 threshold=THRESHOLD):
+        self.model_name = model_name
+        self.detector_backend = detector_backend
+        self.distance_metric = distance_metric
+        self.default_threshold = find_threshold(model_name, distance_metric)
+        self.threshold = self.default_threshold if threshold is None else threshold
+        if self.threshold > self.default_threshold:
+            logger.warning(f"Face threshold {self.threshold} is looser than DeepFace's {self.default_threshold} "
+                           f"for {model_name}/{distance_metric}, more impostors will be accepted")
+        self.model = None
+        self.ready = False
+        self.error = None
+        self.load_seconds = None
+        self.model_memory_mb = None
+        self.parity_error = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Build the recognizer and warm up the detector; safe to call more than once"""
+        if self.ready:
+            return
+        with self._lock:
+            if self.ready:
+                return
+            start = time.perf_counter()
+            rss_before = current_rss_mb()
+            try:
+                self.model = DeepFace.build_model(self.model_name)
+                # Run a blank frame through the detector and a blank batch through the
+                # recognizer so both are initialised now rather than on the first check-in
+                DeepFace.extract_faces(
+                    img_path=np.zeros((224, 224, 3), dtype=np.uint8),
+                    detector_backend=self.detector_backend,
+                    enforce_detection=False
+                )
+                height, width = self.input_size
+                self._predict(np.zeros((1, height, width, 3), dtype=np.float32))
+                if PARITY_CHECK:
+                    self.check_parity()
+            except Exception as e:
+                self.error = str(e)
+                raise
+            self.load_seconds = time.perf_counter() - start
+            self.model_memory_mb = current_rss_mb() - rss_before
+            self.error = None
+            self.ready = True
+
+    def status(self):
+        """Readiness and resource figures for health checks"""
+        return {
+            'ready': self.ready,
+            'model_name': self.model_name,
+            'detector_backend': self.detector_backend,
+            'distance_metric': self.distance_metric,
+            'threshold': self.threshold,
+            'default_threshold': self.default_threshold,
+            'load_seconds': self.load_seconds,
+            'model_memory_mb': self.model_memory_mb,
+            'parity_error': self.parity_error,
+            'rss_mb': current_rss_mb(),
+            'pid': os.getpid(),
+            'error': self.error,
+        }
+
+    def represent(self, image_path):
+        """Run detection and the recognizer on one image and return its embedding"""
+        embedding, error = self.represent_batch([image_path])[0]
+        if embedding is None:
+            raise ValueError(error)
+        return embedding
+
+    def represent_batch(self, images, face_crops=None):
+        """Embed several images with a single forward pass of the recognizer.
+
+        Detection still runs per image, except for images flagged in face_crops
+        that already are a usable face crop; the faces are then stacked into
+        one batch. Returns one (embedding, error) pair per input image.
+        """
+        self.load()
+        face_crops = face_crops or [False] * len(images)
+        results = [(None, None)] * len(images)
+        faces = []
+        indexes = []
+        for i, (image, face_crop) in enumerate(zip(images, face_crops)):
+            try:
+                if face_crop and self.is_face_crop(image):
+                    with stage('crop'):
+                        faces.append(self.prepare_crop(image))
+                else:
+                    with stage('detect'):
+                        faces.append(self.extract_face(image))
+                indexes.append(i)
+            except Exception as e:
+                results[i] = (None, str(e))
+
+        if faces:
+            with stage('embed'):
+                embeddings = self._predict(np.stack(faces))
+            for i, embedding in zip(indexes, embeddings):
+                results[i] = (np.asarray(embedding, dtype=np.float32), None)
+        return results
+
+    def extract_face(self, image):
+        """Detect and align the face in an image, resized to the recognizer input"""
+        face_objs = DeepFace.extract_faces(
+            img_path=image,
+            detector_backend=self.detector_backend,
+            enforce_detection=True,
+            align=True
+        )
+        return self._to_input(face_objs[0]['face'])
+
+    def represent_faces(self, image):
+        """Detect every face in a frame (e.g. a group photo) and embed them in one batch.
+
+        Returns (embeddings, facial_areas); embeddings has one row per face.
+        """
+        self.load()
+        with stage('detect'):
+            face_objs = DeepFace.extract_faces(
+                img_path=image,
+                detector_backend=self.detector_backend,
+                enforce_detection=False,
+                align=True
+            )
+        faces = []
+        areas = []
+        for face_obj in face_objs:
+            # Without enforce_detection a frame with no face comes back as the whole image, confidence 0
+            if not face_obj.get('confidence', 1):
+                continue
+            faces.append(self._to_input(face_obj['face']))
+            area = face_obj['facial_area']
+            areas.append({key: int(area[key]) for key in ('x', 'y', 'w', 'h')})
+        if not faces:
+            return np.empty((0, 0), dtype=np.float32), []
+        with stage('embed'):
+            return np.asarray(self._predict(np.stack(faces)), dtype=np.float32), areas
+
+    def _to_input(self, face):
+        # The steps DeepFace.represent takes after extract_faces (RGB in [0, 1]): back to BGR like
+        # cv2.imread, resized with the aspect ratio kept and padded, then the model's input normalization
+        face = face[:, :, ::-1]
+        face = preprocessing.resize_image(img=face, target_size=self.input_size)
+        return preprocessing.normalize_input(img=face, normalization=NORMALIZATION)[0].astype(np.float32)
+
+    def is_face_crop(self, image):
+        """Whether a client-side or stored crop is large enough and shaped like the input to skip detection"""
+        height, width = image.shape[:2]
+        input_height, input_width = self.input_size
+        if height < min(MIN_FACE_CROP, input_height) or width < min(MIN_FACE_CROP, input_width):
+            return False
+        return any(abs(height / width / aspect - 1) <= FACE_CROP_ASPECT_TOLERANCE
+                   for aspect in (input_height / input_width, 1))
+
+    def prepare_crop(self, image):
+        """Turn a BGR uint8 face crop into recognizer input, exactly like an extract_faces() face"""
+        return self._to_input(image[:, :, ::-1].astype(np.float32) / 255)
+
+    @property
+    def input_size(self):
+        """(height, width) of the recognizer input"""
+        shape = getattr(self.model, 'input_shape', None)
+        if shape is not None and len(shape) == 2:
+            # DeepFace clients give (width, height), e.g. (47, 55) for DeepID
+            return shape[1], shape[0]
+        # Keras shape (batch, height, width, channels)
+        return tuple(self._keras_model().input_shape[1:3])
+
+    def _keras_model(self):
+        # Newer deepface wraps the Keras model in a client class
+        return getattr(self.model, 'model', self.model)
+
+    def _predict(self, batch):
+        # The model's own forward(), so its output normalization (e.g. L2 for VGG-Face) is applied
+        embeddings = np.asarray(self.model.forward(batch), dtype=np.float32)
+        if len(batch) == 1:
+            return embeddings.reshape(1, -1)
+        if embeddings.ndim == 2 and len(embeddings) == len(batch):
+            return embeddings
+        # forward() of recognizers without batch support (e.g. SFace, older deepface) embeds one face
+        return np.stack([np.asarray(self.model.forward(face[np.newaxis]), dtype=np.float32).reshape(-1)
+                         for face in batch])
+
+    def check_parity(self):
+        """Raise if a batched embedding differs from what DeepFace.represent computes for the same face.
+
+        The distances are scored against DeepFace's thresholds, so they are
+        only meaningful while our batched pipeline gives the same embeddings.
+        """
+        height, width = self.input_size
+        rng = np.random.default_rng(0)
+        # A crop that is larger than the input and not of its aspect ratio, so resizing and padding are compared too
+        image = cv2.GaussianBlur(rng.integers(0, 256, (height * 2, width * 2 + 17, 3), dtype=np.uint8), (5, 5), 0)
+        # detector_backend='skip' hands the image to the model channel-swapped, so swap it first
+        expected = np.asarray(DeepFace.represent(img_path=image[:, :, ::-1].copy(), model_name=self.model_name,
+                                                 detector_backend='skip', enforce_detection=False,
+                                                 normalization=NORMALIZATION)[0]['embedding'], dtype=np.float32)
+        # Batched with a second face, as check-ins are
+        actual = self._predict(np.stack([self.prepare_crop(image), self.prepare_crop(image[::-1])]))[0]
+        self.parity_error = float(np.linalg.norm(actual - expected) / max(np.linalg.norm(expected), 1e-12))
+        if self.parity_error > PARITY_TOLERANCE:
+            raise RuntimeError(f"Batched {self.model_name} embeddings differ from DeepFace.represent "
+                               f"(relative error {self.parity_error:.2e}), distances would not match its thresholds")
+
+    def distance(self, embedding1, embedding2):
+        """Distance between two embeddings with the configured metric"""
+        return find_distance(embedding1, embedding2, self.distance_metric)
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class Gallery:
+    """Embeddings of a group of students as one normalised matrix, for 1:N search.
+
+    Exact search scores every query against every student with one matrix
+    product. With index='ivf' the rows are grouped by k-means and a query only
+    scans the nprobe closest groups, which keeps large galleries fast at the
+    cost of occasionally missing the best match.
+    """
+
+    def __init__(self, student_ids, embeddings, index='exact', nprobe=GALLERY_IVF_NPROBE):
+        self.student_ids = np.asarray(student_ids, dtype=np.int64)
+        self.embeddings = np.asarray(embeddings, dtype=np.float32)
+        self.matrix = _normalize(embeddings) if len(student_ids) else np.empty((0, 0), dtype=np.float32)
+        self.index = index if len(student_ids) else 'exact'
+        self.nprobe = nprobe
+        self.built_at = time.monotonic()
+        if self.index == 'ivf':
+            self._build_ivf(max(1, int(len(student_ids) ** 0.5)))
+
+    def __len__(self):
+        return len(self.student_ids)
+
+    def _build_ivf(self, nlist, iterations=10):
+        rng = np.random.default_rng(0)
+        centroids = self.matrix[rng.choice(len(self.matrix), nlist, replace=False)]
+        for _ in range(iterations):
+            assignment = (self.matrix @ centroids.T).argmax(axis=1)
+            for cluster in range(nlist):
+                members = self.matrix[assignment == cluster]
+                if len(members):
+                    centroids[cluster] = _normalize(members.mean(axis=0))
+        self.centroids = centroids
+        self.lists = [np.flatnonzero(assignment == cluster) for cluster in range(nlist)]
+
+    def search(self, queries, distance_metric=DISTANCE_METRIC):
+        """Return (student_ids, distances) of the closest student for every query embedding"""
+        if distance_metric == 'euclidean':
+            # Raw euclidean depends on the vector lengths, so it is always an exact search
+            queries = np.asarray(queries, dtype=np.float32)
+            squared = ((queries ** 2).sum(axis=1)[:, np.newaxis] + (self.embeddings ** 2).sum(axis=1)
+                       - 2 * queries @ self.embeddings.T)
+            rows = squared.argmin(axis=1)
+            distances = np.sqrt(np.maximum(squared[np.arange(len(queries)), rows], 0))
+            return self.student_ids[rows], distances
+
+        queries = _normalize(queries)
+        if self.index == 'ivf':
+            best_rows = []
+            best_scores = []
+            probes = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :self.nprobe]
+            for query, probe in zip(queries, probes):
+                candidates = np.concatenate([self.lists[cluster] for cluster in probe])
+                scores = self.matrix[candidates] @ query
+                best = scores.argmax()
+                best_rows.append(candidates[best])
+                best_scores.append(scores[best])
+            rows, similarities = np.array(best_rows), np.array(best_scores)
+        else:
+            scores = queries @ self.matrix.T
+            rows = scores.argmax(axis=1)
+            similarities = scores[np.arange(len(queries)), rows]
+
+        if distance_metric == 'cosine':
+            distances = 1 - similarities
+        elif distance_metric == 'euclidean_l2':
+            distances = np.sqrt(np.maximum(2 - 2 * similarities, 0))
+        else:
+            raise ValueError(f"Unsupported distance metric for identification: {distance_metric}")
+        return self.student_ids[rows], distances
+
+
+engine = FaceEngine()
+
+# Per-process cache of module galleries: module_id -> (signature, Gallery)
+_galleries = {}
+
+
+def preload():
+    """Load the face engine in the current process (gunicorn post_fork / on_starting hook)"""
+    engine.load()
+    return engine.status()
+
+
+def decode_image(data):
+    """Decode uploaded image bytes straight into a BGR array, without touching the disk"""
+    with stage('decode'):
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Uploaded image could not be decoded")
+    return image
+
+
+def represent_enrollment(face_image):
+    """Embedding of a registered face image, from its stored face crop when there is one.
+
+    The first time, the face is detected and aligned as usual and the crop is
+    saved next to the image in the face store, so recomputing the embedding
+    (e.g. after a model upgrade) skips detection.
+    """
+    path = face_store.crop_path(face_image, engine.detector_backend)
+    crop = cv2.imread(path) if os.path.exists(path) else None
+    if crop is None:
+        engine.load()
+        with stage('detect'):
+            face = engine.extract_face(face_image)
+        crop = (np.clip(face, 0, 1) * 255).round().astype(np.uint8)
+        face_store.save_crop(path, crop)
+    embedding, error = engine.represent_batch([crop], [True])[0]
+    if embedding is None:
+        raise ValueError(error)
+    return embedding
+
+
+def store_embedding(conn, student_id, face_image):
+    """Compute and persist the embedding of a student's registered face image"""
+    embedding = represent_enrollment(face_image)
+    conn.execute('''INSERT OR REPLACE INTO face_embeddings
+                    (student_id, model_name, detector_backend, model_version, face_image, image_mtime, embedding)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                 (student_id, engine.model_name, engine.detector_backend, model_version(), face_image,
+                  os.path.getmtime(face_image), embedding.tobytes()))
+    conn.commit()
+    return embedding
+
+
+def is_current(stored, face_image):
+    """Whether a face_embeddings row still matches the student's image and the loaded model"""
+    return bool(stored
+                and stored['face_image'] == face_image
+                and stored['image_mtime'] == os.path.getmtime(face_image)
+                and stored['model_name'] == engine.model_name
+                and stored['detector_backend'] == engine.detector_backend
+                and stored['model_version'] == model_version())
+
+
+def get_enrolled_embedding(conn, student_id):
+    """Return (embedding, message) for a student's registered face.
+
+    The stored vector is reused as long as the face image and the model are
+    unchanged; otherwise it is recomputed and saved again.
+    """
+    student = conn.execute('SELECT face_image FROM students WHERE id = ?', (student_id,)).fetchone()
+
+    if not student or not student['face_image']:
+        return None, "No registered face found"
+
+    face_image = student['face_image']
+    if not os.path.exists(face_image):
+        return None, "Registered face image not found"
+
+    stored = conn.execute('SELECT * FROM face_embeddings WHERE student_id = ?', (student_id,)).fetchone()
+    if is_current(stored, face_image):
+        return np.frombuffer(stored['embedding'], dtype=np.float32), "OK"
+
+    try:
+        return store_embedding(conn, student_id, face_image), "OK"
+    except Exception as e:
+        return None, f"Registered face could not be processed: {str(e)}"
+
+
+def verify_faces(conn, items):
+    """Verify several (image_data, student_id, face_crop) items; returns one (verified, message) per item.
+
+    image_data is the encoded upload (JPEG/PNG bytes) and is decoded in memory.
+    face_crop marks frames the browser already cropped to the face.
+    All live frames are embedded in one batch, then each is compared with the
+    stored embedding of its student.
+    """
+    results = [None] * len(items)
+    enrolled = {}
+    frames = {}
+    pending = []
+    for i, (image_data, student_id, face_crop) in enumerate(items):
+        try:
+            # Get the registered face embedding (computed once and cached in the database)
+            enrolled_embedding, message = get_enrolled_embedding(conn, student_id)
+        except Exception as e:
+            results[i] = (False, f"Verification error: {str(e)}")
+            continue
+
+        if enrolled_embedding is None:
+            results[i] = (False, message)
+            continue
+
+        try:
+            frames[i] = decode_image(image_data)
+        except ValueError as e:
+            results[i] = (False, str(e))
+            continue
+
+        enrolled[i] = enrolled_embedding
+        pending.append(i)
+
+    try:
+        # Only the live frames go through the recognizer
+        live = engine.represent_batch([frames[i] for i in pending], [items[i][2] for i in pending])
+    except Exception as e:
+        live = [(None, str(e))] * len(pending)
+
+    for i, (live_embedding, error) in zip(pending, live):
+        if live_embedding is None:
+            results[i] = (False, f"Face comparison error: {error}")
+        else:
+            with stage('compare'):
+                distance = engine.distance(enrolled[i], live_embedding)
+            results[i] = (distance <= engine.threshold, f"Distance: {distance:.4f}")
+    return results
+
+
+def verify_face(conn, image_data, student_id, face_crop=False):
+    """Compare an uploaded face with the stored embedding of the student's registered face"""
+    return verify_faces(conn, [(image_data, student_id, face_crop)])[0]
+
+
+def _gallery_signature(conn, module_id):
+    # Changes when a student is enrolled or an embedding is (re)computed
+    return tuple(conn.execute('''SELECT COUNT(*), COUNT(fe.student_id), MAX(fe.created_at)
+                                FROM student_modules sm
+                                LEFT JOIN face_embeddings fe ON fe.student_id = sm.student_id
+                                WHERE sm.module_id = ?''', (module_id,)).fetchone())
+
+
+def module_gallery(conn, module_id):
+    """Gallery of the students enrolled in a module, cached per process.
+
+    Stored embeddings are read in one query; only missing or stale ones go
+    through the recognizer. The cached gallery is reused until enrollments
+    or embeddings change, and re-checked after GALLERY_TTL seconds.
+    """
+    signature = _gallery_signature(conn, module_id)
+    cached = _galleries.get(module_id)
+    if cached and cached[0] == signature and time.monotonic() - cached[1].built_at < GALLERY_TTL:
+        return cached[1]
+
+    rows = conn.execute('''SELECT DISTINCT sm.student_id, s.face_image AS current_image, fe.face_image, fe.image_mtime,
+                                   fe.model_name, fe.detector_backend, fe.model_version, fe.embedding
+                            FROM student_modules sm
+                            JOIN students s ON s.id = sm.student_id
+                            LEFT JOIN face_embeddings fe ON fe.student_id = sm.student_id
+                            WHERE sm.module_id = ?''', (module_id,)).fetchall()
+    student_ids = []
+    embeddings = []
+    for row in rows:
+        if not row['current_image'] or not os.path.exists(row['current_image']):
+            continue
+        if row['embedding'] is not None and is_current(row, row['current_image']):
+            embedding = np.frombuffer(row['embedding'], dtype=np.float32)
+        else:
+            embedding, _ = get_enrolled_embedding(conn, row['student_id'])
+            if embedding is None:
+                continue
+        student_ids.append(row['student_id'])
+        embeddings.append(embedding)
+
+    index = GALLERY_INDEX if len(student_ids) >= GALLERY_IVF_MIN_SIZE else 'exact'
+    gallery = Gallery(student_ids, embeddings, index=index)
+    _galleries[module_id] = (_gallery_signature(conn, module_id), gallery)
+    return gallery
+
+
+def identify(conn, module_id, image_data):
+    """Find enrolled students of a module in a frame or group photo (1:N).
+
+    Every detected face is matched against the module gallery; a student is
+    only given to the closest of several faces. Returns one dict per face
+    with student_id (None if nobody is within the threshold), distance and
+    facial_area.
+    """
+    frame = decode_image(image_data)
+    embeddings, areas = engine.represent_faces(frame)
+    faces = [{'student_id': None, 'distance': None, 'facial_area': area} for area in areas]
+    with stage('gallery'):
+        gallery = module_gallery(conn, module_id)
+    if not faces or not len(gallery):
+        return faces
+
+    with stage('compare'):
+        student_ids, distances = gallery.search(embeddings, engine.distance_metric)
+    closest = {}
+    for i, (student_id, distance) in enumerate(zip(student_ids.tolist(), distances.tolist())):
+        faces[i]['distance'] = round(distance, 4)
+        if distance <= engine.threshold and (student_id not in closest or distance < faces[closest[student_id]]['distance']):
+            closest[student_id] = i
+    for student_id, i in closest.items():
+        faces[i]['student_id'] = student_id
+    return faces
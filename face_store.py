@@ -0,0 +1,104 @@
+"""Content-addressed store of the students' enrollment images.
+
+An upload is normalized (decoded, scaled down to MAX_SIDE, re-encoded as
+JPEG; the web workers do this through the verification pool, so OpenCV stays
+in the inference service) and saved once as <FACE_STORE>/<first 2 hex>/<sha256>.jpg; students
+uploading the same image share the file. The inference processes save the
+aligned face crop next to it (<sha256>.<detector>.png) the first time they
+embed it, so later re-embeddings (e.g. after a model upgrade) skip
+detection. The store lives outside static/, so enrollment images are not
+publicly served.
+
+students.face_hash records which image a student uses; files no student
+refers to any more are deleted by release() and collect_garbage().
+"""
+import glob
+import hashlib
+import os
+import time
+
+FACE_STORE = os.environ.get('FACE_STORE', 'face_store')
+# Longest side of a stored enrollment image, in pixels
+MAX_SIDE = int(os.environ.get('FACE_STORE_MAX_SIDE', '800'))
+JPEG_QUALITY = 92
+
+
+def normalize(image_data):
+    """Re-encode an upload as a JPEG no larger than MAX_SIDE; raises ValueError if it can't be decoded"""
+    import cv2
+    import numpy as np
+
+    image = cv2.imdecode(np.frombuffer(image_data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Uploaded image could not be decoded")
+    height, width = image.shape[:2]
+    if max(height, width) > MAX_SIDE:
+        scale = MAX_SIDE / max(height, width)
+        image = cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+    return cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])[1].tobytes()
+
+
+def image_path(digest, root=FACE_STORE):
+    return os.path.join(root, digest[:2], f"{digest}.jpg")
+
+
+def crop_path(path, detector_backend):
+    """Where the aligned face crop of a stored image is kept"""
+    return f"{os.path.splitext(path)[0]}.{detector_backend}.png"
+
+
+def _write(path, data):
+    # Write to a temporary name first, so a reader never sees half a file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'wb') as f:
+        f.write(data)
+    os.replace(temporary, path)
+
+
+def save(image_data, normalize_image=True, root=FACE_STORE):
+    """Store an enrollment image and return (path, sha256 digest)"""
+    if normalize_image:
+        image_data = normalize(image_data)
+    digest = hashlib.sha256(image_data).hexdigest()
+    path = image_path(digest, root)
+    if not os.path.exists(path):
+        _write(path, image_data)
+    return path, digest
+
+
+def save_crop(path, crop):
+    """Save a face crop (BGR uint8 array) at crop_path()"""
+    import cv2
+    _write(path, cv2.imencode('.png', crop)[1].tobytes())
+
+
+def _delete(digest, root):
+    removed = 0
+    for path in glob.glob(os.path.join(root, digest[:2], f"{digest}.*")):
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def release(conn, digest, root=FACE_STORE):
+    """Delete an image and its crops once no student uses it (call after the change is committed)"""
+    if conn.execute('SELECT 1 FROM students WHERE face_hash = ?', (digest,)).fetchone():
+        return 0
+    return _delete(digest, root)
+
+
+def collect_garbage(conn, root=FACE_STORE, min_age=3600):
+    """Delete every stored image (and crop) no student refers to; returns the number of files removed.
+
+    Files younger than min_age seconds are kept: they may belong to an
+    upload whose database update is not committed yet.
+    """
+    used = {row[0] for row in conn.execute('SELECT face_hash FROM students WHERE face_hash IS NOT NULL')}
+    cutoff = time.time() - min_age
+    stored = {os.path.basename(path).split('.')[0] for path in glob.glob(os.path.join(root, '??', '*'))
+              if os.path.getmtime(path) < cutoff}
+    return sum(_delete(digest, root) for digest in stored - used)
@@ -0,0 +1,41 @@
+# Gunicorn settings for VisitED
+# Run with: gunicorn -c gunicorn.conf.py app:app
+import os
+import secrets
+import tempfile
+
+# Face verification runs in one inference service process shared by all web workers, so the
+# model is loaded FACE_WORKERS times in total, whatever the number of web workers. The workers
+# find it through these variables, set before they are forked (and before verification_pool is
+# imported, which picks the remote pool when FACE_SERVICE_ADDRESS is set).
+os.environ.setdefault('FACE_SERVICE_ADDRESS', os.path.join(tempfile.gettempdir(), f"visited-face-{os.getpid()}.sock"))
+os.environ.setdefault('FACE_SERVICE_AUTHKEY', secrets.token_hex(16))
+
+import verification_pool
+
+bind = '0.0.0.0:8000'
+workers = 2
+threads = 8
+# An open live attendance feed (/module/<id>/live) holds a thread while it waits, so at most a
+# quarter of them stream; further lecturer pages poll every LIVE_FEED_BUSY_RETRY_SECONDS instead
+os.environ.setdefault('LIVE_FEED_MAX_STREAMS', str(threads // 4))
+
+_service = None
+
+
+def on_starting(server):
+    # Start the service, and the model loading in its inference processes, before the first check-in
+    global _service
+    _service = verification_pool.start_service()
+    server.log.info(f"Started the face inference service (pid {_service.pid}, {verification_pool.FACE_WORKERS} "
+                    f"face workers) on {verification_pool.FACE_SERVICE_ADDRESS}")
+
+
+def on_exit(server):
+    if _service is not None:
+        _service.terminate()
+        _service.join(10)
+
+
+def worker_exit(server, worker):
+    verification_pool.pool.shutdown()
\ No newline at end of file
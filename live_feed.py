@@ -0,0 +1,109 @@
+"""Live attendance feed for the lecturer's module page (server-sent events).
+
+The check-in paths call notify() after committing Present rows, which wakes
+the streams of the same web process at once. Streams in other processes
+find the rows on their next poll, a rowid range read of the attendance
+rows newer than the last one sent.
+
+Each open stream holds a request thread, so a web process serves at most
+MAX_STREAMS of them at a time. Beyond that a request gets the rows that
+are already there and ends at once, and the browser asks again after
+BUSY_RETRY_SECONDS: a plain poll that leaves the threads to check-ins.
+"""
+import json
+import os
+import threading
+import time
+
+# How often a stream looks for rows written by other web processes
+POLL_SECONDS = float(os.environ.get('LIVE_FEED_POLL_SECONDS', '2'))
+# A stream ends after this long and the browser reconnects (EventSource resumes from Last-Event-ID)
+MAX_SECONDS = float(os.environ.get('LIVE_FEED_MAX_SECONDS', '300'))
+KEEPALIVE_SECONDS = 15
+# Streams held open per web process; keep it well under gunicorn's threads
+MAX_STREAMS = int(os.environ.get('LIVE_FEED_MAX_STREAMS', '4'))
+# How soon the browser polls again when every stream slot is taken
+BUSY_RETRY_SECONDS = float(os.environ.get('LIVE_FEED_BUSY_RETRY_SECONDS', '10'))
+
+_changed = threading.Condition()
+_version = 0
+_streams = threading.BoundedSemaphore(MAX_STREAMS) if MAX_STREAMS > 0 else None
+
+
+def notify():
+    """Wake the streams of this process after attendance was written"""
+    global _version
+    with _changed:
+        _version += 1
+        _changed.notify_all()
+
+
+def _wait(version, timeout):
+    with _changed:
+        _changed.wait_for(lambda: _version != version, timeout)
+        return _version
+
+
+def latest_attendance_id(conn):
+    return conn.execute('SELECT COALESCE(MAX(id), 0) FROM attendance').fetchone()[0]
+
+
+def new_attendance(conn, module_id, after_id, session_id=None):
+    """Attendance rows of a module (or one of its sessions) written after after_id"""
+    sql = '''SELECT id, student_id, session_id, status, attendance_time FROM attendance
+             WHERE id > ? AND module_id = ?'''
+    params = [after_id, module_id]
+    if session_id is not None:
+        sql += ' AND session_id = ?'
+        params.append(session_id)
+    return conn.execute(sql + ' ORDER BY id', params).fetchall()
+
+
+def _poll(pool, module_id, after_id, session_id):
+    conn = pool.acquire()
+    try:
+        return new_attendance(conn, module_id, after_id, session_id)
+    finally:
+        pool.release(conn)
+
+
+def _message(row):
+    return f"id: {row['id']}\ndata: {json.dumps(dict(row))}\n\n"
+
+
+def events(pool, module_id, after_id, session_id=None):
+    """Generate SSE messages, one per new attendance row, for up to MAX_SECONDS.
+
+    A pooled connection is only held while polling, so an open stream does
+    not tie up the pool. With MAX_STREAMS streams already open, only the
+    rows written so far are sent.
+    """
+    if _streams is not None and not _streams.acquire(blocking=False):
+        yield f"retry: {int(BUSY_RETRY_SECONDS * 1000)}\n\n"
+        for row in _poll(pool, module_id, after_id, session_id):
+            yield _message(row)
+        return
+    try:
+        yield from _stream(pool, module_id, after_id, session_id)
+    finally:
+        if _streams is not None:
+            _streams.release()
+
+
+def _stream(pool, module_id, after_id, session_id):
+    yield f"retry: {int(POLL_SECONDS * 1000)}\n\n"
+    deadline = time.monotonic() + MAX_SECONDS
+    last_write = time.monotonic()
+    version = _version
+    while time.monotonic() < deadline:
+        for row in _poll(pool, module_id, after_id, session_id):
+            after_id = row['id']
+            last_write = time.monotonic()
+            yield _message(row)
+
+        if time.monotonic() - last_write >= KEEPALIVE_SECONDS:
+            # Comment line: keeps proxies from closing the idle stream and detects closed tabs
+            last_write = time.monotonic()
+            yield ": keepalive\n\n"
+
+        version = _wait(version, POLL_SECONDS)
@@ -0,0 +1,130 @@
+"""Request, SQL and face pipeline timings in the Prometheus text format.
+
+Histograms are fixed bucket counters behind a lock, so observing a value
+costs a few microseconds and they can stay on in production. Every web
+worker keeps its own; /metrics reports the worker that served the scrape
+(label the scrape target per worker, or run one worker per port, to see
+all of them).
+
+profile() is an opt-in sampling profiler: it samples the stacks of all
+threads every few milliseconds and returns them in the folded format of
+flamegraph.pl / speedscope.
+"""
+import bisect
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+PROFILER_ENABLED = os.environ.get('PROFILER_ENABLED') == '1'
+PROFILER_MAX_SECONDS = 60
+
+# Seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Statements per request
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+
+
+class Histogram:
+    """Cumulative bucket histogram with a fixed set of label names"""
+
+    def __init__(self, name, documentation, labelnames, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [count per bucket (+Inf last), sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, list(counts), total) for labels, (counts, total) in self._series.items())
+        for labels, counts, total in series:
+            label_text = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, labels))
+            separator = ',' if label_text else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label_text}{separator}le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {total}")
+            lines.append(f"{self.name}_count{{{label_text}}} {cumulative}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+request_seconds = Histogram('visited_request_seconds', 'Time to produce a response (first byte for streams)',
+                            ('endpoint', 'method', 'status'))
+request_queries = Histogram('visited_request_sql_queries', 'SQL statements executed per request',
+                            ('endpoint',), QUERY_BUCKETS)
+request_sql_seconds = Histogram('visited_request_sql_seconds', 'Time spent executing SQL per request',
+                                ('endpoint',))
+face_stage_seconds = Histogram('visited_face_stage_seconds',
+                               'Face pipeline stage timings (detect per frame, embed per batch)', ('stage',))
+
+
+def observe_request(endpoint, method, status, seconds, queries, sql_seconds):
+    request_seconds.observe((endpoint, method, str(status)), seconds)
+    request_queries.observe((endpoint,), queries)
+    request_sql_seconds.observe((endpoint,), sql_seconds)
+
+
+def observe_stages(timings):
+    """Record (stage, seconds) pairs, e.g. the timings returned by an inference process"""
+    for stage, seconds in timings:
+        face_stage_seconds.observe((stage,), seconds)
+
+
+def render(extra=None):
+    """All metrics in the Prometheus text exposition format.
+
+    extra maps more metric names to (type, documentation, value), e.g. the
+    counters the verification pool and the dashboard cache keep themselves.
+    """
+    lines = []
+    for histogram in (request_seconds, request_queries, request_sql_seconds, face_stage_seconds):
+        lines.extend(histogram.render())
+    for name, (metric_type, documentation, value) in (extra or {}).items():
+        lines.extend([f"# HELP {name} {documentation}", f"# TYPE {name} {metric_type}", f"{name} {value}"])
+    return '\n'.join(lines) + '\n'
+
+
+_profiling = threading.Lock()
+
+
+def profile(seconds, interval=0.005):
+    """Sample every thread's stack for `seconds` and return folded stacks ("a;b;c count" lines)"""
+    if not _profiling.acquire(blocking=False):
+        raise RuntimeError("A profile is already running")
+    try:
+        me = threading.get_ident()
+        samples = Counter()
+        deadline = time.monotonic() + min(seconds, PROFILER_MAX_SECONDS)
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                samples[';'.join(reversed(stack))] += 1
+            time.sleep(interval)
+    finally:
+        _profiling.release()
+    return ''.join(f"{stack} {count}\n" for stack, count in samples.most_common())
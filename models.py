@@ -1,9 +1,82 @@
 import sqlite3
 from datetime import datetime
 import hashlib
+import os
+import queue
+import time
+
+import face_store
+import summary
+
+DATABASE = os.environ.get('DATABASE', 'attendance.db')
+
+# Applied once to every new connection
+CONNECTION_PRAGMAS = (
+    'PRAGMA journal_mode = WAL',        # readers don't block the writer
+    'PRAGMA busy_timeout = 5000',       # wait for a lock instead of "database is locked"
+    'PRAGMA synchronous = NORMAL',      # safe with WAL, far fewer fsyncs
+    'PRAGMA cache_size = -16000',       # 16 MB page cache
+    'PRAGMA temp_store = MEMORY',
+)
+
+class TimedConnection(sqlite3.Connection):
+    """Connection that counts its statements and the time spent in execute().
+
+    For SQLite, execute() runs the statement up to its first row, so this is
+    most of the query time; fetching the remaining rows is not included.
+    """
+    queries = 0
+    query_seconds = 0.0
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.queries += 1
+            self.query_seconds += time.perf_counter() - start
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self.queries += 1
+            self.query_seconds += time.perf_counter() - start
+
+def get_connection():
+    """Open a connection to the attendance database with rows accessible by column name"""
+    # uri=True so archive.py can attach the term archives read-only (file:...?mode=ro)
+    conn = sqlite3.connect(DATABASE, timeout=5, cached_statements=256, check_same_thread=False,
+                           factory=TimedConnection, uri=True)
+    conn.row_factory = sqlite3.Row
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+class ConnectionPool:
+    """Keeps up to `size` idle connections open so requests don't pay the connect and pragma cost"""
+
+    def __init__(self, size=8):
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return get_connection()
+
+    def release(self, conn):
+        # Never hand out a connection with a transaction left open
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
 
 def init_db():
-    conn = sqlite3.connect('attendance.db')
+    conn = sqlite3.connect(DATABASE)
     c = conn.cursor()
     
     c.execute('''CREATE TABLE IF NOT EXISTS students
@@ -65,13 +138,38 @@ def init_db():
                   FOREIGN KEY (student_id) REFERENCES students (id),
                   FOREIGN KEY (module_id) REFERENCES modules (id),
                   FOREIGN KEY (session_id) REFERENCES sessions (id))''')
-    
+
+    # Precomputed face embeddings of the registered student photos
+    c.execute('''CREATE TABLE IF NOT EXISTS face_embeddings
+                 (student_id INTEGER PRIMARY KEY,
+                  model_name TEXT NOT NULL,
+                  detector_backend TEXT NOT NULL,
+                  model_version TEXT NOT NULL,
+                  face_image TEXT NOT NULL,
+                  image_mtime REAL NOT NULL,
+                  embedding BLOB NOT NULL,
+                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                  FOREIGN KEY (student_id) REFERENCES students (id))''')
+
+    # Face verification jobs, so any web worker can answer a status poll
+    c.execute('''CREATE TABLE IF NOT EXISTS verification_jobs
+                 (id TEXT PRIMARY KEY,
+                  student_id INTEGER NOT NULL,
+                  module_id INTEGER NOT NULL,
+                  session_id INTEGER NOT NULL,
+                  status TEXT NOT NULL DEFAULT 'queued',
+                  success INTEGER,
+                  message TEXT,
+                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                  finished_at TIMESTAMP,
+                  FOREIGN KEY (student_id) REFERENCES students (id))''')
+
     conn.commit()
     conn.close()
 
 def update_db():
     """Update existing database to add the face_image column to students table and final_mark to student_modules"""
-    conn = sqlite3.connect('attendance.db')
+    conn = sqlite3.connect(DATABASE)
     c = conn.cursor()
     
     try:
@@ -92,11 +190,115 @@ def update_db():
             print("Added final_mark column to student_modules table")
         
         conn.commit()
+        
+        # Versioned schema changes
+        migrate(conn)
     except Exception as e:
         print(f"Error updating database: {e}")
     finally:
         conn.close()
 
+def add_hot_path_indexes(c):
+    """Add indexes for the attendance, enrollment and session lookups"""
+    # Keep only the first attendance row per student and session so the unique index can be built
+    c.execute('''DELETE FROM attendance WHERE id NOT IN
+                 (SELECT MIN(id) FROM attendance GROUP BY student_id, session_id)''')
+    c.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_attendance_student_session ON attendance (student_id, session_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_attendance_module_student_status ON attendance (module_id, student_id, status)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_student_modules_module_student ON student_modules (module_id, student_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_student_modules_student ON student_modules (student_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_sessions_module_date ON sessions (module_id, session_date, start_time)')
+
+def add_attendance_summary(c):
+    """Add the attendance_summary table behind the dashboard counts"""
+    c.execute('''CREATE TABLE IF NOT EXISTS attendance_summary
+                 (student_id INTEGER NOT NULL,
+                  module_id INTEGER NOT NULL,
+                  attended_sessions INTEGER NOT NULL DEFAULT 0,
+                  total_sessions INTEGER NOT NULL DEFAULT 0,
+                  last_attendance_time TIMESTAMP,
+                  PRIMARY KEY (student_id, module_id),
+                  FOREIGN KEY (student_id) REFERENCES students (id),
+                  FOREIGN KEY (module_id) REFERENCES modules (id))''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_attendance_summary_module ON attendance_summary (module_id)')
+    c.execute('DELETE FROM attendance_summary')
+    summary.populate(c)
+
+def add_cache_generations(c):
+    """Add the cache_generations table shared by the dashboard caches of all web workers"""
+    c.execute('''CREATE TABLE IF NOT EXISTS cache_generations
+                 (tag TEXT PRIMARY KEY,
+                  generation INTEGER NOT NULL)''')
+
+def add_face_store(c):
+    """Move the enrollment images into the content-addressed face store and track them in students.face_hash"""
+    c.execute('ALTER TABLE students ADD COLUMN face_hash TEXT')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_students_face_hash ON students (face_hash)')
+    for student_id, path in c.execute('SELECT id, face_image FROM students WHERE face_image IS NOT NULL').fetchall():
+        if not os.path.exists(path):
+            # What has_face_image used to check on every page load
+            c.execute('UPDATE students SET face_image = NULL WHERE id = ?', (student_id,))
+            continue
+        with open(path, 'rb') as f:
+            stored_path, digest = face_store.save(f.read(), normalize_image=False)
+        c.execute('UPDATE students SET face_image = ?, face_hash = ? WHERE id = ?', (stored_path, digest, student_id))
+    # The old uploads stay in static/uploads until `flask gc-face-store` deletes them
+
+def add_session_timestamps(c):
+    """Add start/end timestamps to sessions and an index for finding the sessions open now"""
+    # Generated from the date and times, so no write path can leave them out of date
+    c.execute("""ALTER TABLE sessions ADD COLUMN starts_at TEXT
+                 GENERATED ALWAYS AS (datetime(session_date || ' ' || start_time)) VIRTUAL""")
+    c.execute("""ALTER TABLE sessions ADD COLUMN ends_at TEXT
+                 GENERATED ALWAYS AS (datetime(session_date || ' ' || end_time)) VIRTUAL""")
+    # Open sessions of a module: ends_at >= now skips the past sessions, starts_at <= now is checked in the index
+    c.execute('CREATE INDEX IF NOT EXISTS idx_sessions_module_open ON sessions (module_id, ends_at, starts_at)')
+
+def add_provisional_checkins(c):
+    """Add the provisional_checkins table for check-ins taken while verification was overloaded"""
+    # status: pending -> verifying (claimed by a re-verification batch) -> confirmed or revoked
+    c.execute('''CREATE TABLE IF NOT EXISTS provisional_checkins
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  student_id INTEGER NOT NULL,
+                  module_id INTEGER NOT NULL,
+                  session_id INTEGER NOT NULL,
+                  frame_path TEXT NOT NULL,
+                  face_crop INTEGER NOT NULL DEFAULT 0,
+                  status TEXT NOT NULL DEFAULT 'pending',
+                  message TEXT,
+                  captured_at TIMESTAMP NOT NULL,
+                  claimed_at TIMESTAMP,
+                  resolved_at TIMESTAMP,
+                  FOREIGN KEY (student_id) REFERENCES students (id),
+                  FOREIGN KEY (module_id) REFERENCES modules (id),
+                  FOREIGN KEY (session_id) REFERENCES sessions (id))''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_provisional_checkins_status ON provisional_checkins (status, id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_provisional_checkins_module ON provisional_checkins (module_id, status)')
+
+# Schema migrations in order; PRAGMA user_version records how many have been applied
+MIGRATIONS = [
+    add_hot_path_indexes,
+    add_attendance_summary,
+    add_cache_generations,
+    add_face_store,
+    add_session_timestamps,
+    add_provisional_checkins,
+]
+
+def migrate(conn):
+    """Apply the migrations the database hasn't seen yet, each in its own transaction"""
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        try:
+            conn.execute('BEGIN')
+            migration(conn.cursor())
+            conn.execute(f'PRAGMA user_version = {number}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"Applied migration {number}: {migration.__doc__}")
+
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
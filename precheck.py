@@ -0,0 +1,139 @@
+"""Cheap checks that reject unusable frames before they reach the face recognizer.
+
+check_frame() runs on a downscaled grayscale copy of the upload: size,
+brightness, sharpness (variance of the Laplacian) and a Haar cascade face
+count. A frame that fails gets an immediate reason instead of a detection +
+VGG-Face pass that would fail anyway. The web workers call it through the
+verification pool (pool.check_frame), so under gunicorn it runs in the
+inference service and the workers never load OpenCV; OpenCV is imported on
+the first check.
+"""
+import logging
+import os
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PRECHECK_ENABLED = os.environ.get('PRECHECK_ENABLED', '1') == '1'
+# Smallest side of an uploaded image, in pixels
+MIN_IMAGE_SIZE = int(os.environ.get('PRECHECK_MIN_IMAGE_SIZE', '64'))
+# Mean gray level range of a usable frame (0-255)
+MIN_BRIGHTNESS = float(os.environ.get('PRECHECK_MIN_BRIGHTNESS', '40'))
+MAX_BRIGHTNESS = float(os.environ.get('PRECHECK_MAX_BRIGHTNESS', '220'))
+# Variance of the Laplacian below which the frame is too blurry
+MIN_SHARPNESS = float(os.environ.get('PRECHECK_MIN_SHARPNESS', '20'))
+# Widths the frame is scaled down to for the quality checks and for the face count
+CHECK_WIDTH = int(os.environ.get('PRECHECK_WIDTH', '320'))
+DETECT_WIDTH = int(os.environ.get('PRECHECK_DETECT_WIDTH', '160'))
+
+STAGES = ('decode', 'size', 'brightness', 'blur', 'face_count')
+
+_lock = threading.Lock()
+_cascade = None
+stats = {
+    'checked': 0,
+    'passed': 0,
+    'rejected': {stage: 0 for stage in STAGES},
+    'seconds_total': 0.0,
+}
+
+
+def _face_cascade():
+    # The same Haar cascade the 'opencv' DeepFace detector uses
+    global _cascade
+    if _cascade is None:
+        import cv2
+        cascade = cv2.CascadeClassifier(os.path.join(cv2.data.haarcascades, 'haarcascade_frontalface_default.xml'))
+        if cascade.empty():
+            logger.warning("Haar face cascade not found, the face count pre-check is skipped")
+        _cascade = cascade
+    return _cascade
+
+
+def count_faces(gray):
+    """Number of faces the Haar cascade finds in a small grayscale image, None if unavailable"""
+    import cv2
+    cascade = _face_cascade()
+    if cascade.empty():
+        return None
+    height, width = gray.shape[:2]
+    if width > DETECT_WIDTH:
+        gray = cv2.resize(gray, (DETECT_WIDTH, round(height * DETECT_WIDTH / width)), interpolation=cv2.INTER_AREA)
+    faces = cascade.detectMultiScale(gray, scaleFactor=1.2, minNeighbors=4, minSize=(20, 20))
+    return len(faces)
+
+
+def _check(image_data, face_crop):
+    import cv2
+    import numpy as np
+
+    image = cv2.imdecode(np.frombuffer(image_data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        return 'decode', "Uploaded image could not be decoded"
+
+    height, width = image.shape[:2]
+    if min(height, width) < MIN_IMAGE_SIZE:
+        return 'size', f"Image is too small ({width}x{height}), move closer to the camera"
+
+    if width > CHECK_WIDTH:
+        image = cv2.resize(image, (CHECK_WIDTH, round(height * CHECK_WIDTH / width)), interpolation=cv2.INTER_AREA)
+
+    brightness = float(image.mean())
+    if brightness < MIN_BRIGHTNESS:
+        return 'brightness', "Image is too dark, find better lighting"
+    if brightness > MAX_BRIGHTNESS:
+        return 'brightness', "Image is too bright, avoid direct light behind or on the camera"
+
+    if cv2.Laplacian(image, cv2.CV_64F).var() < MIN_SHARPNESS:
+        return 'blur', "Image is too blurry, hold still and try again"
+
+    # Browser face crops were already found by the browser's detector and are too tight for the cascade
+    if not face_crop:
+        faces = count_faces(image)
+        if faces == 0:
+            return 'face_count', "No face found in the image, face the camera"
+        if faces is not None and faces > 1:
+            return 'face_count', "More than one face in the image, only you should be in the frame"
+    return None, None
+
+
+def check_frame(image_data, face_crop=False, record_metrics=True):
+    """Return (ok, reason) for an encoded upload; reason says why it was rejected"""
+    if not PRECHECK_ENABLED:
+        return True, None
+    start = time.perf_counter()
+    stage, reason = _check(image_data, face_crop)
+    seconds = time.perf_counter() - start
+    if record_metrics:
+        metrics.observe_stages([('precheck', seconds)])
+    with _lock:
+        stats['checked'] += 1
+        stats['seconds_total'] += seconds
+        if stage:
+            stats['rejected'][stage] += 1
+        else:
+            stats['passed'] += 1
+    return stage is None, reason
+
+
+def status(avg_inference_seconds=None):
+    """Rejection rate per stage, and the recognizer time the rejections saved"""
+    with _lock:
+        checked = stats['checked']
+        rejected = dict(stats['rejected'])
+        seconds_total = stats['seconds_total']
+        passed = stats['passed']
+    total_rejected = sum(rejected.values())
+    return {
+        'enabled': PRECHECK_ENABLED,
+        'checked': checked,
+        'passed': passed,
+        'rejected': rejected,
+        'rejection_rate': {stage: count / checked for stage, count in rejected.items()} if checked else None,
+        'avg_check_seconds': seconds_total / checked if checked else None,
+        # Each rejected frame would have cost one recognizer pass
+        'seconds_saved': total_rejected * avg_inference_seconds - seconds_total if avg_inference_seconds else None,
+    }
@@ -0,0 +1,298 @@
+"""Provisional check-ins, taken while face verification is overloaded.
+
+Once the expected verification wait reaches PROVISIONAL_WAIT_SECONDS (or
+the queue is full), process_attendance stores the frame under
+PROVISIONAL_FOLDER and writes a 'Provisional' attendance row at once
+instead of making the student wait.
+The Reverifier thread of each web process later claims the stored frames in
+batches, whenever the verification pool has an idle worker, and runs them
+through verify_faces_task (the stored enrollment embeddings and one batched
+inference call). A verified check-in becomes a Present row with its capture
+time; any other is deleted, so the student is absent again (and may retry
+while the session is open). A kiosk that identifies the student first
+confirms the check-in at once. The module page shows the lecturer the
+outcomes.
+
+Provisional rows don't count as attended in attendance_summary until they
+are confirmed.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import live_feed
+import models
+import summary
+from cache import cache as dashboard_cache
+from verification_pool import pool as verification_pool, PoolBusy, verify_faces_task
+
+logger = logging.getLogger(__name__)
+
+# Expected verification wait (seconds) from which check-ins are taken provisionally; 0 disables
+PROVISIONAL_WAIT_SECONDS = float(os.environ.get('PROVISIONAL_WAIT_SECONDS', '5'))
+PROVISIONAL_FOLDER = os.environ.get('PROVISIONAL_FOLDER', 'provisional_frames')
+# Frames per re-verification batch and how often an idle reverifier looks for work
+REVERIFY_BATCH = int(os.environ.get('REVERIFY_BATCH', '32'))
+REVERIFY_INTERVAL = float(os.environ.get('REVERIFY_INTERVAL', '5'))
+# How long the reverifier waits for a batch before handing its check-ins back to the queue
+REVERIFY_TIMEOUT = float(os.environ.get('REVERIFY_TIMEOUT', '120'))
+# A batch claimed longer ago than this belonged to a process that died; it is claimed again
+CLAIM_TIMEOUT = timedelta(minutes=10)
+
+stats = {'recorded': 0, 'confirmed': 0, 'revoked': 0, 'failed_batches': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(**increments):
+    with _stats_lock:
+        for key, value in increments.items():
+            stats[key] += value
+
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def should_defer(pool):
+    """True when a check-in should be taken provisionally instead of queued.
+
+    Compares the pool's estimate of how long its backlog takes to drain,
+    not the raw job count (which also counts jobs waiting for a
+    micro-batch), and unrounded, so an idle pool never defers. With the
+    shared inference service the estimate covers the check-ins of every
+    web process.
+    """
+    return 0 < PROVISIONAL_WAIT_SECONDS <= pool.backlog_seconds()
+
+
+def record(conn, student_id, module_id, session_id, image_data, face_crop, folder=PROVISIONAL_FOLDER):
+    """Store the frame and write a Provisional attendance row; returns the response for the student"""
+    captured_at = _now()
+    try:
+        conn.execute('''INSERT INTO attendance (student_id, module_id, session_id, status, attendance_time)
+                        VALUES (?, ?, ?, 'Provisional', ?)''', (student_id, module_id, session_id, captured_at))
+    except sqlite3.IntegrityError:
+        conn.rollback()
+        return {'success': True, 'message': 'Attendance already marked for this session!'}
+
+    path = os.path.join(folder, f"{uuid.uuid4().hex}.jpg")
+    try:
+        os.makedirs(folder, exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(image_data)
+        conn.execute('''INSERT INTO provisional_checkins
+                        (student_id, module_id, session_id, frame_path, face_crop, captured_at)
+                        VALUES (?, ?, ?, ?, ?, ?)''',
+                     (student_id, module_id, session_id, path, bool(face_crop), captured_at))
+        # Commits with the cache generation bump
+        dashboard_cache.invalidate(conn, f'student:{student_id}')
+    except Exception:
+        conn.rollback()
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    _count(recorded=1)
+    return {'success': True, 'provisional': True,
+            'message': 'Check-in received. It will be confirmed once your face has been verified.'}
+
+
+def claim(conn, limit=REVERIFY_BATCH):
+    """Mark up to `limit` pending check-ins as being verified by this process and return them"""
+    now = datetime.now()
+    stale = (now - CLAIM_TIMEOUT).strftime('%Y-%m-%d %H:%M:%S')
+    # A plain read first: an idle reverifier must not take the write lock from the check-ins
+    if not conn.execute('''SELECT 1 FROM provisional_checkins WHERE status = 'pending'
+                           OR (status = 'verifying' AND claimed_at < ?) LIMIT 1''', (stale,)).fetchone():
+        return []
+    # IMMEDIATE takes the write lock first, so two processes never claim the same rows
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute('''UPDATE provisional_checkins SET status = 'pending', claimed_at = NULL
+                        WHERE status = 'verifying' AND claimed_at < ?''', (stale,))
+        checkins = conn.execute('''SELECT * FROM provisional_checkins WHERE status = 'pending'
+                                   ORDER BY id LIMIT ?''', (limit,)).fetchall()
+        conn.executemany("UPDATE provisional_checkins SET status = 'verifying', claimed_at = ? WHERE id = ?",
+                         [(now.strftime('%Y-%m-%d %H:%M:%S'), checkin['id']) for checkin in checkins])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return checkins
+
+
+def release(conn, checkins):
+    """Hand claimed check-ins back to the queue (the batch could not be verified now)"""
+    conn.executemany("UPDATE provisional_checkins SET status = 'pending', claimed_at = NULL WHERE id = ?",
+                     [(checkin['id'],) for checkin in checkins])
+    conn.commit()
+
+
+def remove_frames(paths):
+    """Delete stored check-in frames that have been resolved"""
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def confirm(conn, student_id, module_id, session_id, attendance_time, message):
+    """Upgrade the student's Provisional row in the session to Present, in the caller's transaction.
+
+    For a student identified another way (the kiosk) before the frame was
+    re-verified; the row gets the identification time. Returns None if the
+    student had no provisional row, else the frame paths of the check-ins
+    it confirmed, for the caller to remove once it has committed.
+    """
+    deleted = conn.execute('''DELETE FROM attendance WHERE student_id = ? AND session_id = ?
+                              AND status = 'Provisional' ''', (student_id, session_id)).rowcount
+    if not deleted:
+        return None
+    # A new row, so the lecturer's live feed picks it up
+    conn.execute('''INSERT INTO attendance (student_id, module_id, session_id, status, attendance_time)
+                    VALUES (?, ?, ?, 'Present', ?)''', (student_id, module_id, session_id, attendance_time))
+    summary.record_attendance(conn, student_id, module_id, attendance_time)
+    checkins = conn.execute('''SELECT id, frame_path FROM provisional_checkins WHERE student_id = ? AND session_id = ?
+                               AND status IN ('pending', 'verifying')''', (student_id, session_id)).fetchall()
+    conn.executemany("UPDATE provisional_checkins SET status = 'confirmed', message = ?, resolved_at = ? WHERE id = ?",
+                     [(message, _now(), checkin['id']) for checkin in checkins])
+    _count(confirmed=len(checkins))
+    return [checkin['frame_path'] for checkin in checkins]
+
+
+def resolve(conn, outcomes):
+    """Promote or revoke check-ins; outcomes are (checkin, verified, message) tuples. Returns the counts."""
+    confirmed = revoked = 0
+    resolved_at = _now()
+    conn.execute('BEGIN')
+    try:
+        for checkin, verified, message in outcomes:
+            # Skip check-ins confirm() resolved while the batch ran (the kiosk identified the student)
+            if not conn.execute('''UPDATE provisional_checkins SET status = ?, message = ?, resolved_at = ?
+                                   WHERE id = ? AND status = 'verifying' ''',
+                                ('confirmed' if verified else 'revoked', message, resolved_at,
+                                 checkin['id'])).rowcount:
+                continue
+            deleted = conn.execute('''DELETE FROM attendance WHERE student_id = ? AND session_id = ?
+                                      AND status = 'Provisional' ''',
+                                   (checkin['student_id'], checkin['session_id'])).rowcount
+            if verified and deleted:
+                # A new row, so the lecturer's live feed picks it up
+                conn.execute('''INSERT INTO attendance (student_id, module_id, session_id, status, attendance_time)
+                                VALUES (?, ?, ?, 'Present', ?)''',
+                             (checkin['student_id'], checkin['module_id'], checkin['session_id'],
+                              checkin['captured_at']))
+                summary.record_attendance(conn, checkin['student_id'], checkin['module_id'], checkin['captured_at'])
+            confirmed += bool(verified)
+            revoked += not verified
+        tags = {f'module:{checkin["module_id"]}' for checkin, _, _ in outcomes}
+        tags.update(f'student:{checkin["student_id"]}' for checkin, _, _ in outcomes)
+        # Commits with the cache generation bump
+        dashboard_cache.invalidate(conn, *tags)
+    except Exception:
+        conn.rollback()
+        raise
+
+    remove_frames(checkin['frame_path'] for checkin, _, _ in outcomes)
+    if confirmed:
+        live_feed.notify()
+    _count(confirmed=confirmed, revoked=revoked)
+    return {'confirmed': confirmed, 'revoked': revoked}
+
+
+def run_batch(conn, pool, limit=REVERIFY_BATCH):
+    """Verify one batch of pending check-ins on the pool and wait for it.
+
+    Returns the confirmed/revoked counts, or None if there was nothing to do
+    or the pool could not take the batch.
+    """
+    checkins = claim(conn, limit)
+    if not checkins:
+        return None
+
+    outcomes, items, queued = [], [], []
+    for checkin in checkins:
+        try:
+            with open(checkin['frame_path'], 'rb') as f:
+                items.append((f.read(), checkin['student_id'], bool(checkin['face_crop'])))
+            queued.append(checkin)
+        except FileNotFoundError:
+            outcomes.append((checkin, False, 'The check-in frame was lost before it could be verified'))
+
+    if items:
+        try:
+            job = pool.submit(verify_faces_task, items)
+        except PoolBusy:
+            release(conn, queued)
+            queued = []
+        else:
+            if not job.wait(REVERIFY_TIMEOUT):
+                # Its outcome is dropped when it does finish; the check-ins go into a later batch
+                logger.error(f"Provisional re-verification batch timed out after {REVERIFY_TIMEOUT:g}s")
+                _count(failed_batches=1)
+                release(conn, queued)
+                queued = []
+            elif job.error:
+                logger.error(f"Provisional re-verification batch failed: {job.error}")
+                _count(failed_batches=1)
+                release(conn, queued)
+                queued = []
+            else:
+                outcomes.extend((checkin, result['verified'], result['message'])
+                                for checkin, result in zip(queued, job.result))
+    if not outcomes:
+        return None
+    return resolve(conn, outcomes)
+
+
+class Reverifier:
+    """Background thread re-verifying the pending check-ins whenever the pool has an idle worker"""
+
+    def __init__(self, pool, interval=REVERIFY_INTERVAL):
+        self.pool = pool
+        self.interval = interval
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='provisional-reverifier', daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        conn = models.get_connection()
+        while True:
+            try:
+                # Live check-ins come first: only take a batch while a worker is idle
+                if self.pool.pending < self.pool.max_workers and run_batch(conn, self.pool):
+                    continue
+            except Exception:
+                logger.exception("Provisional re-verification failed")
+            time.sleep(self.interval)
+
+
+reverifier = Reverifier(verification_pool)
+
+
+def module_report(conn, module_id, limit=20):
+    """Provisional check-in counts of a module by status, and the most recently revoked ones"""
+    counts = {row['status']: row['count'] for row in conn.execute(
+        'SELECT status, COUNT(*) AS count FROM provisional_checkins WHERE module_id = ? GROUP BY status', (module_id,))}
+    revoked = conn.execute('''SELECT p.captured_at, p.message, st.id AS student_id, st.name, st.surname,
+                                     s.session_date, s.start_time
+                              FROM provisional_checkins p
+                              JOIN students st ON st.id = p.student_id
+                              JOIN sessions s ON s.id = p.session_id
+                              WHERE p.module_id = ? AND p.status = 'revoked'
+                              ORDER BY p.id DESC LIMIT ?''', (module_id, limit)).fetchall()
+    return {
+        'awaiting': counts.get('pending', 0) + counts.get('verifying', 0),
+        'confirmed': counts.get('confirmed', 0),
+        'revoked': counts.get('revoked', 0),
+        'recent_revoked': revoked,
+    }
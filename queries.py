@@ -0,0 +1,105 @@
+"""Read queries shared by the dashboard, module and export pages.
+
+The per-module counts come from the attendance_summary table (see summary.py),
+which the write routes keep up to date, so a dashboard reads one row per
+module instead of aggregating the attendance history. CROSS JOIN fixes the
+join order so SQLite starts from the summary's primary key or module index.
+"""
+import itertools
+from datetime import datetime
+
+
+def student_modules_with_attendance(conn, student_id):
+    """Modules a student is enrolled in, with total and attended session counts"""
+    return conn.execute('''
+        SELECT m.*, su.total_sessions, su.attended_sessions, su.last_attendance_time
+        FROM attendance_summary su
+        CROSS JOIN modules m ON m.id = su.module_id
+        WHERE su.student_id = ?
+        ORDER BY m.id
+    ''', (student_id,)).fetchall()
+
+
+def module_students_with_attendance(conn, module_id):
+    """Students enrolled in a module with their final mark and attendance counts"""
+    return conn.execute('''
+        SELECT s.*, sm.final_mark, su.total_sessions, su.attended_sessions, su.last_attendance_time
+        FROM student_modules sm
+        CROSS JOIN students s ON s.id = sm.student_id
+        CROSS JOIN attendance_summary su ON su.student_id = sm.student_id AND su.module_id = sm.module_id
+        WHERE sm.module_id = ?
+        ORDER BY sm.student_id
+    ''', (module_id,)).fetchall()
+
+
+def attendance_register(conn, module_id, today=None):
+    """Students x sessions attendance matrix of a module, generated one row at a time.
+
+    Yields a header row first, then one row per enrolled student with their
+    status for every session (Absent if not marked, blank for sessions still
+    to come) and the final mark. Rows come straight from the cursor, so a
+    large module is never held in memory.
+    """
+    today = (today or datetime.now().date()).isoformat()
+    sessions = conn.execute('''SELECT id, session_date, start_time FROM sessions WHERE module_id = ?
+                               ORDER BY session_date, start_time''', (module_id,)).fetchall()
+    yield (['Student ID', 'Name', 'Surname', 'Email']
+           + [f"{s['session_date']} {s['start_time']}" for s in sessions]
+           + ['Attended', 'Final Mark'])
+
+    cursor = conn.execute('''
+        SELECT s.id, s.name, s.surname, s.email, sm.final_mark, a.session_id, a.status
+        FROM student_modules sm
+        CROSS JOIN students s ON s.id = sm.student_id
+        LEFT JOIN attendance a ON a.module_id = sm.module_id AND a.student_id = sm.student_id
+        WHERE sm.module_id = ?
+        ORDER BY sm.student_id
+    ''', (module_id,))
+    for _, rows in itertools.groupby(cursor, key=lambda row: row['id']):
+        rows = list(rows)
+        student = rows[0]
+        statuses = {row['session_id']: row['status'] for row in rows if row['session_id'] is not None}
+        cells = [statuses.get(s['id']) or ('Absent' if s['session_date'] <= today else '') for s in sessions]
+        yield ([student['id'], student['name'], student['surname'], student['email']]
+               + cells
+               + [cells.count('Present'), student['final_mark']])
+
+
+def student_module_attendance(conn, student_id, module_id):
+    """Every session of a module with the student's attendance, plus summary counts"""
+    records = conn.execute('''
+        SELECT s.id, s.session_date, s.start_time, s.end_time, s.starts_at, s.ends_at, a.status, a.attendance_time
+        FROM sessions s
+        LEFT JOIN attendance a ON s.id = a.session_id AND a.student_id = ?
+        WHERE s.module_id = ?
+        ORDER BY s.session_date DESC, s.start_time DESC
+    ''', (student_id, module_id)).fetchall()
+
+    # Counted by SQLite: measured faster than counting the fetched rows in Python
+    stats = conn.execute('''
+        SELECT
+            (SELECT COUNT(*) FROM sessions WHERE module_id = ?) as total_sessions,
+            COUNT(a.id) as attended_sessions
+        FROM attendance a
+        JOIN sessions s ON a.session_id = s.id
+        WHERE a.student_id = ? AND s.module_id = ? AND a.status = 'Present'
+    ''', (module_id, student_id, module_id)).fetchone()
+    return records, stats
+
+
+def open_sessions(conn, student_id, now=None):
+    """Sessions running now in any of the student's modules, with whether attendance is already marked.
+
+    One indexed range lookup (idx_sessions_module_open) per enrolled module.
+    """
+    now = (now or datetime.now()).strftime('%Y-%m-%d %H:%M:%S')
+    return conn.execute('''
+        SELECT s.id, s.module_id, m.code, m.name, s.session_date, s.start_time, s.end_time, s.ends_at,
+               a.id IS NOT NULL AS marked
+        FROM sessions s
+        JOIN modules m ON m.id = s.module_id
+        LEFT JOIN attendance a ON a.session_id = s.id AND a.student_id = :student_id
+        WHERE s.module_id IN (SELECT module_id FROM student_modules WHERE student_id = :student_id)
+          AND s.ends_at >= :now AND s.starts_at <= :now
+        ORDER BY s.ends_at
+    ''', {'student_id': student_id, 'now': now}).fetchall()
@@ -0,0 +1,76 @@
+"""Per student, per module attendance totals kept in the attendance_summary table.
+
+The write routes update the table incrementally through the functions below,
+so the dashboards read one indexed row per module instead of aggregating the
+attendance history. rebuild() recomputes it from scratch and check() lists the
+rows that drifted from the raw tables.
+"""
+
+# Summary rows as computed from the raw tables
+AGGREGATE_SQL = '''
+    SELECT sm.student_id, sm.module_id,
+           COALESCE(at.attended_sessions, 0) AS attended_sessions,
+           COALESCE(sc.total_sessions, 0) AS total_sessions,
+           at.last_attendance_time
+    FROM (SELECT DISTINCT student_id, module_id FROM student_modules) sm
+    LEFT JOIN (SELECT module_id, COUNT(*) AS total_sessions FROM sessions GROUP BY module_id) sc
+           ON sc.module_id = sm.module_id
+    LEFT JOIN (SELECT student_id, module_id, COUNT(*) AS attended_sessions, MAX(attendance_time) AS last_attendance_time
+               FROM attendance WHERE status = 'Present' GROUP BY student_id, module_id) at
+           ON at.student_id = sm.student_id AND at.module_id = sm.module_id
+'''
+
+
+def record_attendance(conn, student_id, module_id, attendance_time):
+    """Count a new Present row (call in the same transaction as the INSERT)"""
+    conn.execute('''UPDATE attendance_summary
+                    SET attended_sessions = attended_sessions + 1,
+                        last_attendance_time = MAX(COALESCE(last_attendance_time, ''), ?)
+                    WHERE student_id = ? AND module_id = ?''',
+                 (attendance_time, student_id, module_id))
+
+
+def add_sessions(conn, module_id, count=1):
+    """Count new sessions of a module for every enrolled student"""
+    conn.execute('UPDATE attendance_summary SET total_sessions = total_sessions + ? WHERE module_id = ?',
+                 (count, module_id))
+
+
+def add_enrollment(conn, student_id, module_id):
+    """Create the summary row of a newly enrolled student"""
+    add_enrollments(conn, module_id, [student_id])
+
+
+def add_enrollments(conn, module_id, student_ids):
+    """Create the summary rows of students newly enrolled in a module"""
+    conn.executemany('''INSERT OR REPLACE INTO attendance_summary
+                        (student_id, module_id, attended_sessions, total_sessions, last_attendance_time)
+                        SELECT :student_id, :module_id,
+                               (SELECT COUNT(*) FROM attendance
+                                WHERE student_id = :student_id AND module_id = :module_id AND status = 'Present'),
+                               (SELECT COUNT(*) FROM sessions WHERE module_id = :module_id),
+                               (SELECT MAX(attendance_time) FROM attendance
+                                WHERE student_id = :student_id AND module_id = :module_id AND status = 'Present')''',
+                     [{'student_id': student_id, 'module_id': module_id} for student_id in student_ids])
+
+
+def populate(c):
+    """Insert the aggregated rows into an empty table (no commit, used by the migration)"""
+    c.execute('''INSERT INTO attendance_summary
+                 (student_id, module_id, attended_sessions, total_sessions, last_attendance_time)''' + AGGREGATE_SQL)
+
+
+def rebuild(conn):
+    """Recompute the whole table from attendance, sessions and student_modules"""
+    conn.execute('DELETE FROM attendance_summary')
+    populate(conn)
+    conn.commit()
+    return conn.execute('SELECT COUNT(*) FROM attendance_summary').fetchone()[0]
+
+
+def check(conn):
+    """Return (missing_or_wrong, unexpected) rows comparing the table with a fresh aggregate"""
+    columns = 'student_id, module_id, attended_sessions, total_sessions, last_attendance_time'
+    expected_only = conn.execute(f'{AGGREGATE_SQL} EXCEPT SELECT {columns} FROM attendance_summary').fetchall()
+    stored_only = conn.execute(f'SELECT {columns} FROM attendance_summary EXCEPT {AGGREGATE_SQL}').fetchall()
+    return expected_only, stored_only
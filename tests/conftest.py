@@ -0,0 +1,49 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models
+import summary
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    """A connection to a fresh, fully migrated attendance database"""
+    monkeypatch.setattr(models, 'DATABASE', str(tmp_path / 'attendance.db'))
+    models.init_db()
+    models.update_db()
+    conn = models.get_connection()
+    yield conn
+    conn.close()
+
+
+def seed(conn, students=6, modules=2, sessions=(('2025-02-03', '2025-03-03'), ('2026-02-02',))):
+    """Students enrolled in every module, with sessions on the given dates and attendance on most of them"""
+    for i in range(1, students + 1):
+        conn.execute('''INSERT INTO students (name, surname, email, course, Faculty, password)
+                        VALUES (?, ?, ?, 'Course', 'FAC', 'x')''', (f'Name{i}', f'Surname{i}', f'{i}@dut4life.ac.za'))
+    conn.execute("INSERT INTO lecturers (name, surname, email, Faculty, password) VALUES ('L', 'L', 'l@dut.ac.za', 'FAC', 'x')")
+    for module_id in range(1, modules + 1):
+        conn.execute("INSERT INTO modules (name, code, Faculty, lecturer_id) VALUES (?, ?, 'FAC', 1)",
+                     (f'Module {module_id}', f'M{module_id}'))
+        for student_id in range(1, students + 1):
+            conn.execute('''INSERT INTO student_modules (student_id, module_id, final_mark, enrolled_at)
+                            VALUES (?, ?, ?, '2025-01-10 08:00:00')''', (student_id, module_id, 50 + student_id))
+        for term_dates in sessions:
+            for session_date in term_dates:
+                session_id = conn.execute('''INSERT INTO sessions (module_id, session_date, start_time, end_time)
+                                             VALUES (?, ?, '08:00', '09:00')''',
+                                          (module_id, session_date)).lastrowid
+                for student_id in range(1, students + 1):
+                    # Every (student + session)th row is missing, and some rows are provisional
+                    if (student_id + session_id) % 4 == 0:
+                        continue
+                    status = 'Provisional' if (student_id * session_id) % 7 == 0 else 'Present'
+                    conn.execute('''INSERT INTO attendance (student_id, module_id, session_id, status, attendance_time)
+                                    VALUES (?, ?, ?, ?, ?)''',
+                                 (student_id, module_id, session_id, status, f'{session_date} 08:{student_id:02d}:00'))
+    conn.commit()
+    summary.rebuild(conn)
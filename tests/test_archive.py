@@ -0,0 +1,103 @@
+import sqlite3
+from datetime import date
+
+import pytest
+
+import archive
+import queries
+import summary
+from conftest import seed
+
+TODAY = date(2026, 10, 16)
+TERMS = (('2025-S1', '2025-01-01', '2025-06-30'), ('2025-S2', '2025-07-01', '2025-12-31'))
+TERM_DATES = (('2025-02-03', '2025-03-03'), ('2025-08-04',), ('2026-02-02',))
+
+
+def count(conn, sql, *params):
+    return conn.execute(sql, params).fetchone()[0]
+
+
+def registers(conn, modules=(1, 2)):
+    return {module_id: list(queries.attendance_register(conn, module_id, today=TODAY)) for module_id in modules}
+
+
+def test_archive_term_copies_then_deletes_the_term(conn, tmp_path):
+    seed(conn, sessions=TERM_DATES)
+    term_sessions = count(conn, "SELECT COUNT(*) FROM sessions WHERE session_date < '2025-07-01'")
+    term_attendance = count(conn, '''SELECT COUNT(*) FROM attendance WHERE session_id IN
+                                     (SELECT id FROM sessions WHERE session_date < '2025-07-01')''')
+    live_attendance = count(conn, 'SELECT COUNT(*) FROM attendance') - term_attendance
+    folder = tmp_path / 'archive'
+
+    counts = archive.archive_term(conn, '2025-S1', '2025-01-01', '2025-06-30', folder=str(folder), today=TODAY)
+
+    # The modules still have sessions in the live database, so their enrollments stay
+    assert counts == {'sessions': term_sessions, 'attendance': term_attendance, 'enrollments': 0}
+    assert count(conn, "SELECT COUNT(*) FROM sessions WHERE session_date < '2025-07-01'") == 0
+    assert count(conn, 'SELECT COUNT(*) FROM attendance') == live_attendance
+    assert summary.check(conn) == ([], [])
+    assert count(conn, 'SELECT SUM(total_sessions) FROM attendance_summary') == 6 * 2 * 2
+
+    stored = sqlite3.connect(folder / '2025-S1.db')
+    assert count(stored, 'SELECT COUNT(*) FROM sessions') == term_sessions
+    assert count(stored, 'SELECT COUNT(*) FROM attendance') == term_attendance
+    assert count(stored, 'SELECT COUNT(*) FROM student_modules') == 6 * 2
+    assert count(stored, 'SELECT COUNT(*) FROM students') == 6
+    assert stored.execute('SELECT term, start_date, end_date FROM archive_info').fetchall() == [
+        ('2025-S1', '2025-01-01', '2025-06-30')]
+    stored.close()
+
+
+def test_archive_term_drops_enrollments_of_modules_that_ended(conn, tmp_path):
+    seed(conn, sessions=(('2025-02-03', '2025-03-03'),))
+
+    counts = archive.archive_term(conn, '2025-S1', '2025-01-01', '2025-06-30', folder=str(tmp_path), today=TODAY)
+
+    assert counts['enrollments'] == 6 * 2
+    assert count(conn, 'SELECT COUNT(*) FROM student_modules') == 0
+    assert count(conn, 'SELECT COUNT(*) FROM attendance_summary') == 0
+
+
+def test_archive_term_again_is_safe(conn, tmp_path):
+    seed(conn, sessions=TERM_DATES)
+    archive.archive_term(conn, '2025-S1', '2025-01-01', '2025-06-30', folder=str(tmp_path), today=TODAY)
+    counts = archive.archive_term(conn, '2025-S1', '2025-01-01', '2025-06-30', folder=str(tmp_path), today=TODAY)
+
+    assert counts == {'sessions': 0, 'attendance': 0, 'enrollments': 0}
+    stored = sqlite3.connect(tmp_path / '2025-S1.db')
+    assert count(stored, 'SELECT COUNT(*) FROM sessions') == 2 * 2
+    stored.close()
+
+
+@pytest.mark.parametrize('term, start, end', [('2026-S2', '2026-07-01', '2026-12-31'),
+                                              ('2025-S1', '2025-06-30', '2025-01-01'),
+                                              ('../x', '2025-01-01', '2025-06-30')])
+def test_archive_term_refuses(conn, tmp_path, term, start, end):
+    seed(conn, sessions=TERM_DATES)
+    with pytest.raises(ValueError):
+        archive.archive_term(conn, term, start, end, folder=str(tmp_path), today=TODAY)
+    assert count(conn, 'SELECT COUNT(*) FROM sessions') == 2 * 4
+
+
+@pytest.mark.parametrize('max_attached', [archive.MAX_ATTACHED, 1])
+def test_reporting_connection_reports_across_terms(conn, tmp_path, monkeypatch, max_attached):
+    # max_attached=1 copies the archives into temporary tables one at a time
+    monkeypatch.setattr(archive, 'MAX_ATTACHED', max_attached)
+    seed(conn, sessions=TERM_DATES)
+    conn.execute("UPDATE student_modules SET final_mark = 90 WHERE student_id = 1")
+    conn.commit()
+    expected = registers(conn)
+    folder = str(tmp_path / 'archive')
+    for term, start, end in TERMS:
+        archive.archive_term(conn, term, start, end, folder=folder, today=TODAY)
+    assert count(conn, 'SELECT COUNT(*) FROM sessions') == 2
+
+    reporting = archive.reporting_connection(folder=folder)
+    try:
+        assert registers(reporting) == expected
+        # The live enrollment wins over the archived snapshots of the same student and module
+        assert count(reporting, 'SELECT COUNT(*) FROM student_modules') == 6 * 2
+        with pytest.raises(sqlite3.OperationalError):
+            reporting.execute('DELETE FROM main.attendance')
+    finally:
+        reporting.close()
@@ -0,0 +1,112 @@
+import sqlite3
+
+import pytest
+
+import live_feed
+import models
+import provisional
+import summary
+from conftest import seed
+from verification_pool import VerificationPool
+
+
+@pytest.fixture
+def checkin(conn, tmp_path):
+    """Student 1 checked in provisionally to session 1 (module 1)"""
+    seed(conn, students=3, modules=1, sessions=(('2026-10-16',),))
+    conn.execute('DELETE FROM attendance WHERE student_id = 1')
+    conn.commit()
+    summary.rebuild(conn)
+    provisional.record(conn, 1, 1, 1, b'\xff\xd8frame', False, folder=str(tmp_path))
+    return conn.execute('SELECT * FROM provisional_checkins').fetchone()
+
+
+def attendance(conn):
+    return conn.execute('SELECT status, attendance_time FROM attendance WHERE student_id = 1').fetchall()
+
+
+def test_provisional_rows_do_not_count(conn, checkin):
+    assert [tuple(row) for row in attendance(conn)] == [('Provisional', checkin['captured_at'])]
+    assert summary.check(conn) == ([], [])
+    assert conn.execute('SELECT attended_sessions FROM attendance_summary WHERE student_id = 1').fetchone()[0] == 0
+
+
+def test_kiosk_confirm_writes_a_new_present_row(conn, checkin):
+    after = live_feed.latest_attendance_id(conn)
+
+    frames = provisional.confirm(conn, 1, 1, 1, '2026-10-16 09:30:00', 'Identified by the kiosk')
+    conn.commit()
+
+    assert frames == [checkin['frame_path']]
+    assert summary.check(conn) == ([], [])
+    rows = live_feed.new_attendance(conn, 1, after)
+    assert [(row['student_id'], row['status'], row['attendance_time']) for row in rows] == [
+        (1, 'Present', '2026-10-16 09:30:00')]
+    assert tuple(conn.execute('SELECT status, message FROM provisional_checkins').fetchone()) == (
+        'confirmed', 'Identified by the kiosk')
+    # Nothing left to confirm
+    assert provisional.confirm(conn, 1, 1, 1, '2026-10-16 09:31:00', 'Identified by the kiosk') is None
+
+
+def test_resolve_confirms_with_the_capture_time(conn, checkin):
+    after = live_feed.latest_attendance_id(conn)
+    claimed = provisional.claim(conn)
+
+    assert provisional.resolve(conn, [(claimed[0], True, 'Distance: 0.1')]) == {'confirmed': 1, 'revoked': 0}
+    assert summary.check(conn) == ([], [])
+    rows = live_feed.new_attendance(conn, 1, after)
+    assert [(row['status'], row['attendance_time']) for row in rows] == [('Present', checkin['captured_at'])]
+
+
+def test_resolve_revokes(conn, checkin):
+    claimed = provisional.claim(conn)
+
+    assert provisional.resolve(conn, [(claimed[0], False, 'No match')]) == {'confirmed': 0, 'revoked': 1}
+    assert attendance(conn) == []
+    assert summary.check(conn) == ([], [])
+
+
+def test_resolve_keeps_a_kiosk_confirmation(conn, checkin):
+    claimed = provisional.claim(conn)
+    provisional.confirm(conn, 1, 1, 1, '2026-10-16 09:30:00', 'Identified by the kiosk')
+    conn.commit()
+
+    assert provisional.resolve(conn, [(claimed[0], False, 'No match')]) == {'confirmed': 0, 'revoked': 0}
+    assert [row['status'] for row in attendance(conn)] == ['Present']
+    assert conn.execute('SELECT status FROM provisional_checkins').fetchone()[0] == 'confirmed'
+    assert summary.check(conn) == ([], [])
+
+
+def test_claim_without_pending_rows_takes_no_write_lock(conn):
+    writer = models.get_connection()
+    writer.execute('PRAGMA busy_timeout = 0')
+    writer.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute('PRAGMA busy_timeout = 0')
+        assert provisional.claim(conn) == []
+    finally:
+        writer.rollback()
+        writer.close()
+
+
+def test_claim_with_pending_rows_needs_the_write_lock(conn, checkin):
+    writer = models.get_connection()
+    writer.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute('PRAGMA busy_timeout = 0')
+        with pytest.raises(sqlite3.OperationalError):
+            provisional.claim(conn)
+    finally:
+        writer.rollback()
+        writer.close()
+
+
+def test_an_idle_pool_never_defers(monkeypatch):
+    monkeypatch.setattr(provisional, 'PROVISIONAL_WAIT_SECONDS', 0.5)
+    pool = VerificationPool(max_workers=2)
+
+    assert not provisional.should_defer(pool)
+    pool.pending = 2
+    assert provisional.should_defer(pool)
+    monkeypatch.setattr(provisional, 'PROVISIONAL_WAIT_SECONDS', 0)
+    assert not provisional.should_defer(pool)
@@ -0,0 +1,603 @@
+"""Face inference off the web request threads.
+
+VerificationPool runs the face tasks on a bounded pool of inference
+processes, each holding one copy of the model, with micro-batching of
+check-ins that arrive together.
+
+Under gunicorn, one VerificationPool runs in a separate inference service
+process started by the master (see gunicorn.conf.py); the web workers reach it
+through a RemotePool over a local socket. Then every worker shares the same
+model copies, max_pending limit and micro-batches. The pre-check of
+uploads and the normalization of enrollment images go through the pool
+too, so OpenCV and NumPy are only loaded by the service. Without
+FACE_SERVICE_ADDRESS (flask run, CLI commands) the pool runs in-process.
+"""
+import logging
+import math
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.managers import BaseManager
+
+import face_store
+import metrics
+import models
+import precheck
+
+logger = logging.getLogger(__name__)
+
+# Number of inference processes and how many jobs may be queued or running at once
+FACE_WORKERS = int(os.environ.get('FACE_WORKERS', '2'))
+FACE_MAX_PENDING = int(os.environ.get('FACE_MAX_PENDING', '32'))
+# Micro-batching of simultaneous check-ins: largest batch and how long to wait to fill it
+FACE_BATCH_SIZE = int(os.environ.get('FACE_BATCH_SIZE', '8'))
+FACE_BATCH_WAIT_MS = float(os.environ.get('FACE_BATCH_WAIT_MS', '25'))
+# Threads running the on_done callbacks (database writes), off the pool's result thread
+FACE_CALLBACK_THREADS = int(os.environ.get('FACE_CALLBACK_THREADS', '4'))
+# Unix socket (or host:port) of the shared inference service, and its shared secret
+FACE_SERVICE_ADDRESS = os.environ.get('FACE_SERVICE_ADDRESS')
+FACE_SERVICE_AUTHKEY = os.environ.get('FACE_SERVICE_AUTHKEY', '')
+
+
+class PoolBusy(Exception):
+    """Raised when the verification queue is full"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Face verification is busy, please retry in {retry_after} s")
+        self.retry_after = retry_after
+
+    def __reduce__(self):
+        # Raised again in the web worker when the inference service is full
+        return PoolBusy, (self.retry_after,)
+
+
+# Functions below run inside the inference processes. They import face_engine
+# themselves, so web processes importing this module never load OpenCV,
+# NumPy or DeepFace/TensorFlow.
+
+_worker_conn = None
+
+
+def _init_worker():
+    import face_engine
+    face_engine.preload()
+
+
+def _connection():
+    # One long-lived connection per inference process
+    global _worker_conn
+    if _worker_conn is None:
+        _worker_conn = models.get_connection()
+    return _worker_conn
+
+
+def engine_status():
+    import face_engine
+    return face_engine.engine.status()
+
+
+def verify_faces_task(items):
+    import face_engine
+    results = face_engine.verify_faces(_connection(), items)
+    return [{'verified': verified, 'message': message} for verified, message in results]
+
+
+def identify_task(module_id, image_data):
+    import face_engine
+    return {'faces': face_engine.identify(_connection(), module_id, image_data)}
+
+
+def prewarm_task(student_id):
+    """Make sure the student's stored embedding is current before they check in"""
+    import face_engine
+    embedding, message = face_engine.get_enrolled_embedding(_connection(), student_id)
+    return {'ready': embedding is not None, 'message': message}
+
+
+def store_embedding_task(student_id, face_image):
+    import face_engine
+    face_engine.store_embedding(_connection(), student_id, face_image)
+    return {'stored': True}
+
+
+def _run(task, args, enqueued_at):
+    import face_engine
+    started_at = time.time()
+    result = task(*args)
+    return {
+        'results': [result],
+        'queue_waits': [started_at - enqueued_at],
+        'inference_seconds': time.time() - started_at,
+        'stages': face_engine.take_stage_timings(),
+    }
+
+
+def _run_batch(task, items, enqueued_ats):
+    import face_engine
+    started_at = time.time()
+    results = task(items)
+    return {
+        'results': results,
+        'queue_waits': [started_at - enqueued_at for enqueued_at in enqueued_ats],
+        'inference_seconds': time.time() - started_at,
+        'stages': face_engine.take_stage_timings(),
+    }
+
+
+class Job:
+    """Handle for a submitted verification; wait() blocks until on_done has run"""
+
+    def __init__(self, on_done=None, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.result = None
+        self.error = None
+        self.outcome = None
+        self.on_done = on_done
+        # (stage, seconds) timings of this job: its queue wait, plus the batch stages for the first job of a batch
+        self.stages = []
+        self.enqueued_at = time.time()
+        self._done = threading.Event()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+
+def _run_callback(job):
+    try:
+        if job.on_done:
+            job.on_done(job)
+    except Exception:
+        logger.exception(f"Error finishing verification job {job.id}")
+    finally:
+        job._done.set()
+
+
+class MicroBatcher:
+    """Collects jobs for one batch task and flushes them to the pool together.
+
+    A batch is sent as soon as max_batch jobs are waiting, or max_wait_ms
+    after the first job of the batch arrived.
+    """
+
+    def __init__(self, pool, task, max_batch=FACE_BATCH_SIZE, max_wait_ms=FACE_BATCH_WAIT_MS):
+        self.pool = pool
+        self.task = task
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._waiting = []
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._loop, name=f"batcher-{task.__name__}", daemon=True)
+        self._thread.start()
+
+    def add(self, job, item):
+        with self._cond:
+            self._waiting.append((job, item))
+            self._cond.notify()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._waiting:
+                    self._cond.wait()
+                deadline = time.monotonic() + self.max_wait
+                while len(self._waiting) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._waiting[:self.max_batch]
+                del self._waiting[:self.max_batch]
+            self.pool._dispatch_batch(self.task, batch)
+
+
+class VerificationPool:
+    """Bounded pool of face inference processes.
+
+    Web requests submit jobs instead of running TensorFlow in the request
+    thread. Once max_pending jobs are queued or running, submit() raises
+    PoolBusy with an estimate of when to retry.
+    """
+
+    def __init__(self, max_workers=FACE_WORKERS, max_pending=FACE_MAX_PENDING, record_metrics=True):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        # The inference service leaves the stage timings to the web worker that submitted the job
+        self.record_metrics = record_metrics
+        self.pending = 0
+        self.engines = {}
+        self.stats = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'rejected_busy': 0,
+            'batches': 0,
+            'queue_wait_total': 0.0,
+            'queue_wait_max': 0.0,
+            'inference_total': 0.0,
+            'inference_max': 0.0,
+        }
+        self._executor = None
+        self._batchers = {}
+        self._callbacks = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Spawn the inference processes and load the model in each of them"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    # TensorFlow is not fork-safe, so workers start from a clean interpreter
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker
+                )
+                for _ in range(self.max_workers):
+                    self._executor.submit(engine_status).add_done_callback(self._record_engine)
+            return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+            if self._callbacks is not None:
+                self._callbacks.shutdown(wait=False)
+                self._callbacks = None
+
+    def _record_engine(self, future):
+        try:
+            status = future.result()
+            self.engines[status['pid']] = status
+        except Exception as e:
+            logger.error(f"Face worker failed to start: {e}")
+
+    def backlog_seconds(self):
+        """Estimated seconds until the current backlog has drained (0 with nothing queued or running)"""
+        completed = self.stats['completed']
+        average = self.stats['inference_total'] / completed if completed else 1.0
+        return self.pending / self.max_workers * average
+
+    def retry_after(self):
+        """Whole seconds a rejected client should wait before retrying"""
+        return max(1, math.ceil(self.backlog_seconds()))
+
+    def _reserve(self, on_done, job_id=None):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.stats['rejected_busy'] += 1
+                raise PoolBusy(self.retry_after())
+            self.pending += 1
+            self.stats['submitted'] += 1
+        return Job(on_done, job_id)
+
+    def submit(self, task, *args, on_done=None, job_id=None):
+        """Queue task(*args) on an inference process and return a Job.
+
+        on_done(job) is called from a callback thread once the result (or error) is known.
+        """
+        job = self._reserve(on_done, job_id)
+        try:
+            executor = self.start()
+            future = executor.submit(_run, task, args, job.enqueued_at)
+        except Exception:
+            with self._lock:
+                self.pending -= 1
+            raise
+        future.add_done_callback(lambda f: self._complete([job], f, executor))
+        return job
+
+    def submit_batched(self, task, item, on_done=None, job_id=None):
+        """Like submit(), but items arriving close together are run as one task(list_of_items) call"""
+        job = self._reserve(on_done, job_id)
+        with self._lock:
+            batcher = self._batchers.get(task)
+            if batcher is None:
+                batcher = self._batchers[task] = MicroBatcher(self, task)
+        batcher.add(job, item)
+        return job
+
+    def _dispatch_batch(self, task, batch):
+        jobs = [job for job, _ in batch]
+        try:
+            executor = self.start()
+            future = executor.submit(_run_batch, task, [item for _, item in batch],
+                                     [job.enqueued_at for job in jobs])
+        except Exception as e:
+            for job in jobs:
+                self._finish(job, error=e)
+            return
+        future.add_done_callback(lambda f: self._complete(jobs, f, executor))
+
+    def _complete(self, jobs, future, executor):
+        try:
+            outcome = future.result()
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                # A worker died (e.g. out of memory); start a fresh pool on the next submit. Every
+                # future of the broken pool ends up here, so leave a pool started since then alone.
+                with self._lock:
+                    if self._executor is executor:
+                        logger.error("Face worker pool broke, restarting it")
+                        self._executor = None
+                executor.shutdown(wait=False, cancel_futures=True)
+            for job in jobs:
+                self._finish(job, error=e)
+            return
+
+        with self._lock:
+            self.stats['batches'] += 1
+            self.stats['inference_total'] += outcome['inference_seconds']
+            self.stats['inference_max'] = max(self.stats['inference_max'], outcome['inference_seconds'])
+            self.stats['queue_wait_total'] += sum(outcome['queue_waits'])
+            self.stats['queue_wait_max'] = max([self.stats['queue_wait_max']] + outcome['queue_waits'])
+        for job, wait in zip(jobs, outcome['queue_waits']):
+            job.stages = [('queue_wait', wait)]
+        jobs[0].stages += outcome['stages']
+        if self.record_metrics:
+            metrics.observe_stages([timing for job in jobs for timing in job.stages])
+        for job, result in zip(jobs, outcome['results']):
+            self._finish(job, result=result)
+
+    def _finish(self, job, result=None, error=None):
+        job.result = result
+        if error is not None:
+            job.error = str(error) or error.__class__.__name__
+        with self._lock:
+            self.pending -= 1
+            self.stats['failed' if error is not None else 'completed'] += 1
+            if self._callbacks is None:
+                self._callbacks = ThreadPoolExecutor(FACE_CALLBACK_THREADS, thread_name_prefix='face-callback')
+            callbacks = self._callbacks
+        # on_done writes to the database; running it here would hold up the pool's result thread
+        callbacks.submit(_run_callback, job)
+
+    def check_frame(self, image_data, face_crop=False):
+        """Pre-check an upload in this process (see precheck.py); returns (ok, reason)"""
+        return precheck.check_frame(image_data, face_crop, record_metrics=self.record_metrics)
+
+    def normalize_image(self, image_data):
+        """An enrollment upload re-encoded for the face store (see face_store.normalize)"""
+        return face_store.normalize(image_data)
+
+    def status(self):
+        """Queue depth, timings, pre-check rejections and the face engine status of each worker"""
+        with self._lock:
+            stats = dict(self.stats)
+            pending = self.pending
+        completed = stats['completed']
+        average_inference = stats['inference_total'] / completed if completed else None
+        return {
+            'ready': bool(self.engines),
+            'workers': self.max_workers,
+            'max_pending': self.max_pending,
+            'pending': pending,
+            'batch_size': FACE_BATCH_SIZE,
+            'batch_wait_ms': FACE_BATCH_WAIT_MS,
+            'avg_batch_size': completed / stats['batches'] if stats['batches'] else None,
+            'avg_queue_wait': stats['queue_wait_total'] / completed if completed else None,
+            'avg_inference_seconds': average_inference,
+            'stats': stats,
+            'engines': list(self.engines.values()),
+            'precheck': precheck.status(average_inference),
+        }
+
+
+class ServiceManager(BaseManager):
+    """Serves the inference service's VerificationPool to the web workers"""
+
+
+class InferenceService:
+    """What the web workers call in the inference service process.
+
+    Results are kept per client (web worker) until it collects them with
+    take_finished(), so a job's outcome reaches the worker that submitted it.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self._finished = {}
+        self._lock = threading.Lock()
+
+    def _results(self, client_id):
+        with self._lock:
+            return self._finished.setdefault(client_id, queue.Queue())
+
+    def submit(self, client_id, job_id, task, args, batched=False):
+        results = self._results(client_id)
+        on_done = lambda job: results.put((job.id, job.result, job.error, job.stages))
+        if batched:
+            self.pool.submit_batched(task, args[0], on_done=on_done, job_id=job_id)
+        else:
+            self.pool.submit(task, *args, on_done=on_done, job_id=job_id)
+
+    def take_finished(self, client_id, timeout):
+        """(job id, result, error, stages) of the client's finished jobs, waiting up to timeout for one"""
+        results = self._results(client_id)
+        try:
+            finished = [results.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                finished.append(results.get_nowait())
+            except queue.Empty:
+                return finished
+
+    def pending(self):
+        return self.pool.pending
+
+    def backlog_seconds(self):
+        return self.pool.backlog_seconds()
+
+    def check_frame(self, image_data, face_crop):
+        """(ok, reason, seconds); the web worker records the pre-check time in its metrics"""
+        start = time.perf_counter()
+        ok, reason = self.pool.check_frame(image_data, face_crop)
+        return ok, reason, time.perf_counter() - start
+
+    def normalize_image(self, image_data):
+        return self.pool.normalize_image(image_data)
+
+    def retry_after(self):
+        return self.pool.retry_after()
+
+    def status(self):
+        return self.pool.status()
+
+
+def _address(address):
+    # "host:port" for TCP, anything else is a Unix socket path
+    host, _, port = address.rpartition(':')
+    return (host, int(port)) if host and port.isdigit() else address
+
+
+def serve(address=FACE_SERVICE_ADDRESS, authkey=FACE_SERVICE_AUTHKEY, parent_pid=None):
+    """Run the inference service until the parent process (the gunicorn master) goes away"""
+    service_pool = VerificationPool(record_metrics=False)
+    service_pool.start()
+    service = InferenceService(service_pool)
+    ServiceManager.register('service', callable=lambda: service)
+    server = ServiceManager(address=_address(address), authkey=authkey.encode()).get_server()
+
+    def stop(*_):
+        # Take the inference processes (and their models) down with the service
+        for child in multiprocessing.active_children():
+            child.terminate()
+        os._exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    if parent_pid:
+        def watch_parent():
+            while os.getppid() == parent_pid:
+                time.sleep(1)
+            stop()
+        threading.Thread(target=watch_parent, name='parent-watch', daemon=True).start()
+    server.serve_forever()
+
+
+def start_service(address=FACE_SERVICE_ADDRESS, authkey=FACE_SERVICE_AUTHKEY, timeout=60):
+    """Start the inference service process and wait until it accepts connections"""
+    if os.path.exists(address):
+        os.remove(address)
+    process = multiprocessing.get_context('spawn').Process(
+        target=serve, args=(address, authkey, os.getpid()), name='face-inference-service')
+    process.start()
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            ServiceManager(address=_address(address), authkey=authkey.encode()).connect()
+            return process
+        except (OSError, EOFError):
+            if not process.is_alive() or time.monotonic() > deadline:
+                process.terminate()
+                raise RuntimeError(f"Face inference service did not start on {address}")
+            time.sleep(0.1)
+
+
+class RemotePool:
+    """The inference service as seen from a web worker; the same interface as VerificationPool.
+
+    A collector thread picks up the results of this worker's jobs and runs
+    their on_done callbacks on a small thread pool.
+    """
+
+    def __init__(self, address=FACE_SERVICE_ADDRESS, authkey=FACE_SERVICE_AUTHKEY):
+        self.address = address
+        self.authkey = authkey
+        self.max_workers = FACE_WORKERS
+        self.max_pending = FACE_MAX_PENDING
+        self._service = None
+        self._pid = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Connect to the service; a forked web worker connects again with its own client id"""
+        with self._lock:
+            if self._service is None or self._pid != os.getpid():
+                ServiceManager.register('service')
+                manager = ServiceManager(address=_address(self.address), authkey=self.authkey.encode())
+                manager.connect()
+                self._service = manager.service()
+                self._pid = os.getpid()
+                self.client_id = f"{os.getpid()}-{uuid.uuid4().hex}"
+                self._jobs = {}
+                self._callbacks = ThreadPoolExecutor(FACE_CALLBACK_THREADS, thread_name_prefix='face-callback')
+                threading.Thread(target=self._collect, args=(self._service, self.client_id),
+                                 name='face-results', daemon=True).start()
+            return self._service
+
+    def shutdown(self):
+        with self._lock:
+            self._service = None
+
+    def _submit(self, task, args, batched, on_done):
+        service = self.start()
+        job = Job(on_done)
+        with self._lock:
+            self._jobs[job.id] = job
+        try:
+            service.submit(self.client_id, job.id, task, args, batched)
+        except Exception:
+            with self._lock:
+                self._jobs.pop(job.id, None)
+            raise
+        return job
+
+    def submit(self, task, *args, on_done=None):
+        return self._submit(task, args, False, on_done)
+
+    def submit_batched(self, task, item, on_done=None):
+        return self._submit(task, (item,), True, on_done)
+
+    def _collect(self, service, client_id):
+        while self._service is service:
+            try:
+                finished = service.take_finished(client_id, 1.0)
+            except Exception as e:
+                logger.error(f"Lost the connection to the face inference service ({e!r}), retrying")
+                time.sleep(1)
+                continue
+            for job_id, result, error, stages in finished:
+                with self._lock:
+                    job = self._jobs.pop(job_id, None)
+                if job is None:
+                    continue
+                job.result, job.error = result, error
+                metrics.observe_stages(stages)
+                self._callbacks.submit(_run_callback, job)
+
+    @property
+    def pending(self):
+        return self.start().pending()
+
+    def backlog_seconds(self):
+        return self.start().backlog_seconds()
+
+    def check_frame(self, image_data, face_crop=False):
+        if not precheck.PRECHECK_ENABLED:
+            return True, None
+        ok, reason, seconds = self.start().check_frame(image_data, face_crop)
+        metrics.observe_stages([('precheck', seconds)])
+        return ok, reason
+
+    def normalize_image(self, image_data):
+        return self.start().normalize_image(image_data)
+
+    def retry_after(self):
+        return self.start().retry_after()
+
+    def status(self):
+        status = self.start().status()
+        status['service'] = self.address
+        return status
+
+
+# The shared inference service when gunicorn started one, otherwise a pool in this process
+pool = RemotePool() if FACE_SERVICE_ADDRESS else VerificationPool()